@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+bench_bc_import.py – startup cost of the blockchain handler module.
+
+Each sample runs in a fresh interpreter so module caches do not hide the cost.
+It reports:
+  import  – `import handlers.bc_handlers` (what every peer now pays)
+  init    – import followed by `chain.init()`, which is what the old module
+            did at import time (dotenv, Web3 provider, is_connected, ABI and
+            address files)
+
+Usage: python benchmarks/bench_bc_import.py [--runs N]
+"""
+
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+IMPORT_ONLY = """
+import time
+t0 = time.perf_counter()
+import handlers.bc_handlers
+print(time.perf_counter() - t0)
+"""
+
+IMPORT_AND_INIT = """
+import time
+t0 = time.perf_counter()
+import handlers.bc_handlers as bc
+try:
+    bc.chain.init()
+except Exception as e:
+    import sys
+    print(f"init failed: {e}", file=sys.stderr)
+print(time.perf_counter() - t0)
+"""
+
+
+def _sample(code: str) -> float | None:
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.strip(), file=sys.stderr)
+        return None
+    if proc.stderr.strip():
+        print(proc.stderr.strip(), file=sys.stderr)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def _report(label: str, samples: list[float]) -> None:
+    if not samples:
+        print(f"{label:8s} no successful runs")
+        return
+    ms = [s * 1000 for s in samples]
+    print(f"{label:8s} median {statistics.median(ms):8.2f} ms   "
+          f"min {min(ms):8.2f} ms   max {max(ms):8.2f} ms   (n={len(ms)})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    imports = [s for s in (_sample(IMPORT_ONLY) for _ in range(args.runs)) if s is not None]
+    inits = [s for s in (_sample(IMPORT_AND_INIT) for _ in range(args.runs)) if s is not None]
+
+    _report("import", imports)
+    _report("init", inits)
+
+
+if __name__ == "__main__":
+    main()
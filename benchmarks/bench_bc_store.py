@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+bench_bc_store.py – RPC round trips and latency per STORE against a local node.
+
+Start Hardhat and deploy the contract first (see README), then:
+
+    python benchmarks/bench_bc_store.py --stores 50
+    RPC_BATCH=0 python benchmarks/bench_bc_store.py --stores 50   # unbatched
+
+Round trips are counted at the HTTP session, so they are only reported for
+http:// RPC URLs.
+"""
+
+import argparse
+import pathlib
+import statistics
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import requests
+
+from handlers.bc_handlers import StringChainClient
+from handlers.bc_provider import ProviderConfig, make_session
+
+
+class CountingSession(requests.Session):
+    """Pooled session that counts HTTP round trips to the node."""
+
+    def __init__(self, pool_size: int):
+        super().__init__()
+        pooled = make_session(pool_size)
+        for prefix, adapter in pooled.adapters.items():
+            self.mount(prefix, adapter)
+        self.round_trips = 0
+
+    def request(self, *args, **kwargs):
+        self.round_trips += 1
+        return super().request(*args, **kwargs)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="STORE round trips and latency")
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    args = parser.parse_args()
+
+    config = ProviderConfig.from_env()
+    session = CountingSession(config.pool_size) if config.scheme == "http" else None
+    client = StringChainClient(session=session).init()
+    payload = "x" * args.payload_bytes
+
+    client.add(payload)                   # warm up connection and caches
+    trips_before = session.round_trips if session else 0
+
+    latencies = []
+    for _ in range(args.stores):
+        t0 = time.perf_counter()
+        client.add(payload)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    print(f"provider   {config.scheme} ({config.rpc_url}), batch={config.batch}")
+    print(f"stores     {args.stores} × {args.payload_bytes} B")
+    if session:
+        trips = session.round_trips - trips_before
+        print(f"round trips/STORE  {trips / args.stores:.2f}")
+    print(f"latency ms  p50 {statistics.median(latencies):.2f}   "
+          f"p99 {_percentile(latencies, 99):.2f}   mean {statistics.mean(latencies):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+bench_cluster.py – end-to-end latency and throughput of a local cluster.
+
+Runs a whole cluster on one box, with stand-ins for every external service:
+- discovery      the single-host registry (DISCOVERY=local)
+- object store   a temporary directory (OBJECT_STORE_URL=file://...)
+- inference API  a stub /predict server in this process (ML_PREDICT_URL)
+                 answering after --predict-latency seconds
+- IoT sensors    the synthetic feed (IOT_FEED=synthetic)
+- blockchain     the in-memory chain (BC_BACKEND=memory), each transaction
+                 confirmed after --block-time seconds
+
+One BC, IoT and ML peer run as `peer.py --headless` under start_peers.py's
+launcher; the web app runs in this process. For PING, IORQ, BCRQ STORE,
+BCRQ FETCH, MLRQ and /submit (timed until the job's result is stored) it
+prints throughput and p50/p99 latency. An operation whose peer did not
+start is skipped. For example, the ML peer and the synthetic video both
+need OpenCV.
+
+Usage: python benchmarks/bench_cluster.py [--requests 200] [--concurrency 8]
+       [--ml-requests 10] [--frames 30] [--predict-latency 0.01]
+       [--block-time 0] [--base-port 19000] [--only PING,IORQ,...]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+HOST = "127.0.0.1"
+DRUMS = ("snare", "kick", "hihat", "tom", "crash")
+OPERATIONS = ("PING", "IORQ", "BCRQ STORE", "BCRQ FETCH", "MLRQ", "/submit")
+
+
+# ---- stand-ins ----
+class _PredictHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        body = json.dumps({"summary": [{"hit_drum": random.choice(DRUMS)}
+                                       for _ in range(random.randint(0, 2))]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_predict(port: int, latency: float) -> ThreadingHTTPServer:
+    """Serve a fake inference API at http://HOST:<port>/predict."""
+    handler = type("PredictHandler", (_PredictHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((HOST, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_video(path: pathlib.Path, frames: int) -> bool:
+    """Write a small synthetic video; False without OpenCV."""
+    try:
+        import cv2
+        import numpy as np
+    except ImportError:
+        return False
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 30, (64, 64))
+    for i in range(frames):
+        writer.write(np.full((64, 64, 3), i % 256, dtype=np.uint8))
+    writer.release()
+    return True
+
+
+# ---- measurement ----
+def measure(name: str, op, n: int, concurrency: int) -> None:
+    """Run op(i) for i in range(n) on *concurrency* threads and print a row."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def _one(i):
+        t0 = time.perf_counter()
+        try:
+            op(i)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_one, range(n)))
+    wall = time.perf_counter() - t0
+
+    lat = sorted(latencies)
+    pct = [lat[min(int(q * len(lat)), len(lat) - 1)] * 1000 if lat else 0.0 for q in (0.5, 0.99)]
+    print(f"{name:12}{len(lat):>6}{len(errors):>6}{len(lat) / wall:>10.1f}{pct[0]:>10.1f}{pct[1]:>10.1f}")
+    if errors:
+        print(f"{'':12}first error: {errors[0]!r}")
+
+
+def expect(replies, msgtype: str) -> str:
+    for t, d in replies:
+        if t == msgtype:
+            return d
+    raise RuntimeError(f"no {msgtype} in {replies!r}")
+
+
+# ---- main ----
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local end-to-end cluster benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="per peer operation")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ml-requests", type=int, default=10, help="for MLRQ and /submit")
+    parser.add_argument("--frames", type=int, default=30, help="frames in the synthetic video")
+    parser.add_argument("--predict-latency", type=float, default=0.01)
+    parser.add_argument("--block-time", type=float, default=0.0)
+    parser.add_argument("--base-port", type=int, default=19000)
+    parser.add_argument("--only", help="comma-separated operations to run (default: all)")
+    args = parser.parse_args()
+    only = set(args.only.split(",")) if args.only else set(OPERATIONS)
+
+    work = pathlib.Path(tempfile.mkdtemp(prefix="bench-cluster-"))
+    port = args.base_port
+    env = {
+        "DISCOVERY": "local",
+        "DISCOVERY_FILE": str(work / "peers.json"),
+        "OBJECT_STORE_URL": (work / "store").as_uri(),
+        "ML_PREDICT_URL": f"http://{HOST}:{port + 7}/predict",
+        "IOT_FEED": "synthetic",
+        "BC_BACKEND": "memory",
+        "BC_MEMORY_BLOCK_TIME": str(args.block_time),
+        "BC_BLOB_DIR": str(work / "blobs"),
+        "RESULTS_DB": str(work / "results.db"),
+        "WEB_PEER_PORT": str(port + 5),
+        "LOG_LEVEL": "WARNING",
+    }
+    os.environ.update(env)      # this process runs the client and the web app
+
+    # imported after the environment is set up
+    import start_peers
+    from bt_utils import direct_router_factory, find_peer_for_service, init_dht
+    from btpeer import BTPeer
+
+    start_stub_predict(port + 7, args.predict_latency)
+    cluster = start_peers.Cluster(start_peers.make_peers({
+        "env": env, "maxpeers": 10,
+        "peers": [{"type": "BC", "port": port + 1}, {"type": "IOT", "port": port + 2},
+                  {"type": "ML", "port": port + 3}],
+    }), max_restarts=0)
+    cluster.start()
+
+    web = None
+    try:
+        client = BTPeer(maxpeers=0, serverport=port + 4, peertype="BENCH", serverhost=HOST)
+        threading.Thread(target=client.mainloop, daemon=True).start()
+        kad, loop = init_dht(client)
+        client.add_router(direct_router_factory(client, kad, loop))
+        ready = {p.peertype for p in cluster.peers if p.ready.is_set()}
+        target = {t: find_peer_for_service(kad, loop, t) for t in ("BC", "IOT", "ML") if t in ready}
+
+        video = work / "store" / "bench.mp4"
+        video.parent.mkdir(parents=True, exist_ok=True)
+        have_video = make_video(video, args.frames)
+
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        iot_range = f"{(now - datetime.timedelta(minutes=1)).isoformat()}|{now.isoformat()}"
+
+        def send(peertype, msgtype, msgdata, **kwargs):
+            return client.send_to_peer(target[peertype], msgtype, msgdata, keepalive=True,
+                                       raise_errors=True, **kwargs)
+
+        def store(i):
+            reply = json.loads(expect(send("BC", "BCRQ", f"STORE bench-{i}", idempotency_key=uuid.uuid4().hex),
+                                      "BCRS"))
+            if reply.get("type") == "ERR":
+                raise RuntimeError(reply.get("msg"))
+
+        ops = {
+            "PING": ("BC", lambda i: expect(send("BC", "PING", "x"), "PONG")),
+            "IORQ": ("IOT", lambda i: json.loads(expect(send("IOT", "IORQ", iot_range), "IORS"))),
+            "BCRQ STORE": ("BC", store),
+            "BCRQ FETCH": ("BC", lambda i: expect(send("BC", "BCRQ", "FETCH"), "BCRS")),
+            "MLRQ": ("ML", lambda i: expect(send("ML", "MLRQ", video.as_uri(), idempotency_key=uuid.uuid4().hex,
+                                                 timeout=600), "MLRS")),
+        }
+
+        print(f"{'':12}{'ok':>6}{'err':>6}{'req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+        for name, (peertype, op) in ops.items():
+            if name not in only:
+                continue
+            if peertype not in target or (name == "MLRQ" and not have_video):
+                print(f"{name:12}skipped: {'no video (OpenCV missing)' if peertype in target else f'{peertype} peer not running'}")
+                continue
+            n = args.ml_requests if name == "MLRQ" else args.requests
+            measure(name, op, n, args.concurrency)
+
+        if "/submit" in only:
+            if "ML" not in target or "IOT" not in target or not have_video:
+                print(f"{'/submit':12}skipped: needs the ML and IoT peers and a video")
+            else:
+                web = submit_benchmark(args, port, video.read_bytes(), now)
+    finally:
+        cluster.stop()
+        if web is not None:
+            web.close()
+
+
+def submit_benchmark(args, port: int, video: bytes, now: datetime.datetime):
+    """Time /submit until the job is stored, against the app in this process."""
+    from werkzeug.serving import make_server
+
+    from bench_webapp_load import multipart
+    from webapp.app import app
+    from webapp.jobs import TERMINAL_STATES, get_job_manager
+
+    manager = get_job_manager()        # start the web peer before timing anything
+    server = make_server(HOST, port + 6, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://{HOST}:{port + 6}"
+    fields = {"start_time": (now - datetime.timedelta(minutes=1)).isoformat(), "end_time": now.isoformat()}
+
+    def submit(i):
+        body, ctype = multipart(fields, {"video": (f"bench-{i}.mp4", video)})
+        req = urllib.request.Request(f"{base}/submit", data=body, headers={"Content-Type": ctype})
+        with urllib.request.urlopen(req) as resp:
+            result_id = resp.headers["Set-Cookie"].split("result_id=")[1].split(";")[0]
+        while True:
+            with urllib.request.urlopen(f"{base}/api/jobs/{result_id}") as resp:
+                job = json.load(resp)
+            if job["state"] in TERMINAL_STATES:
+                if job["state"] != "stored":
+                    raise RuntimeError(job["error"])
+                return
+            time.sleep(0.02)
+
+    measure("/submit", submit, args.ml_requests, args.concurrency)
+    server.shutdown()
+    return manager.web
+
+
+if __name__ == "__main__":
+    main()
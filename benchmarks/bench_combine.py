@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+bench_combine.py – vectorised vs reference combine_and_analyze.
+
+Generates a synthetic session (default 1 hour of 100 Hz IoT readings plus
+ML hits for every second), checks that both implementations produce the
+same result, and reports their run times.
+
+Usage: python benchmarks/bench_combine.py [--seconds 3600] [--hz 100]
+"""
+
+import argparse
+import contextlib
+import io
+import math
+import pathlib
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from webapp.analysis import combine_and_analyze, combine_and_analyze_py
+
+DRUMS = ["snare", "kick", "hihat", "tom1", "tom2", "crash", "ride"]
+
+
+def make_session(seconds: int, hz: int, seed: int = 0):
+    rng = random.Random(seed)
+    start = datetime(2025, 5, 1, 12, 0, 0, tzinfo=timezone.utc)
+    step = timedelta(seconds=1 / hz)
+    iot = []
+    for i in range(seconds * hz):
+        ts = start + i * step
+        iot.append({
+            "timestamp": ts.strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z",
+            "room_noise (db)": round(rng.uniform(40, 90), 2),
+            "vibration_level": rng.randint(0, 100),
+        })
+    per_second = {}
+    for sec in range(seconds + 5):           # a few seconds with no IoT data
+        if rng.random() < 0.9:
+            per_second[str(sec)] = {d: rng.randint(1, 6) for d in rng.sample(DRUMS, 3)}
+    return iot, {"total_hits": {}, "per_second_hits": per_second}
+
+
+def assert_equivalent(expected: dict, actual: dict) -> None:
+    assert expected.keys() == actual.keys(), "second keys differ"
+    for sec, want in expected.items():
+        got = actual[sec]
+        assert want["hits"] == got["hits"], f"hits differ at {sec}"
+        assert want["warning"] == got["warning"], f"warning differs at {sec}"
+        for field in ("volume", "vibration"):
+            if want[field] is None or got[field] is None:
+                assert want[field] is got[field], f"{field} differs at {sec}"
+            else:
+                assert math.isclose(want[field], got[field], rel_tol=1e-12), f"{field} differs at {sec}"
+
+
+def timed(fn, *args, repeat: int):
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="combine_and_analyze benchmark")
+    parser.add_argument("--seconds", type=int, default=3600)
+    parser.add_argument("--hz", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    iot, ml = make_session(args.seconds, args.hz)
+    print(f"session: {args.seconds}s × {args.hz} Hz = {len(iot)} IoT entries, "
+          f"{len(ml['per_second_hits'])} ML seconds")
+
+    reference, t_ref = timed(combine_and_analyze_py, iot, ml, repeat=args.repeat)
+    vectorised, t_vec = timed(combine_and_analyze, iot, ml, repeat=args.repeat)
+    assert_equivalent(reference, vectorised)
+
+    # non-UTC timestamps take the reference fallback and must still agree
+    shifted = [dict(e, timestamp=e["timestamp"][:-1] + "+02:00") for e in iot[:1000]]
+    assert_equivalent(combine_and_analyze_py(shifted, ml), combine_and_analyze(shifted, ml))
+
+    print("equivalence: OK")
+    print(f"reference  {t_ref * 1000:9.1f} ms")
+    print(f"vectorised {t_vec * 1000:9.1f} ms   ({t_ref / t_vec:.1f}× faster)")
+
+
+if __name__ == "__main__":
+    main()
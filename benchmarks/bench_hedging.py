@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+bench_hedging.py – tail latency of read requests with and without hedging.
+
+Starts two in-process IoT stand-ins answering IORQ: the first is usually
+fast but stalls on a small share of requests, the second is always fast.
+Sends the same requests through bt_utils.hedged_request with hedging on
+and off and prints latency percentiles.
+
+Usage: python benchmarks/bench_hedging.py [--requests 300] [--slow-share 0.03] [--stall 1.0]
+"""
+
+import argparse
+import pathlib
+import random
+import sys
+import threading
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import bt_utils
+from btpeer import BTPeer
+
+HOST = "127.0.0.1"
+
+
+def start_server(port: int, slow_share: float, stall: float) -> BTPeer:
+    server = BTPeer(maxpeers=0, serverport=port, peertype="IOT", serverhost=HOST)
+
+    def handle(conn, data):
+        time.sleep(stall if random.random() < slow_share else 0.002)
+        conn.senddata("IORS", "[]")
+
+    server.add_handler("IORQ", handle)
+    threading.Thread(target=server.mainloop, daemon=True).start()
+    server.ready.wait()
+    return server
+
+
+def run(client: BTPeer, targets: list[str], n: int, hedge: bool) -> list[float]:
+    bt_utils.HEDGE_ENABLED = hedge
+    op = "hedged" if hedge else "single"
+    lat = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        bt_utils.hedged_request(client, targets, "IORQ", "0|1", bt_utils._parse_iot_reply,
+                                timeout=30, op=op)
+        lat.append(time.perf_counter() - t0)
+    return sorted(lat)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hedged request benchmark")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--slow-share", type=float, default=0.03)
+    parser.add_argument("--stall", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=18750)
+    args = parser.parse_args()
+
+    flaky = start_server(args.port, args.slow_share, args.stall)
+    steady = start_server(args.port + 1, 0.0, 0.0)
+    client = BTPeer(maxpeers=0, serverport=args.port + 2, peertype="BENCH", serverhost=HOST)
+    for server in (flaky, steady):
+        client.add_peer(server.myid, HOST, server.serverport, "IOT")
+    targets = [flaky.myid, steady.myid]
+
+    print(f"{'':8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}")
+    for name, hedge in (("single", False), ("hedged", True)):
+        lat = run(client, targets, args.requests, hedge)
+        pct = [lat[min(int(q * len(lat)), len(lat) - 1)] * 1000 for q in (0.5, 0.95, 0.99)]
+        print(f"{name:8}" + "".join(f"{v:10.1f}" for v in pct) + f"{lat[-1] * 1000:10.1f}")
+    flaky.shutdown = steady.shutdown = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+bench_results_store.py – SQLite results store vs the old JSON files.
+
+Saves a synthetic session (default 2 hours) both as an indented JSON file,
+as results used to be stored, and into the SQLite store, then compares
+size on disk, save time, full load time and the time to read one page.
+
+Usage: python benchmarks/bench_results_store.py [--seconds 7200] [--page 300]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.bench_combine import make_session
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="results store benchmark")
+    parser.add_argument("--seconds", type=int, default=7200)
+    parser.add_argument("--page", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-results-")
+    os.environ["RESULTS_DB"] = os.path.join(workdir, "results.db")
+    os.environ["RESULTS_CACHE_SIZE"] = "0"         # measure the store, not the cache
+    from webapp import results
+    from webapp.analysis import combine_and_analyze
+
+    iot, ml = make_session(args.seconds, 10)
+    data = combine_and_analyze(iot, ml)
+    print(f"session: {len(data)} analysed seconds")
+
+    json_path = os.path.join(workdir, "legacy.json")
+
+    def save_json():
+        with open(json_path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def load_json():
+        with open(json_path) as f:
+            return json.load(f)
+
+    _, t_json_save = timed(save_json)
+    _, t_db_save = timed(results.save_result, "bench", data)
+    _, t_json_load = timed(load_json)
+    loaded, t_db_load = timed(results.load_result, "bench")
+    assert loaded == json.loads(json.dumps(data)), "round trip differs"
+    mid = len(data) // 2
+    _, t_json_page = timed(lambda: list(load_json().items())[mid:mid + args.page])
+    _, t_db_page = timed(results.load_window, "bench", mid, args.page)
+
+    db_size = sum(os.path.getsize(p) for p in pathlib.Path(workdir).glob("results.db*"))
+    print(f"{'':12}{'JSON':>12}{'SQLite':>12}")
+    print(f"{'size (KiB)':12}{os.path.getsize(json_path) / 1024:12.0f}{db_size / 1024:12.0f}")
+    print(f"{'save (ms)':12}{t_json_save:12.1f}{t_db_save:12.1f}")
+    print(f"{'load (ms)':12}{t_json_load:12.1f}{t_db_load:12.1f}")
+    print(f"{'page (ms)':12}{t_json_page:12.1f}{t_db_page:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
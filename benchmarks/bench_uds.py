@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+bench_uds.py – btpeer over TCP loopback vs Unix domain sockets.
+
+Starts one peer in-process and measures, for each transport, the round-trip
+latency of small keep-alive requests and the throughput of large replies
+(the size of a big FETCH or IORS payload).
+
+Usage: python benchmarks/bench_uds.py [--small 2000] [--large-mb 8] [--large-count 20]
+"""
+
+import argparse
+import pathlib
+import statistics
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from btpeer import BTPeer
+
+HOST = "127.0.0.1"
+
+
+def start_server(port: int, payload: str) -> BTPeer:
+    server = BTPeer(maxpeers=0, serverport=port, peertype="BENCH", serverhost=HOST)
+    server.add_handler("PING", lambda conn, data: conn.senddata("PONG", data))
+    server.add_handler("BLOB", lambda conn, data: conn.senddata("BLOB", payload))
+    import threading
+    threading.Thread(target=server.mainloop, daemon=True).start()
+    return server
+
+
+def make_client(server: BTPeer, uds: bool) -> BTPeer:
+    client = BTPeer(maxpeers=0, serverport=server.serverport + 1, peertype="BENCH", serverhost=HOST)
+    client.add_peer(server.myid, HOST, server.serverport, "BENCH",
+                    uds=server.uds_path if uds else None)
+    client.add_router(lambda pid: (pid, *client.peers[pid][:2]))
+    return client
+
+
+def bench(client: BTPeer, pid: str, small: int, large_count: int, large_bytes: int) -> tuple[float, float]:
+    for _ in range(50):                                 # warm the pool
+        client.send_to_peer(pid, "PING", "x", keepalive=True)
+    lat = []
+    for _ in range(small):
+        t0 = time.perf_counter()
+        client.send_to_peer(pid, "PING", "x", keepalive=True)
+        lat.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for _ in range(large_count):
+        replies = client.send_to_peer(pid, "BLOB", "", keepalive=True)
+        assert len(replies[0][1]) == large_bytes, "short reply"
+    mbps = large_count * large_bytes / (time.perf_counter() - t0) / 1e6
+    return statistics.median(lat) * 1e6, mbps
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="btpeer TCP vs Unix socket benchmark")
+    parser.add_argument("--small", type=int, default=2000)
+    parser.add_argument("--large-mb", type=int, default=8)
+    parser.add_argument("--large-count", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18700)
+    args = parser.parse_args()
+
+    large_bytes = args.large_mb * 1024 * 1024
+    server = start_server(args.port, "x" * large_bytes)
+    if not server.uds_path:
+        sys.exit("Unix sockets are disabled (BTPEER_UDS=0)")
+    time.sleep(0.2)
+
+    print(f"{'':6}{'p50 latency (µs)':>18}{'large replies (MB/s)':>22}")
+    for name, uds in (("tcp", False), ("uds", True)):
+        client = make_client(server, uds)
+        p50, mbps = bench(client, server.myid, args.small, args.large_count, large_bytes)
+        client.connpool.close_all()
+        print(f"{name:6}{p50:18.1f}{mbps:22.1f}")
+    server.shutdown = True
+
+
+if __name__ == "__main__":
+    main()
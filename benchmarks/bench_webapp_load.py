@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+bench_webapp_load.py – throughput of /submit and /results on a running web app.
+
+Start the app first, e.g. with a local object store so uploads stay on disk:
+
+    OBJECT_STORE_URL=file:///tmp/drum-store gunicorn -c webapp/gunicorn.conf.py
+
+then run N concurrent clients against it. Each /submit uploads a synthetic
+video; each /results request reuses a result id returned by /submit (or the
+one given with --result-id, to measure rendering of a finished result).
+503 answers (queue full) are counted separately from errors.
+
+Usage: python benchmarks/bench_webapp_load.py [--url http://127.0.0.1:8000]
+       [--concurrency 16] [--requests 200] [--size-kb 1024] [--result-id ID]
+"""
+
+import argparse
+import collections
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def multipart(fields: dict, files: dict) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                     f'filename="{filename}"\r\nContent-Type: video/mp4\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.codes: collections.Counter = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, code, seconds: float) -> None:
+        with self._lock:
+            self.codes[code] += 1
+            self.latencies.append(seconds)
+
+    def report(self, name: str, wall: float) -> None:
+        lat = sorted(self.latencies)
+        p95 = lat[int(len(lat) * 0.95) - 1] if lat else 0
+        print(f"{name:8} {len(lat) / wall:8.1f} req/s   p50 {statistics.median(lat) * 1000:7.1f} ms   "
+              f"p95 {p95 * 1000:7.1f} ms   {dict(self.codes)}")
+
+
+def timed_request(stats: Stats, req: urllib.request.Request):
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            resp.read()
+            stats.record(resp.status, time.perf_counter() - t0)
+            return resp
+    except urllib.error.HTTPError as e:
+        stats.record(e.code, time.perf_counter() - t0)
+    except OSError as e:
+        stats.record(type(e).__name__, time.perf_counter() - t0)
+    return None
+
+
+def run_phase(name: str, count: int, concurrency: int, fn) -> list:
+    stats = Stats()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        out = list(pool.map(lambda i: fn(stats, i), range(count)))
+    stats.report(name, time.perf_counter() - t0)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="web app load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--result-id", help="finished result to request in the /results phase")
+    args = parser.parse_args()
+
+    video = os.urandom(args.size_kb * 1024)
+    body, content_type = multipart(
+        {"start_time": "2025-05-01T12:00:00Z", "end_time": "2025-05-01T12:05:00Z"},
+        {"video": ("bench.mp4", video)},
+    )
+    print(f"{args.requests} requests per phase, {args.concurrency} clients, "
+          f"{args.size_kb} KiB uploads → {args.url}")
+
+    def submit(stats, _):
+        req = urllib.request.Request(f"{args.url}/submit", data=body,
+                                     headers={"Content-Type": content_type})
+        resp = timed_request(stats, req)
+        cookie = resp.headers.get("Set-Cookie", "") if resp else ""
+        return cookie.split(";", 1)[0].removeprefix("result_id=") or None
+
+    ids = [i for i in run_phase("/submit", args.requests, args.concurrency, submit) if i]
+    if args.result_id:
+        ids = [args.result_id]
+    if not ids:
+        print("no result ids to query; skipping /results")
+        return
+
+    def results(stats, i):
+        req = urllib.request.Request(f"{args.url}/results",
+                                     headers={"Cookie": f"result_id={ids[i % len(ids)]}"})
+        timed_request(stats, req)
+
+    run_phase("/results", args.requests, args.concurrency, results)
+
+
+if __name__ == "__main__":
+    main()
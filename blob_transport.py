@@ -0,0 +1,193 @@
+# blob_transport.py
+"""
+How a video gets from the requesting peer to the ML peer.
+
+The requester *offers* an object it holds and sends the ML peer a URL; the
+ML peer *fetches* that URL into a local file it can decode.
+
+- ObjectStoreTransport – the object lives in an object store (GCS, or a local
+                         directory); the URL is its public/file:// URL.
+- P2PTransport         – the object lives on the requester's disk and is
+                         streamed directly to the ML peer over a side-channel
+                         TCP socket with sendfile(); no cloud round trip.
+                         URL form: p2p://<host>:<port>/<token>
+
+`get_blob_transport()` picks one from BLOB_TRANSPORT ("object" or "p2p").
+With "p2p", uploads are spooled under P2P_SPOOL_DIR (default "uploads").
+"""
+
+import contextlib
+import os
+import secrets
+import socket
+import struct
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+from object_store import LocalObjectStore, ObjectStore, get_object_store
+
+RECV_CHUNK = 1024 * 1024
+SIZE_HEADER = struct.Struct("!Q")
+TOKEN_BYTES = 16
+
+
+@dataclass
+class Offer:
+    url: str
+    release: Callable[[], None]     # call once the ML peer is done with it
+
+
+class BlobTransport:
+    """Requester side: turns a stored object into a URL for the ML peer."""
+
+    store: ObjectStore              # where uploads for this transport go
+
+    def offer(self, peer, name: str) -> Offer:
+        raise NotImplementedError
+
+
+class ObjectStoreTransport(BlobTransport):
+    def __init__(self, store: ObjectStore):
+        self.store = store
+
+    def offer(self, peer, name: str) -> Offer:
+        return Offer(self.store.public_url(name), lambda: self.store.delete(name))
+
+
+# ---- direct peer-to-peer transfer ----
+class BlobServer:
+    """Side-channel listener serving registered files to ML peers.
+
+    Protocol: the client sends the token followed by a newline; the server
+    answers with the file size (8-byte big-endian) and the raw bytes.
+    """
+
+    def __init__(self, host: str = ""):
+        self._files: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, name="blob-server", daemon=True).start()
+
+    def register(self, path: str) -> str:
+        token = secrets.token_hex(TOKEN_BYTES)
+        with self._lock:
+            self._files[token] = path
+        return token
+
+    def unregister(self, token: str) -> None:
+        with self._lock:
+            self._files.pop(token, None)
+
+    def _serve(self) -> None:
+        while True:
+            client, _ = self._sock.accept()
+            threading.Thread(target=self._send, args=(client,), daemon=True).start()
+
+    def _send(self, client: socket.socket) -> None:
+        with client:
+            client.settimeout(30)
+            token = client.makefile("rb").readline(2 * TOKEN_BYTES + 2).strip().decode()
+            with self._lock:
+                path = self._files.get(token)
+            if path is None:
+                return
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                client.sendall(SIZE_HEADER.pack(size))
+                client.sendfile(f)
+
+
+class P2PTransport(BlobTransport):
+    def __init__(self, spool_dir: str):
+        self.store = LocalObjectStore(spool_dir)
+        self._server: BlobServer | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def server(self) -> BlobServer:
+        with self._lock:
+            if self._server is None:
+                self._server = BlobServer()
+            return self._server
+
+    def offer(self, peer, name: str) -> Offer:
+        token = self.server.register(str(self.store.path(name)))
+
+        def release():
+            self.server.unregister(token)
+            self.store.delete(name)
+
+        return Offer(f"p2p://{peer.serverhost}:{self.server.port}/{token}", release)
+
+
+def _receive_p2p(url: str, dest) -> None:
+    parsed = urllib.parse.urlparse(url)
+    token = parsed.path.lstrip("/")
+    with socket.create_connection((parsed.hostname, parsed.port), timeout=30) as s:
+        s.sendall(token.encode() + b"\n")
+        header = s.recv(SIZE_HEADER.size, socket.MSG_WAITALL)
+        if len(header) != SIZE_HEADER.size:
+            raise ConnectionError(f"Blob {token} is not offered by {parsed.netloc}")
+        remaining = SIZE_HEADER.unpack(header)[0]
+        buf = bytearray(RECV_CHUNK)
+        view = memoryview(buf)
+        while remaining:
+            n = s.recv_into(view, min(RECV_CHUNK, remaining))
+            if not n:
+                raise ConnectionError(f"Blob transfer from {parsed.netloc} ended early")
+            dest.write(view[:n])
+            remaining -= n
+
+
+# ---- ML peer side ----
+BLOB_URL_SCHEMES = ("http://", "https://", "file://", "p2p://")
+
+
+def is_blob_url(text: str) -> bool:
+    return text.startswith(BLOB_URL_SCHEMES)
+
+
+@contextlib.contextmanager
+def fetch_blob(url: str, suffix: str = ".mp4") -> Iterator[str]:
+    """Yield a local path holding the blob at *url*; temp copies are removed."""
+    if url.startswith("file://"):
+        # same host: read the object in place instead of copying it
+        yield urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+        return
+
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        if url.startswith("p2p://"):
+            with open(tmp_path, "wb") as dest:
+                _receive_p2p(url, dest)
+        else:
+            urllib.request.urlretrieve(url, tmp_path)
+        yield tmp_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+_transport: BlobTransport | None = None
+_transport_lock = threading.Lock()
+
+
+def get_blob_transport() -> BlobTransport:
+    """Return the process-wide transport named by BLOB_TRANSPORT."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if os.getenv("BLOB_TRANSPORT", "object").lower() == "p2p":
+                _transport = P2PTransport(os.getenv("P2P_SPOOL_DIR", "uploads"))
+            else:
+                _transport = ObjectStoreTransport(get_object_store())
+        return _transport
@@ -1,126 +1,311 @@
 # bt_utils.py
-import json, os, asyncio
-from google.cloud import storage
-from kademlia.network import Server as KadServer
-from btpeer import BTPeer
+import json, logging, os, asyncio, itertools, random, uuid
+from collections import defaultdict, deque
+from functools import lru_cache
+import metrics
+from btpeer import BTPeer, DeadlineBeforeSend, DeadlineExceeded, SendError, current_trace, time_left, tracing
+from discovery import announce_service, is_local, make_discovery
+from blob_transport import BlobTransport
+from object_store import GCSObjectStore
 import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+log = logging.getLogger(__name__)
 
 BOOTSTRAP_NODE = ("127.0.0.1", 7000)
 
 # ---- start / bootstrap DHT ----
-def init_dht(peer: BTPeer):
+BOOTSTRAP_RETRY_DELAYS = (0.2, 0.5, 1, 2, 4)    # then every 4s until it answers
+DHT_START_TIMEOUT = float(os.getenv("DHT_START_TIMEOUT", 10))   # init_dht's wait for the bootstrap
+
+async def _bootstrap(kad):
+    """Bootstrap off BOOTSTRAP_NODE, retrying until it answers.
+
+    Peers may start before the bootstrap node does, so a failed attempt is
+    retried with backoff instead of leaving the peer without neighbours.
+    """
+    addr = (BOOTSTRAP_NODE[0], BOOTSTRAP_NODE[1] + 10000)
+    for attempt in itertools.count():
+        if await kad.bootstrap([addr]):
+            return
+        await asyncio.sleep(BOOTSTRAP_RETRY_DELAYS[min(attempt, len(BOOTSTRAP_RETRY_DELAYS) - 1)])
 
+def start_dht(peer: BTPeer):
+    """Start the discovery node in the background.
+
+    Returns (kad, loop, ready): *ready* is a concurrent Future that completes
+    once the peer is bootstrapped and has announced itself.
+    """
     kad_port = peer.serverport + 10000
     loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    kad = KadServer()
+    kad = make_discovery()
 
     async def _start():
         await kad.listen(kad_port)
-        if (peer.serverhost, peer.serverport) != BOOTSTRAP_NODE:
-            await kad.bootstrap([(BOOTSTRAP_NODE[0], BOOTSTRAP_NODE[1] + 10000)])
+        if not is_local(kad) and (peer.serverhost, peer.serverport) != BOOTSTRAP_NODE:
+            await _bootstrap(kad)
         # store ourselves
         await kad.set(peer.myid, json.dumps({
             "host": peer.serverhost,
             "port": peer.serverport,
             "type": peer.peertype,
+            "uds": peer.uds_path,
         }))
         # announce service
-        key = f"svc:{peer.peertype.upper()}"
-        raw = await kad.get(key) or "[]"
-        lst = json.loads(raw)
-        if peer.myid not in lst:
-            lst.append(peer.myid)
-            await kad.set(key, json.dumps(lst))
-
-    loop.run_until_complete(_start())
+        await announce_service(kad, peer.myid, peer.peertype)
+
     threading.Thread(target=loop.run_forever, daemon=True).start()
+    ready = asyncio.run_coroutine_threadsafe(_start(), loop)
+    return kad, loop, ready
+
+def init_dht(peer: BTPeer, timeout: float | None = None):
+    """Start the discovery node and wait until the peer is announced.
 
+    Waits at most *timeout* seconds (default DHT_START_TIMEOUT); if the
+    bootstrap node has not answered by then, the peer carries on and the
+    bootstrap keeps retrying in the background.
+    """
+    kad, loop, ready = start_dht(peer)
+    timeout = DHT_START_TIMEOUT if timeout is None else timeout
+    try:
+        ready.result(timeout=timeout)
+    except FutureTimeout:      # not the builtin TimeoutError before Python 3.11
+        log.warning("DHT not bootstrapped after %.0fs; still retrying in the background", timeout)
     return kad, loop
 
 # ---- dynamic router ----
+DHT_TIMEOUT = float(os.getenv("DHT_TIMEOUT", 5))   # per lookup, capped by the request's deadline
+
+PEER_LOOKUPS = metrics.counter("peer_lookups_total", "Peer address lookups, by where they were answered",
+                               ["result"])             # table / dht / miss: the table is the cache
+DHT_SECONDS = metrics.histogram("dht_lookup_seconds", "DHT get() latency, by kind of key", ["kind"])
+
+def _lookup_timeout() -> float:
+    left = time_left()
+    return DHT_TIMEOUT if left is None else min(DHT_TIMEOUT, left)
+
 def direct_router_factory(peer, kad, loop):
+    """Router resolving peers from the routing table, then the DHT.
+
+    Peers it cannot resolve are left to BTPeer, which forwards through
+    other known peers (FWRD).
+    """
     def _direct_router(pid: str):
         # first check local cache
         try:
             host, port, _ = peer.peers[pid]
+            PEER_LOOKUPS.inc(result="table")
             return pid, host, port
         except KeyError:
-            future = asyncio.run_coroutine_threadsafe(kad.get(pid), loop)
-            raw = future.result(timeout=5)
-            if not raw:
-                return (None, None, None)
-            info = json.loads(raw)
-            peer.add_peer(pid, info["host"], info["port"], info["type"])
-            return pid, info["host"], info["port"]
+            pass
+        future = asyncio.run_coroutine_threadsafe(kad.get(pid), loop)
+        try:
+            with DHT_SECONDS.time(kind="peer"):
+                raw = future.result(timeout=_lookup_timeout())
+        except Exception:
+            future.cancel()
+            raw = None
+        if not raw:
+            PEER_LOOKUPS.inc(result="miss")
+            return (None, None, None)
+        PEER_LOOKUPS.inc(result="dht")
+        info = json.loads(raw)
+        # cache it; a full table evicts its least recently used peer
+        peer.add_peer(pid, info["host"], info["port"], info["type"], uds=info.get("uds"))
+        return pid, info["host"], info["port"]
     return _direct_router
 
-# ---- find the first peer offering a service ----
-def find_peer_for_service(kad, loop, service_type: str, timeout=5):
+# ---- find peers offering a service ----
+def find_peers_for_service(kad, loop, service_type: str, timeout=None) -> list[str]:
     key = f"svc:{service_type.upper()}"
     future = asyncio.run_coroutine_threadsafe(kad.get(key), loop)
     try:
-        raw = future.result(timeout=timeout)
+        with DHT_SECONDS.time(kind="service"):
+            raw = future.result(timeout=timeout if timeout is not None else _lookup_timeout())
     except:
-        return None
+        future.cancel()
+        return []
     if not raw:
-        return None
-    ids = json.loads(raw)
+        return []
+    return json.loads(raw)
+
+def find_peer_for_service(kad, loop, service_type: str, timeout=None):
+    ids = find_peers_for_service(kad, loop, service_type, timeout)
     if not ids:
         return None
     return ids[0]
 
+# ---- hedged / retried requests (read-only operations) ----
+HEDGE_ENABLED = os.getenv("HEDGE_REQUESTS", "1") != "0"
+HEDGE_QUANTILE = 0.95       # hedge once a reply is slower than this share of recent ones
+HEDGE_WINDOW = 200          # latencies remembered per operation
+HEDGE_MIN_SAMPLES = 20      # below this, hedge after HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = 0.5
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.1      # backoff before round n: uniform(0, min(max, base * 2**n))
+RETRY_MAX_DELAY = 2.0
+
+class LatencyTracker:
+    """Recent latencies of one operation; its p95 is the hedging delay."""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(self) -> float:
+        q = self.quantile(HEDGE_QUANTILE)
+        return HEDGE_DEFAULT_DELAY if q is None else q
+
+latency: dict[str, LatencyTracker] = defaultdict(LatencyTracker)   # operation → tracker
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+HEDGES = metrics.counter("hedged_copies_total", "Second copies sent by hedged requests, by operation", ["op"])
+
+def _attempt(peer, target, msgtype, msgdata, parse, deadline, tracker, trace):
+    t0 = time.monotonic()
+    with tracing(trace):    # runs in a pool thread: carry the caller's trace over
+        replies = peer.send_to_peer(target, msgtype, msgdata, waitreply=True, keepalive=True,
+                                    timeout=deadline - t0, raise_errors=True)
+    result = parse(replies)
+    tracker.record(time.monotonic() - t0)
+    return result
+
+def hedged_request(peer, targets, msgtype, msgdata, parse, *, timeout, op=None, attempts=RETRY_ATTEMPTS):
+    """Send a read-only request to one of *targets*; return parse(replies).
+
+    When no reply has come within the operation's recent p95 latency, a
+    copy goes to the next target and the first good reply wins. *parse*
+    raises on a bad reply. If every copy in a round fails, another round
+    starts after a jittered exponential backoff, up to *attempts* rounds,
+    all within *timeout* seconds. Only for requests that are safe to run
+    twice. *op* names the operation for latency tracking (default msgtype).
+    """
+    if not targets:
+        raise RuntimeError(f"No peer to send {msgtype} to")
+    op = op or msgtype
+    tracker = latency[op]
+    deadline = time.monotonic() + timeout
+    order = itertools.cycle(targets)
+    trace = current_trace()
+    last_error: Exception | None = None
+
+    def _submit():
+        return _hedge_pool.submit(_attempt, peer, next(order), msgtype, msgdata, parse, deadline, tracker, trace)
+
+    for attempt in range(attempts):
+        if attempt:
+            backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if time.monotonic() + backoff >= deadline:
+                break
+            time.sleep(backoff)
+        pending = {_submit()}
+        hedged = not HEDGE_ENABLED or len(targets) < 2
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            done, pending = wait(pending, timeout=left if hedged else min(tracker.hedge_delay(), left),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+            if not done and not hedged:
+                # the first copy is slower than usual: race a second one
+                pending.add(_submit())
+                HEDGES.inc(op=op)
+                hedged = True
+    if last_error is not None:
+        raise last_error
+    raise DeadlineExceeded(f"{msgtype} got no reply within {timeout:.0f}s")
+
 # ---- GCS helpers ----
+@lru_cache(maxsize=None)
+def _gcs_store(bucket_name) -> GCSObjectStore:
+    """One store (and storage client) per bucket for the whole process."""
+    return GCSObjectStore(bucket_name)
+
 def upload_to_gcs(bucket_name, path):
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(os.path.basename(path))
-    blob.upload_from_filename(path)
-    blob.make_public()
-    return blob.public_url
+    return _gcs_store(bucket_name).upload_file(path)
 
 def delete_from_gcs(bucket, blob_name):
-    client = storage.Client()
-    bucket = client.bucket(bucket)
-    bucket.blob(blob_name).delete()
+    _gcs_store(bucket).delete(blob_name)
 
 # ---- high-level peer requests ----
-def request_ml(peer, kad, loop, bucket, video_path):
-    target = find_peer_for_service(kad, loop, "ML")
-    if not target:
-        raise RuntimeError("No ML peer")
-    url = upload_to_gcs(bucket, video_path)
-    replies = peer.send_to_peer(target, "MLRQ", url, waitreply=True)
+ML_ATTEMPTS = 3
+ML_TIMEOUT = float(os.getenv("ML_REQUEST_TIMEOUT", 900))    # whole video, all attempts
+IOT_TIMEOUT = float(os.getenv("IOT_REQUEST_TIMEOUT", 30))
+
+def _send_ml_request(peer, target, url, key):
+    """Send MLRQ, retrying lost replies under the same idempotency key.
+
+    The ML peer runs each key once, so a retry after a dropped connection
+    picks up the running (or finished) job instead of starting it again.
+    All attempts share one ML_TIMEOUT budget; once it is spent the ML peer
+    is told to cancel the job.
+    """
+    deadline = time.monotonic() + ML_TIMEOUT
+    for attempt in range(ML_ATTEMPTS):
+        try:
+            replies = peer.send_to_peer(target, "MLRQ", url, waitreply=True, keepalive=True,
+                                        idempotency_key=key, timeout=deadline - time.monotonic(),
+                                        raise_errors=True)
+            break
+        except (DeadlineExceeded, DeadlineBeforeSend) as e:
+            raise RuntimeError(f"ML request timed out after {ML_TIMEOUT:.0f}s") from e
+        except SendError as e:
+            if attempt == ML_ATTEMPTS - 1:
+                raise RuntimeError(f"ML request failed: {e}") from e
+            log.warning("ML request to %s failed: %s; retrying", target, e)
     for t, d in replies:
         if t=="MLRS":
-            delete_from_gcs(bucket, os.path.basename(video_path))
             return json.loads(d)
     raise RuntimeError("MLRS never arrived")
 
-def request_iot(peer, kad, loop, start, end):
-    target = find_peer_for_service(kad, loop, "IOT")
-    if not target:
-        raise RuntimeError("No IoT peer")
-    payload = f"{start}|{end}"
-    replies = peer.send_to_peer(target, "IORQ", payload, waitreply=True)
+def request_ml(peer, kad, loop, transport: BlobTransport, name, key: str | None = None):
+    """Run ML on the video *name* held by *transport*'s store, then release it.
+
+    *key* identifies the request across retries (default: a new one).
+    """
+    # preparing the offer and the DHT lookup are independent: overlap them
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        lookup = pool.submit(find_peer_for_service, kad, loop, "ML")
+        offer = transport.offer(peer, name)
+        target = lookup.result()
+    try:
+        if not target:
+            raise RuntimeError("No ML peer")
+        return _send_ml_request(peer, target, offer.url, key or uuid.uuid4().hex)
+    finally:
+        offer.release()
+
+def _parse_iot_reply(replies):
     for t, d in replies:
         if t=="IORS":
             return json.loads(d)
     raise RuntimeError("IORS never arrived")
 
-def bc_store(peer, kad, loop, data):
-    target = find_peer_for_service(kad, loop, "BC") or peer.myid
-    payload = json.dumps(data)
-    replies = peer.send_to_peer(target, "BCRQ", f"STORE {payload}", waitreply=True)
-    for t, d in replies:
-        if t=="BCRS":
-            return d
-    raise RuntimeError("BCRS never arrived")
-
-def bc_fetch(peer, kad, loop):
-    target = find_peer_for_service(kad, loop, "BC") or peer.myid
-    replies = peer.send_to_peer(target, "BCRQ", "FETCH", waitreply=True)
-    for msg_type, msg_data in replies:
-        if msg_type == "BCRS":
-            from handlers import bc_handlers as _bc
-            _bc.bc_response_handler(peer, msg_data)
+def request_iot(peer, kad, loop, start, end):
+    """Query IoT data; read-only, so hedged across IoT peers and retried."""
+    targets = find_peers_for_service(kad, loop, "IOT")
+    if not targets:
+        raise RuntimeError("No IoT peer")
+    # start at a random provider to spread the load
+    first = random.randrange(len(targets))
+    targets = targets[first:] + targets[:first]
+    payload = f"{start}|{end}"
+    return hedged_request(peer, targets, "IORQ", payload, _parse_iot_reply, timeout=IOT_TIMEOUT)
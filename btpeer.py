@@ -3,19 +3,143 @@
 btpeer.py – basic P2P networking primitives (cleaned & reformatted)
 """
 
+import contextlib
+import json
+import logging
+import os
+import select
 import socket
 import struct
+import tempfile
 import threading
 import time
-import traceback
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# A connection that opens with KEEP stays open for further requests; the
+# server ends each reply with a DONE frame instead of closing the socket.
+KEEPALIVE_MSG = "KEEP"
+REPLY_END_MSG = "DONE"
+KEEPALIVE_IDLE_TIMEOUT = 60.0   # server side: close idle keep-alive sockets
+
+# Peers also listen on a Unix domain socket derived from their port; other
+# peers on the same host use it instead of TCP. BTPEER_UDS=0 turns it off;
+# so does a platform without AF_UNIX (older Windows builds of Python).
+_AF_UNIX = getattr(socket, "AF_UNIX", None)
+UDS_ENABLED = os.getenv("BTPEER_UDS", "1") != "0" and _AF_UNIX is not None
+UDS_DIR = os.getenv("BTPEER_UDS_DIR", tempfile.gettempdir())
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+# A peer that cannot reach the target itself hands the message to another
+# known peer in a FWRD envelope; each hop decrements the TTL. BTPEER_FORWARD_TTL=0
+# turns forwarding off.
+FORWARD_MSG = "FWRD"
+FORWARD_TTL = int(os.getenv("BTPEER_FORWARD_TTL", 3))
+MAX_RELAY_ATTEMPTS = 3          # relays tried per hop before giving up
+
+# An optional HDRS frame (JSON object) right before a message carries its
+# headers; the handler sees them as conn.headers.
+HEADERS_MSG = "HDRS"
+# Requests to handlers registered with idempotent=True may carry this
+# header. Replies are remembered per key, so a retried request gets the
+# recorded replies instead of running again.
+IDEMPOTENCY_HEADER = "idem"
+IDEMPOTENCY_TTL = float(os.getenv("BTPEER_IDEMPOTENCY_TTL", 600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("BTPEER_IDEMPOTENCY_CACHE", 256))
+
+# Every request carries an id and the seconds left until its deadline. Each
+# hop derives its socket timeouts from that budget, and handlers inherit
+# it, so nested requests share the original deadline. CNCL <request id>
+# tells the target to stop working on a request.
+REQUEST_ID_HEADER = "rid"
+DEADLINE_HEADER = "timeout"
+CANCEL_MSG = "CNCL"
+CONNECT_TIMEOUT = float(os.getenv("BTPEER_CONNECT_TIMEOUT", 5))
+DEADLINE_SLACK = 0.5            # seconds a socket timeout may run past the deadline
+# budget of requests that set no timeout of their own (0 = unlimited)
+REQUEST_TIMEOUT = float(os.getenv("BTPEER_REQUEST_TIMEOUT", 0))
+
+# A trace id names the job a request belongs to; every request sent while
+# handling a traced request carries it on, so one job can be followed
+# across peers in their logs.
+TRACE_HEADER = "trace"
+
+# ---- metrics (see metrics.py) ----
+REQUESTS_HANDLED = metrics.counter("btpeer_requests_handled_total", "Requests handled, by message type", ["type"])
+HANDLER_SECONDS = metrics.histogram("btpeer_handler_seconds", "Time spent in handlers, by message type", ["type"])
+ACTIVE_HANDLERS = metrics.gauge("btpeer_active_handlers", "Handlers running right now")
+REPLAYED = metrics.counter("btpeer_replayed_total", "Idempotent requests answered from the cache", ["type"])
+REQUESTS_SENT = metrics.counter("btpeer_requests_sent_total", "Requests sent, by message type and outcome",
+                                ["type", "result"])
+REQUEST_SECONDS = metrics.histogram("btpeer_request_seconds", "Round trip of sent requests, by message type",
+                                    ["type"])
+BYTES_IN = metrics.counter("btpeer_bytes_received_total", "Bytes received in frames")
+BYTES_OUT = metrics.counter("btpeer_bytes_sent_total", "Bytes sent in frames")
+
+
+class SendError(ConnectionError):
+    """A request could not be completed (see send_to_peer(raise_errors=True))."""
+
+
+class PeerUnreachable(SendError):
+    """No connection to the target or any relay: the request was not sent."""
+
+
+class ReplyLost(SendError):
+    """The request was sent but no reply came back; it may have run."""
+
+
+class DeadlineExceeded(ReplyLost):
+    """The request's deadline passed before its reply was complete."""
+
+
+class DeadlineBeforeSend(PeerUnreachable):
+    """The request's deadline passed before it was sent: the target never saw it."""
+
+
+class _RelayFailed(PeerUnreachable):
+    """A relay answered, but could not reach the target either."""
 
 
 # --------------------------------------------------------------------------- #
 # Utility
 # --------------------------------------------------------------------------- #
-def btdebug(msg: str) -> None:
-    """Print a message tagged with the current thread name (if debug mode)."""
-    print(f"[{threading.current_thread().name}] {msg}")
+def uds_path_for(port: int) -> str:
+    """Unix socket path of the peer listening on TCP *port* of this host."""
+    return os.path.join(UDS_DIR, f"btpeer-{int(port)}.sock")
+
+
+# deadline (time.monotonic()) and trace id of the request this thread is sending or handling
+_request_ctx = threading.local()
+
+
+def current_deadline() -> float | None:
+    return getattr(_request_ctx, "deadline", None)
+
+
+def current_trace() -> str | None:
+    return getattr(_request_ctx, "trace", None)
+
+
+@contextlib.contextmanager
+def tracing(trace_id: str | None):
+    """Tag the requests this thread sends with *trace_id*."""
+    outer = current_trace()
+    _request_ctx.trace = trace_id
+    try:
+        yield
+    finally:
+        _request_ctx.trace = outer
+
+
+def time_left() -> float | None:
+    """Seconds left for the current request, or None without a deadline."""
+    deadline = current_deadline()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
 
 
 # --------------------------------------------------------------------------- #
@@ -43,8 +167,6 @@ class BTPeer:
             myid: Optional canonical peer ID string.
             serverhost: Override host/IP, otherwise auto-detect.
         """
-        self.debug: bool = False
-
         self.maxpeers = int(maxpeers)
         self.serverport = int(serverport)
 
@@ -52,60 +174,191 @@ class BTPeer:
 
         self.serverhost = serverhost or self._init_server_host()
         self.myid = myid or f"{self.serverhost}:{self.serverport}"
+        # advertised in the peer record so local peers can skip TCP
+        self.uds_path: str | None = uds_path_for(self.serverport) if UDS_ENABLED else None
+        self.uds_routes: dict[tuple[str, int], str] = {}  # (host, port) → socket path
 
-        self.peerlock = threading.Lock()          # protects self.peers
-        self.peers: dict[str, tuple[str, int, str]] = {}  # peerid → (host, port, peertype)
+        # peerid → (host, port, peertype), least recently used evicted when full
+        self.peers = RoutingTable(self.maxpeers)
         self.shutdown: bool = False
 
         self.handlers: dict[str, callable] = {}   # 4-char msgtype → handler
-        self.router: callable | None = None       # routing callback
-        self.router = lambda pid: (pid, *self.peers.get(pid, (None, None))) #当 peers 表里有目标 pid 时就能“直连”；没有的话返回 (None, None, None)
+        self.handlers[FORWARD_MSG] = self._handle_forward
+        self.handlers[CANCEL_MSG] = self._handle_cancel
+        self.inflight: dict[str, BTPeerConnection] = {}  # request id → connection being handled
+        self.idempotent: set[str] = set()         # msgtypes whose replies are remembered
+        self.completed = CompletedRequests(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+        self.router: callable | None = self._table_router  # routing callback
+
+        self.connpool = BTPeerConnectionPool()    # keep-alive sockets
+        self.ready = threading.Event()            # set once mainloop is accepting
 
     # ----------------------------------------------------------------------- #
     # Internal helpers
     # ----------------------------------------------------------------------- #
     def _init_server_host(self) -> str:
-        """Determine the local IP address by making an outbound connection."""
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        """Determine the local IP address without any network traffic.
+
+        BTPEER_HOST overrides it. Otherwise a UDP socket is "connected" to a
+        non-routable address: nothing is sent, but the kernel picks the
+        outbound interface. Without any route, fall back to loopback.
+        """
+        override = os.getenv("BTPEER_HOST")
+        if override:
+            return override
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            s.connect(("www.google.com", 80))
+            s.connect(("10.255.255.255", 1))
             return s.getsockname()[0]
+        except OSError:
+            return "127.0.0.1"
         finally:
             s.close()
 
-    def _debug(self, msg: str) -> None:
-        if self.debug:
-            btdebug(msg)
-
     # ----------------------------------------------------------------------- #
     # Networking helpers
     # ----------------------------------------------------------------------- #
     def _handle_peer(self, clientsock: socket.socket) -> None:
         """Handle a newly accepted peer connection."""
-        self._debug(f"New child {threading.current_thread().name}")
-        self._debug(f"Connected {clientsock.getpeername()}")
-
-        host, port = clientsock.getpeername()
-        peerconn = BTPeerConnection(None, host, port, sock=clientsock, debug=False)
+        if clientsock.family == _AF_UNIX:
+            host, port = "unix", 0
+        else:
+            host, port = clientsock.getpeername()[:2]
+        log.debug("Connected %s:%s", host, port)
+        peerconn = BTPeerConnection(None, host, port, sock=clientsock)
 
         try:
             msgtype, msgdata = peerconn.recvdata()
-            if msgtype:
-                msgtype = msgtype.upper()
-            if msgtype not in self.handlers:
-                self._debug(f"Not handled: {msgtype}: {msgdata}")
-            else:
-                self._debug(f"Handling peer msg: {msgtype}: {msgdata}")
-                self.handlers[msgtype](peerconn, msgdata)
+            keepalive = bool(msgtype) and msgtype.upper() == KEEPALIVE_MSG
+            if keepalive:
+                msgtype, msgdata = peerconn.recvdata()
+
+            while msgtype and not self.shutdown:
+                peerconn.headers = {}
+                if msgtype.upper() == HEADERS_MSG:
+                    peerconn.headers = json.loads(msgdata)
+                    msgtype, msgdata = peerconn.recvdata()
+                    if not msgtype:
+                        break
+                budget = peerconn.headers.get(DEADLINE_HEADER)
+                peerconn.deadline = time.monotonic() + budget if budget is not None else None
+                peerconn.cancel.clear()
+                self._dispatch(peerconn, msgtype.upper(), msgdata)
+                peerconn.deadline = None
+                peerconn.set_timeout(KEEPALIVE_IDLE_TIMEOUT)
+                if not keepalive or not peerconn.senddata(REPLY_END_MSG, ""):
+                    break
+                msgtype, msgdata = peerconn.recvdata()
         except KeyboardInterrupt:
             raise
         except Exception:
-            if self.debug:
-                traceback.print_exc()
+            log.debug("Connection from %s:%s failed", host, port, exc_info=True)
 
-        self._debug(f"Disconnecting {clientsock.getpeername()}")
+        log.debug("Disconnecting %s:%s", host, port)
         peerconn.close()
 
+    def _dispatch(self, peerconn: "BTPeerConnection", msgtype: str, msgdata: str) -> None:
+        """Run the handler registered for *msgtype*."""
+        if msgtype not in self.handlers:
+            log.debug("Not handled: %s: %.200s", msgtype, msgdata)
+            return
+        if peerconn.deadline is not None and time.monotonic() >= peerconn.deadline:
+            log.debug("Skipping %s: deadline passed", msgtype)
+            return
+        log.debug("Handling peer msg: %s: %.200s", msgtype, msgdata)
+        rid = peerconn.headers.get(REQUEST_ID_HEADER)
+        if rid:
+            self.inflight[rid] = peerconn
+        trace = peerconn.headers.get(TRACE_HEADER)
+        outer_deadline, outer_trace = current_deadline(), current_trace()
+        # inherited by requests the handler sends (and tagged on its log records)
+        _request_ctx.deadline, _request_ctx.trace = peerconn.deadline, trace
+        if trace and msgtype != FORWARD_MSG:
+            log.info("%s handling %s", self.myid, msgtype)
+        ACTIVE_HANDLERS.inc()
+        t0 = time.perf_counter()
+        try:
+            key = peerconn.headers.get(IDEMPOTENCY_HEADER) if msgtype in self.idempotent else None
+            if key:
+                self._run_idempotent(peerconn, msgtype, msgdata, f"{msgtype}:{key}")
+            else:
+                self._run_handler(peerconn, msgtype, msgdata)
+        finally:
+            elapsed = time.perf_counter() - t0
+            ACTIVE_HANDLERS.dec()
+            REQUESTS_HANDLED.inc(type=msgtype)
+            HANDLER_SECONDS.observe(elapsed, type=msgtype)
+            if trace and msgtype != FORWARD_MSG:
+                log.info("%s done %s in %.3fs", self.myid, msgtype, elapsed)
+            _request_ctx.deadline, _request_ctx.trace = outer_deadline, outer_trace
+            if rid and self.inflight.get(rid) is peerconn:
+                del self.inflight[rid]
+
+    def _run_idempotent(self, peerconn, msgtype: str, msgdata: str, key: str) -> None:
+        entry, first = self.completed.begin(key)
+        if not first:
+            # a retry: replay the first attempt's replies (waiting if it still runs)
+            log.debug("Replaying %s", key)
+            REPLAYED.inc(type=msgtype)
+            with self.completed.waiting(entry):
+                entry.done.wait(time_left())
+            for reply in entry.replies:
+                if not peerconn.senddata(*reply):
+                    break
+            return
+        recorder = _RecordingConnection(peerconn, entry)
+        try:
+            self._run_handler(recorder, msgtype, msgdata)
+        finally:
+            self.completed.finish(key, entry, recorder.replies)
+
+    def _run_handler(self, peerconn, msgtype: str, msgdata: str) -> None:
+        try:
+            self.handlers[msgtype](peerconn, msgdata)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            log.exception("Handler for %s failed", msgtype)
+
+    def _handle_cancel(self, peerconn: "BTPeerConnection", msgdata: str) -> None:
+        """CNCL <request id>: flag the request so its handler can stop early."""
+        conn = self.inflight.get(msgdata.strip())
+        if conn is not None:
+            log.debug("Cancelling request %s", msgdata.strip())
+            conn.cancel.set()
+
+    def _table_router(self, pid: str) -> tuple[str | None, str | None, int | None]:
+        """Default router: deliver directly to peers in the routing table."""
+        entry = self.peers.get(pid)
+        if entry is None:
+            return (None, None, None)
+        return (pid, entry[0], entry[1])
+
+    def _handle_forward(self, peerconn: "BTPeerConnection", msgdata: str) -> None:
+        """FWRD: handle a relayed message, or pass it one hop closer.
+
+        Replies travel back along the same chain of connections.
+        """
+        env = json.loads(msgdata)
+        headers = env.get("headers") or {}
+        if env["dst"] == self.myid:
+            peerconn.headers = headers
+            self._dispatch(peerconn, env["type"].upper(), env["data"])
+            return
+        # with the TTL used up we may still deliver directly, just not relay again
+        try:
+            replies = self._route(env["dst"], env["type"], env["data"], waitreply=True, keepalive=True,
+                                  ttl=env["ttl"], path=env["path"] + [self.myid], headers=headers)
+        except PeerUnreachable:
+            # tell the sender nothing was delivered, so it can try elsewhere
+            peerconn.senddata(FORWARD_MSG, "UNREACHABLE")
+            return
+        except ReplyLost:
+            return
+        for reply in replies:
+            if not peerconn.senddata(*reply):
+                break
+
     def _run_stabilizer(self, stabilizer: callable, delay: float) -> None:
         while not self.shutdown:
             stabilizer()
@@ -123,10 +376,18 @@ class BTPeer:
         t.daemon = True
         t.start()
 
-    def add_handler(self, msgtype: str, handler: callable) -> None:
-        """Register *handler* for 4-char *msgtype*."""
+    def add_handler(self, msgtype: str, handler: callable, *, idempotent: bool = False) -> None:
+        """Register *handler* for 4-char *msgtype*.
+
+        With *idempotent*, requests carrying an idempotency key run once per
+        key: retries get the replies of the first run (see IDEMPOTENCY_TTL).
+        """
         assert len(msgtype) == 4, "msgtype must be exactly 4 characters"
         self.handlers[msgtype] = handler
+        if idempotent:
+            self.idempotent.add(msgtype)
+        else:
+            self.idempotent.discard(msgtype)
 
     def add_router(self, router: callable) -> None:
         """Register a routing callback.
@@ -138,21 +399,32 @@ class BTPeer:
     # ----------------------------------------------------------------------- #
     # Peer list maintenance
     # ----------------------------------------------------------------------- #
-    def add_peer(self, peerid: str, host: str, port: int, peertype: str) -> bool:
-        """Add a peer to known list (respects *maxpeers*)."""
-        if peerid in self.peers:
-            return False
-        if self.maxpeers and len(self.peers) >= self.maxpeers:
-            return False
+    def add_peer(self, peerid: str, host: str, port: int, peertype: str, uds: str | None = None) -> bool:
+        """Add or refresh a peer; returns whether it was new.
 
-        self.peers[peerid] = (host, int(port), peertype.upper())
-        return True
+        With *maxpeers* reached, the least recently used peer is evicted (and
+        its pooled connections closed) to make room. *uds* is the Unix socket
+        path from the peer's record, if it has one.
+        """
+        if uds:
+            self.uds_routes[(host, int(port))] = uds
+        added, evicted = self.peers.add(peerid, (host, int(port), peertype.upper()))
+        for old_pid, (old_host, old_port, _) in evicted:
+            log.debug("Evicted %s from the routing table", old_pid)
+            self._forget(old_host, old_port)
+        return added
 
     def get_peer(self, peerid: str) -> tuple[str, int, str]:
         return self.peers[peerid]
 
     def remove_peer(self, peerid: str) -> None:
-        self.peers.pop(peerid, None)
+        entry = self.peers.pop(peerid)
+        if entry:
+            self._forget(entry[0], entry[1])
+
+    def _forget(self, host: str, port: int) -> None:
+        self.uds_routes.pop((host, int(port)), None)
+        self.connpool.discard(host, port)
 
     def get_peer_ids(self) -> list[str]:
         return list(self.peers.keys())
@@ -167,32 +439,196 @@ class BTPeer:
     # Socket helpers
     # ----------------------------------------------------------------------- #
     @staticmethod
-    def _make_server_socket(port: int, backlog: int = 5) -> socket.socket:
-        """Return a bound & listening socket."""
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(("", port))
+    def _make_server_socket(port: int, backlog: int = 5, *, uds: str | None = None) -> socket.socket:
+        """Return a bound & listening socket (TCP on *port*, or Unix at *uds*)."""
+        if uds:
+            if _AF_UNIX is None:
+                raise OSError("Unix domain sockets are not supported here")
+            if os.path.exists(uds):
+                os.remove(uds)          # left over from a previous run
+            s = socket.socket(_AF_UNIX, socket.SOCK_STREAM)
+            s.bind(uds)
+        else:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("", port))
         s.listen(backlog)
         return s
 
+    def _uds_for(self, host: str, port: int) -> str | None:
+        """Unix socket path to use for *host*:*port*, if it is on this host."""
+        if host in LOCAL_HOSTS or host == self.serverhost or host.startswith("127."):
+            return self.uds_routes.get((host, int(port)))
+        return None
+
     # ----------------------------------------------------------------------- #
     # Messaging
     # ----------------------------------------------------------------------- #
     def send_to_peer(
-        self, peerid: str, msgtype: str, msgdata: str, waitreply: bool = True
-    ):
-        """Route a message to *peerid* using self.router."""
+        self,
+        peerid: str,
+        msgtype: str,
+        msgdata: str,
+        waitreply: bool = True,
+        *,
+        keepalive: bool = False,
+        headers: dict | None = None,
+        idempotency_key: str | None = None,
+        timeout: float | None = None,
+        raise_errors: bool = False,
+    ) -> list[tuple[str, str]]:
+        """Route a message to *peerid* using self.router.
+
+        With *keepalive* the request reuses a pooled connection to the
+        target instead of opening (and tearing down) a fresh socket. A
+        target the router cannot resolve, or whose address does not answer,
+        is reached through another known peer (see FORWARD_TTL).
+
+        *headers* travel with the message; *idempotency_key* adds the header
+        that lets an idempotent handler recognise a retry of this request.
+        The thread's trace id (see tracing()) is passed on as well.
+
+        The request must complete within *timeout* seconds (default
+        REQUEST_TIMEOUT, unlimited unless set), and within what is left of
+        the request being handled when called from a handler. When the deadline passes, the
+        target is sent a CNCL for the request.
+
+        Failures return an empty list unless *raise_errors* is set: then
+        PeerUnreachable means nothing was sent (safe to send elsewhere), and
+        ReplyLost that the request went out but no reply came back (retry
+        with the same idempotency key); DeadlineExceeded is a ReplyLost,
+        DeadlineBeforeSend a PeerUnreachable.
+        """
+        rid = uuid.uuid4().hex[:16]
+        headers = {**(headers or {}), REQUEST_ID_HEADER: rid}
+        if idempotency_key:
+            headers[IDEMPOTENCY_HEADER] = idempotency_key
+        trace = current_trace()
+        if trace:
+            headers[TRACE_HEADER] = trace
+
+        outer_deadline = current_deadline()
+        budget = timeout if timeout is not None else (REQUEST_TIMEOUT or None)
+        deadline = time.monotonic() + budget if budget is not None else None
+        if outer_deadline is not None:
+            deadline = outer_deadline if deadline is None else min(deadline, outer_deadline)
+        _request_ctx.deadline = deadline
+        t0 = time.perf_counter()
+        try:
+            replies = self._route(peerid, msgtype, msgdata, waitreply=waitreply, keepalive=keepalive,
+                                  ttl=FORWARD_TTL, path=[self.myid], headers=headers)
+        except SendError as e:
+            result = ("deadline" if isinstance(e, (DeadlineExceeded, DeadlineBeforeSend))
+                      else "unreachable" if isinstance(e, PeerUnreachable) else "lost")
+            REQUESTS_SENT.inc(type=msgtype, result=result)
+            if isinstance(e, DeadlineExceeded) and msgtype != CANCEL_MSG:
+                self.cancel_request(peerid, rid)
+            if raise_errors:
+                raise
+            return []
+        finally:
+            _request_ctx.deadline = outer_deadline
+        if waitreply and not replies:
+            REQUESTS_SENT.inc(type=msgtype, result="lost")
+            if raise_errors:
+                raise ReplyLost(f"No reply to {msgtype} from {peerid}")
+            return replies
+        REQUESTS_SENT.inc(type=msgtype, result="ok")
+        if waitreply:
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, type=msgtype)
+        return replies
+
+    def cancel_request(self, peerid: str, rid: str) -> None:
+        """Tell *peerid* (in the background) to stop working on request *rid*."""
+        def _send_cancel():
+            _request_ctx.deadline = _request_ctx.trace = None
+            self.send_to_peer(peerid, CANCEL_MSG, rid, waitreply=False, timeout=CONNECT_TIMEOUT)
+        threading.Thread(target=_send_cancel, daemon=True).start()
+
+    def _route(
+        self,
+        peerid: str,
+        msgtype: str,
+        msgdata: str,
+        *,
+        waitreply: bool,
+        keepalive: bool,
+        ttl: int,
+        path: list[str],
+        headers: dict | None,
+    ) -> list[tuple[str, str]]:
+        """Deliver directly or through relays; raises SendError."""
         if not self.router:
-            self._debug("No router set")
-            return None
+            raise PeerUnreachable("No router set")
 
         nextpid, host, port = self.router(peerid)
-        if not nextpid:
-            self._debug(f"Unable to route {msgtype} to {peerid}")
-            return None
+        if nextpid:
+            try:
+                if nextpid != peerid:
+                    # the router chose an intermediate hop
+                    return self._send_forward(nextpid, host, port, peerid, msgtype, msgdata, waitreply=waitreply,
+                                              keepalive=keepalive, ttl=ttl, path=path, headers=headers)
+                return self._send(nextpid, host, port, msgtype, msgdata,
+                                  waitreply=waitreply, keepalive=keepalive, headers=headers)
+            except _RelayFailed:
+                pass
+            except DeadlineBeforeSend:
+                raise                   # no time left for relays either
+            except PeerUnreachable:
+                log.debug("%s at %s:%s is unreachable", nextpid, host, port)
+                self.remove_peer(nextpid)
+
+        if ttl > 0:
+            for relay in self.peers.recent(exclude={peerid, nextpid, *path})[:MAX_RELAY_ATTEMPTS]:
+                entry = self.peers.get(relay)
+                if entry is None:
+                    continue
+                try:
+                    return self._send_forward(relay, entry[0], entry[1], peerid, msgtype, msgdata, waitreply=waitreply,
+                                              keepalive=keepalive, ttl=ttl, path=path, headers=headers)
+                except _RelayFailed:
+                    continue
+                except DeadlineBeforeSend:
+                    raise
+                except PeerUnreachable:
+                    self.remove_peer(relay)
+
+        raise PeerUnreachable(f"Unable to route {msgtype} to {peerid}")
+
+    def _send_forward(self, relay, host, port, peerid, msgtype, msgdata, *, waitreply, keepalive, ttl, path, headers):
+        """Send *msgtype* for *peerid* to *relay* wrapped in a FWRD envelope."""
+        log.debug("Forwarding %s for %s via %s", msgtype, peerid, relay)
+        env = json.dumps({"dst": peerid, "type": msgtype, "data": msgdata, "ttl": ttl - 1, "path": path,
+                          "headers": headers or {}})
+        outer = {name: headers[name] for name in (REQUEST_ID_HEADER, TRACE_HEADER) if name in (headers or {})}
+        replies = self._send(relay, host, port, FORWARD_MSG, env, waitreply=waitreply, keepalive=keepalive,
+                             headers=outer)
+        if replies and replies[0][0] == FORWARD_MSG:
+            raise _RelayFailed(f"{relay} cannot reach {peerid}")
+        return replies
+
+    def _send(self, pid, host, port, msgtype, msgdata, *, waitreply, keepalive, headers=None):
+        """Deliver to the next hop; raises PeerUnreachable or ReplyLost."""
+        deadline = current_deadline()
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise DeadlineBeforeSend(f"Deadline passed before sending {msgtype} to {pid}")
+            headers = {**(headers or {}), DEADLINE_HEADER: round(left, 3)}
+        if keepalive and waitreply:
+            try:
+                return self.connpool.request(host, port, msgtype, msgdata, pid=pid,
+                                             uds=self._uds_for(host, port), headers=headers,
+                                             deadline=deadline)
+            except KeyboardInterrupt:
+                raise
+            except SendError:
+                raise
+            except OSError as e:
+                raise PeerUnreachable(f"Cannot connect to {pid} at {host}:{port}: {e}") from e
 
         return self._connect_and_send(
-            host, port, msgtype, msgdata, pid=nextpid, waitreply=waitreply
+            host, port, msgtype, msgdata, pid=pid, waitreply=waitreply, headers=headers, deadline=deadline
         )
 
     def _connect_and_send(
@@ -204,25 +640,33 @@ class BTPeer:
         *,
         pid: str | None = None,
         waitreply: bool = True,
-    ):
+        headers: dict | None = None,
+        deadline: float | None = None,
+    ) -> list[tuple[str, str]]:
+        try:
+            peerconn = BTPeerConnection(pid, host, port, uds=self._uds_for(host, port),
+                                        deadline=deadline)
+        except OSError as e:
+            raise PeerUnreachable(f"Cannot connect to {pid} at {host}:{port}: {e}") from e
+
         replies: list[tuple[str, str]] = []
         try:
-            peerconn = BTPeerConnection(pid, host, port, debug=self.debug)
-            peerconn.senddata(msgtype, msgdata)
-            self._debug(f"Sent {pid}: {msgtype}")
+            if not peerconn.senddata(msgtype, msgdata, headers):
+                if peerconn.timed_out:
+                    raise DeadlineExceeded(f"Sending {msgtype} to {pid} ran past its deadline")
+                raise ReplyLost(f"Sending {msgtype} to {pid} failed")
+            log.debug("Sent %s: %s", pid, msgtype)
 
             if waitreply:
                 onereply = peerconn.recvdata()
                 while onereply != (None, None):
                     replies.append(onereply)
-                    self._debug(f"Reply from {pid}: {onereply}")
+                    log.debug("Reply from %s: %.200s", pid, onereply)
                     onereply = peerconn.recvdata()
+        finally:
             peerconn.close()
-        except KeyboardInterrupt:
-            raise
-        except Exception:
-            if self.debug:
-                traceback.print_exc()
+        if peerconn.timed_out:
+            raise DeadlineExceeded(f"{msgtype} to {pid} ran past its deadline")
         return replies
 
     # ----------------------------------------------------------------------- #
@@ -230,48 +674,222 @@ class BTPeer:
     # ----------------------------------------------------------------------- #
     def check_live_peers(self) -> None:
         """Ping all known peers and drop those that do not respond."""
-        dead = []
-        for pid, (host, port) in self.peers.items():
+        for pid, (host, port, _) in self.peers.items():
             try:
-                self._debug(f"Ping {pid}")
-                peerconn = BTPeerConnection(pid, host, port, debug=self.debug)
+                log.debug("Ping %s", pid)
+                peerconn = BTPeerConnection(pid, host, port, uds=self._uds_for(host, port))
                 peerconn.senddata("PING", "")
                 peerconn.close()
             except Exception:
-                dead.append(pid)
-
-        with self.peerlock:
-            for pid in dead:
-                self.peers.pop(pid, None)
+                self.remove_peer(pid)
 
     # ----------------------------------------------------------------------- #
     # Main server loop
     # ----------------------------------------------------------------------- #
     def mainloop(self) -> None:
         server = self._make_server_socket(self.serverport)
-        server.settimeout(2)
-        self._debug(f"Server started: {self.myid} ({self.serverhost}:{self.serverport})")
+        log.debug("Server started: %s (%s:%s)", self.myid, self.serverhost, self.serverport)
+
+        uds_server = None
+        if self.uds_path:
+            try:
+                uds_server = self._make_server_socket(0, uds=self.uds_path)
+            except OSError as e:
+                log.warning("Unix socket %s unavailable, TCP only: %s", self.uds_path, e)
+                self.uds_path = None
+        if uds_server:
+            t = threading.Thread(target=self._accept_loop, args=(uds_server,), daemon=True)
+            t.start()
+
+        self.ready.set()
+        self._accept_loop(server)
+
+        log.debug("Main loop exiting")
+        server.close()
+        if uds_server:
+            uds_server.close()
+            if os.path.exists(self.uds_path):
+                os.remove(self.uds_path)
+        self.connpool.close_all()
 
+    def _accept_loop(self, server: socket.socket) -> None:
+        server.settimeout(2)
         while not self.shutdown:
             try:
-                self._debug("Awaiting connections …")
                 clientsock, _ = server.accept()
-                clientsock.settimeout(None)
+                # bounds the wait for a request and each write of a reply
+                clientsock.settimeout(KEEPALIVE_IDLE_TIMEOUT)
 
                 t = threading.Thread(target=self._handle_peer, args=(clientsock,))
                 t.daemon = True
                 t.start()
             except KeyboardInterrupt:
-                print("KeyboardInterrupt → shutting down")
+                log.info("KeyboardInterrupt → shutting down")
                 self.shutdown = True
             except socket.timeout:
                 continue
             except Exception:
-                if self.debug:
-                    traceback.print_exc()
+                log.debug("accept() failed", exc_info=True)
 
-        self._debug("Main loop exiting")
-        server.close()
+
+# --------------------------------------------------------------------------- #
+# Routing table
+# --------------------------------------------------------------------------- #
+class RoutingTable:
+    """Known peers: peerid → (host, port, peertype), bounded to *capacity*.
+
+    Used like the dict it replaced, but reading an entry marks it recently
+    used, and adding to a full table evicts the least recently used peer
+    instead of refusing the new one. 0 means unbounded. Thread-safe.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = capacity
+        self._entries: OrderedDict[str, tuple[str, int, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, peerid: str, entry: tuple[str, int, str]) -> tuple[bool, list]:
+        """Insert or refresh *peerid*; returns (was new, evicted (pid, entry) pairs)."""
+        evicted = []
+        with self._lock:
+            added = peerid not in self._entries
+            self._entries[peerid] = entry
+            self._entries.move_to_end(peerid)
+            while self.capacity and len(self._entries) > self.capacity:
+                evicted.append(self._entries.popitem(last=False))
+        return added, evicted
+
+    def get(self, peerid: str, default=None):
+        with self._lock:
+            entry = self._entries.get(peerid)
+            if entry is None:
+                return default
+            self._entries.move_to_end(peerid)
+            return entry
+
+    def __getitem__(self, peerid: str) -> tuple[str, int, str]:
+        entry = self.get(peerid)
+        if entry is None:
+            raise KeyError(peerid)
+        return entry
+
+    def pop(self, peerid: str, default=None):
+        with self._lock:
+            return self._entries.pop(peerid, default)
+
+    def recent(self, exclude: set[str] = frozenset()) -> list[str]:
+        """Peer ids, most recently used first (candidate relays)."""
+        with self._lock:
+            return [pid for pid in reversed(self._entries) if pid not in exclude]
+
+    def __contains__(self, peerid: str) -> bool:
+        return peerid in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def items(self) -> list[tuple[str, tuple[str, int, str]]]:
+        with self._lock:
+            return list(self._entries.items())
+
+
+# --------------------------------------------------------------------------- #
+# Idempotent request cache
+# --------------------------------------------------------------------------- #
+class _Completion:
+    __slots__ = ("done", "replies", "finished_at", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.replies: list[tuple[str, str]] = []
+        self.finished_at = 0.0
+        self.waiters = 0                # retries waiting for this run
+
+
+class CompletedRequests:
+    """Replies of recent idempotent requests, keyed by idempotency key.
+
+    begin() tells the first request for a key to run; later ones get the
+    same entry and wait for it. Finished entries expire after *ttl*
+    seconds, and at most *capacity* of them are kept (oldest dropped).
+    """
+
+    def __init__(self, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _Completion] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> tuple[_Completion, bool]:
+        """Return (entry, whether the caller is the first and must run it)."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = self._entries[key] = _Completion()
+            return entry, True
+
+    def finish(self, key: str, entry: _Completion, replies: list[tuple[str, str]]) -> None:
+        entry.replies = replies
+        entry.finished_at = time.monotonic()
+        with self._lock:
+            if not replies:
+                # nothing to replay (the handler failed): let a retry run again
+                self._entries.pop(key, None)
+        entry.done.set()
+
+    @contextlib.contextmanager
+    def waiting(self, entry: _Completion):
+        """Count the caller as interested in *entry* while it waits."""
+        with self._lock:
+            entry.waiters += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry.waiters -= 1
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        finished = [k for k, e in self._entries.items() if e.done.is_set()]
+        excess = len(finished) - self.capacity
+        for k in finished:
+            if excess > 0 or now - self._entries[k].finished_at > self.ttl:
+                del self._entries[k]
+                excess -= 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _RecordingConnection:
+    """Passes replies through to *conn* and keeps a copy of each."""
+
+    def __init__(self, conn: "BTPeerConnection", entry: _Completion):
+        self._conn = conn
+        self._entry = entry
+        self.replies: list[tuple[str, str]] = []
+
+    def senddata(self, msgtype: str, msgdata: str) -> bool:
+        self.replies.append((msgtype, msgdata))
+        return self._conn.senddata(msgtype, msgdata)
+
+    def abandoned(self) -> bool:
+        # a requester that hung up may retry with the same key and attach to
+        # this run, so only a CNCL or the deadline stops it; and not while a
+        # retry is waiting for the result
+        return self._conn.cancelled() and not self._entry.waiters
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
 
 
 # --------------------------------------------------------------------------- #
@@ -287,16 +905,45 @@ class BTPeerConnection:
         port: int,
         *,
         sock: socket.socket | None = None,
-        debug: bool = False,
+        uds: str | None = None,
+        deadline: float | None = None,
     ):
+        """Wrap *sock*, or connect to *uds* (falling back to TCP) or *host*:*port*.
+
+        Connecting takes at most CONNECT_TIMEOUT (less if *deadline*, a
+        time.monotonic() value, is sooner); reads and writes then have
+        until *deadline*.
+        """
         self.id = peerid
-        self.debug = debug
+        self.deadline = deadline
+        self.timed_out = False          # a read or write ran past the deadline
+        # server side: the request being handled
+        self.headers: dict = {}
+        self.cancel = threading.Event()
 
-        if sock:
-            self.s = sock
-        else:
-            self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.s.connect((host, int(port)))
+        if sock is None:
+            connect_timeout = CONNECT_TIMEOUT
+            if deadline is not None:
+                connect_timeout = max(min(connect_timeout, deadline - time.monotonic()), 0.001)
+            if uds and _AF_UNIX is not None:
+                try:
+                    sock = socket.socket(_AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(connect_timeout)
+                    sock.connect(uds)
+                except OSError:
+                    sock.close()
+                    sock = None         # stale or missing socket file: use TCP
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(connect_timeout)
+                sock.connect((host, int(port)))
+            sock.settimeout(None)
+        self.s = sock
+        self._timeout = sock.gettimeout()
+        if self.s.family != _AF_UNIX:
+            # a reply and its DONE frame are separate writes; don't let
+            # Nagle hold the second one back for the delayed ACK
+            self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         # binary read/write, unbuffered
         self.sd = self.s.makefile("rwb", buffering=0)
@@ -310,51 +957,217 @@ class BTPeerConnection:
         msglen = len(msg_bytes)
         return struct.pack(f"!4sL{msglen}s", msgtype.encode(), msglen, msg_bytes)
 
-    def _debug(self, msg: str) -> None:
-        if self.debug:
-            btdebug(msg)
+    def _apply_deadline(self) -> None:
+        """Bound the next socket operation by the time left, if any.
+
+        settimeout() is a system call, so the socket timeout is only
+        lowered once it would overshoot the deadline by more than
+        DEADLINE_SLACK; one shorter than the time left (left over from an
+        earlier request on a pooled connection) is raised at once.
+        """
+        if self.deadline is None:
+            return
+        left = self.deadline - time.monotonic()
+        if left <= 0:
+            raise TimeoutError("deadline passed")
+        if self._timeout is None or self._timeout < left or self._timeout - left > min(DEADLINE_SLACK, left):
+            self.set_timeout(left)
+
+    def set_timeout(self, timeout: float | None) -> None:
+        if timeout != self._timeout:
+            self.s.settimeout(timeout)
+            self._timeout = timeout
+
+    def _read_exact(self, n: int) -> bytes:
+        """Read *n* bytes; a raw socket read may return fewer than asked for."""
+        buf = bytearray(n)
+        view = memoryview(buf)
+        got = 0
+        while got < n:
+            k = self.sd.readinto(view[got:])
+            if not k:
+                return bytes(view[:got])
+            got += k
+        return bytes(buf)
 
     # ----------------------------------------------------------------------- #
     # Public API
     # ----------------------------------------------------------------------- #
-    def senddata(self, msgtype: str, msgdata: str) -> bool:
-        """Send a framed message. Return True on success."""
+    def senddata(self, msgtype: str, msgdata: str, headers: dict | None = None) -> bool:
+        """Send a framed message, preceded by an HDRS frame if *headers*.
+
+        Return True on success.
+        """
         try:
-            self.sd.write(self._make_msg(msgtype, msgdata))
-            self.sd.flush()
+            self._apply_deadline()
+            msg = self._make_msg(msgtype, msgdata)
+            if headers:
+                msg = self._make_msg(HEADERS_MSG, json.dumps(headers)) + msg
+            # sendall: a raw write may send only part of a large frame
+            self.s.sendall(msg)
+            BYTES_OUT.inc(len(msg))
             return True
         except KeyboardInterrupt:
             raise
+        except TimeoutError:
+            self.timed_out = True
+            return False
         except Exception:
-            if self.debug:
-                traceback.print_exc()
+            log.debug("Sending %s failed", msgtype, exc_info=True)
             return False
 
     def recvdata(self) -> tuple[str | None, str | None]:
         """Receive one framed message."""
         try:
+            self._apply_deadline()
             msgtype_raw = self.sd.read(4)
             if not msgtype_raw:
                 return (None, None)
 
-            len_raw = self.sd.read(4)
+            len_raw = self._read_exact(4)
             msglen = struct.unpack("!L", len_raw)[0]
 
-            data = self.sd.read(msglen)
+            data = self._read_exact(msglen)
             if len(data) != msglen:
                 return (None, None)
 
+            BYTES_IN.inc(8 + msglen)
             return (msgtype_raw.decode(), data.decode())
         except KeyboardInterrupt:
             raise
+        except TimeoutError:
+            self.timed_out = True
+            return (None, None)
         except Exception:
-            if self.debug:
-                traceback.print_exc()
+            log.debug("Receiving failed", exc_info=True)
             return (None, None)
 
+    def cancelled(self) -> bool:
+        """Server side: whether the request was cancelled (CNCL) or ran past
+        its deadline."""
+        if self.cancel.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def abandoned(self) -> bool:
+        """Server side: whether the request was cancelled (CNCL), ran past its
+        deadline, or its requester hung up. Long handlers poll this to stop
+        early."""
+        if self.cancelled():
+            return True
+        try:
+            readable, _, _ = select.select([self.s], [], [], 0)
+            # the requester sends nothing while it waits: readable means EOF
+            return bool(readable) and self.s.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
     def close(self) -> None:
         self.s.close()
         self.sd.close()
 
     def __str__(self) -> str:  # pragma: no cover
-        return f"|{self.id}|"
\ No newline at end of file
+        return f"|{self.id}|"
+
+
+# --------------------------------------------------------------------------- #
+# Keep-alive connection pool
+# --------------------------------------------------------------------------- #
+class BTPeerConnectionPool:
+    """Reusable keep-alive connections, keyed by (host, port).
+
+    Each request sends one message and collects replies up to the server's
+    DONE frame, then returns the connection to the pool for the next caller.
+    """
+
+    def __init__(
+        self,
+        max_idle_per_host: int = 4,
+        idle_timeout: float = KEEPALIVE_IDLE_TIMEOUT / 2,
+    ):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, int], list[tuple[float, BTPeerConnection]]] = {}
+
+    def _checkout(self, host: str, port: int, pid: str | None, uds: str | None = None,
+                  deadline: float | None = None):
+        """Return (connection, reused?) for *host*:*port*."""
+        key = (host, int(port))
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                since, conn = idle.pop()
+                if now - since < self.idle_timeout:
+                    conn.id = pid
+                    return conn, True
+                conn.close()
+
+        conn = BTPeerConnection(pid, host, port, uds=uds, deadline=deadline)
+        if not conn.senddata(KEEPALIVE_MSG, ""):
+            conn.close()
+            raise ConnectionError(f"Cannot open keep-alive connection to {host}:{port}")
+        return conn, False
+
+    def _checkin(self, host: str, port: int, conn: "BTPeerConnection") -> None:
+        # the next request sets its own deadline
+        conn.deadline = None
+        conn.set_timeout(None)
+        key = (host, int(port))
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((time.monotonic(), conn))
+                return
+        conn.close()
+
+    def request(
+        self, host: str, port: int, msgtype: str, msgdata: str, *,
+        pid: str | None = None, uds: str | None = None, headers: dict | None = None,
+        deadline: float | None = None,
+    ) -> list[tuple[str, str]]:
+        """Send one message and return its replies.
+
+        A pooled socket the server has already closed is detected by an empty
+        read before any reply; the request is then retried once on a fresh
+        connection. Raises ReplyLost if the connection drops mid-reply, and
+        DeadlineExceeded if *deadline* passes first.
+        """
+        for _ in range(2):
+            conn, reused = self._checkout(host, port, pid, uds, deadline)
+            conn.deadline = deadline
+            replies: list[tuple[str, str]] = []
+            complete = False
+            if conn.senddata(msgtype, msgdata, headers):
+                onereply = conn.recvdata()
+                while onereply != (None, None):
+                    if onereply[0] == REPLY_END_MSG:
+                        complete = True
+                        break
+                    replies.append(onereply)
+                    onereply = conn.recvdata()
+
+            if complete:
+                self._checkin(host, port, conn)
+                return replies
+            conn.close()
+            if conn.timed_out:
+                raise DeadlineExceeded(f"{msgtype} to {host}:{port} ran past its deadline")
+            if replies or not reused:
+                raise ReplyLost(f"Connection to {host}:{port} dropped before {msgtype} completed")
+        raise ReplyLost(f"Connection to {host}:{port} dropped before {msgtype} completed")
+
+    def discard(self, host: str, port: int) -> None:
+        """Close the idle connections to *host*:*port*."""
+        with self._lock:
+            idle = self._idle.pop((host, int(port)), [])
+        for _, conn in idle:
+            conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for _, conn in idle:
+                    conn.close()
+            self._idle.clear()
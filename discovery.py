@@ -0,0 +1,131 @@
+# discovery.py
+"""
+Peer discovery: where peers announce themselves and look each other up.
+
+Two backends share Kademlia's async interface (listen / bootstrap / get /
+set / stop), so callers do not care which one they have:
+
+- kademlia.network.Server – the default; a UDP DHT node per peer on
+                            port + 10000, bootstrapped off 127.0.0.1:7000.
+- LocalRegistry           – for single-host deployments: a JSON file shared
+                            by every peer on the machine, updated under an
+                            exclusive file lock. No sockets, no bootstrap;
+                            a peer is discoverable as soon as it has
+                            written its record.
+
+`make_discovery()` picks one from DISCOVERY ("dht" or "local"); the local
+registry lives at DISCOVERY_FILE (default <tmpdir>/drum-peers.json).
+It relies on fcntl file locks, so it is not available on Windows.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:                 # Windows: no LocalRegistry, the DHT still works
+    fcntl = None
+
+from kademlia.network import Server as KadServer
+
+
+class LocalRegistry:
+    """Kademlia look-alike backed by a file shared by all local peers."""
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("DISCOVERY=local needs fcntl file locks, which this platform lacks; "
+                               "use DISCOVERY=dht")
+        self.path = path
+        self._lock_path = path + ".lock"
+        self._cache: tuple[tuple[int, int], dict] | None = None
+        self._cache_lock = threading.Lock()
+
+    # ---- Kademlia interface ----
+    async def listen(self, port, interface="0.0.0.0"):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    async def bootstrap(self, addrs):
+        return []                   # every local peer already shares the file
+
+    async def get(self, key):
+        return self._read().get(key)
+
+    async def set(self, key, value):
+        with self._locked() as entries:
+            entries[key] = value
+        return True
+
+    def stop(self):
+        pass
+
+    # ---- atomic list update (see announce_service) ----
+    async def add_to_list(self, key, item):
+        with self._locked() as entries:
+            lst = json.loads(entries.get(key) or "[]")
+            if item not in lst:
+                lst.append(item)
+                entries[key] = json.dumps(lst)
+
+    # ---- file access ----
+    def _read(self) -> dict:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._cache_lock:
+            if self._cache and self._cache[0] == stamp:
+                return self._cache[1]
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        with self._cache_lock:
+            self._cache = (stamp, entries)
+        return entries
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Yield the current entries under the lock, then write them back atomically."""
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = dict(self._read())
+                yield entries
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".peers-")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def make_discovery():
+    """Return a new discovery node as selected by DISCOVERY."""
+    if os.getenv("DISCOVERY", "dht").lower() == "local":
+        return LocalRegistry(os.getenv(
+            "DISCOVERY_FILE", os.path.join(tempfile.gettempdir(), "drum-peers.json")))
+    return KadServer()
+
+
+def is_local(kad) -> bool:
+    return isinstance(kad, LocalRegistry)
+
+
+async def announce_service(kad, pid: str, ptype: str) -> None:
+    """Add *pid* to the "svc:<ptype>" list of peers offering that service."""
+    key = f"svc:{ptype.upper()}"
+    if is_local(kad):
+        # one locked read-modify-write, so peers starting together do not drop each other
+        await kad.add_to_list(key, pid)
+        return
+    raw = await kad.get(key)
+    lst = json.loads(raw) if raw else []
+    if pid not in lst:
+        lst.append(pid)
+        await kad.set(key, json.dumps(lst))
@@ -3,93 +3,179 @@
 """
 统一 Blockchain 访问层
 ~~~~~~~~~~~~~~~~~~~~~
-• 如果本机就是 BC 节点 → 直接操作内存中的 `blockchain` 实例
-• 否则 → 自动找到已知的远程 BC 节点，通过 P2P 发送 BCRQ 并等待回应
+• 如果本机就是 BC 节点 → 直接调用本地 `bc_handlers`（含链下 CAS 存储模式）
+• 否则 → 通过 DHT 服务表 (svc:BC) 找到远程 BC 节点，用 BCRQ STORE/FETCH 通信
 
-公开函数
+读请求（FETCH）在多个 BC 节点之间轮询分摊，并用对冲请求（hedged request）：
+超过近期 p95 延迟仍无回复时，向下一个节点再发一份，取先到的结果；整轮失败后
+按带抖动的指数退避重试（见 bt_utils.hedged_request）。
+所有远程调用都走 BTPeer 的 keep-alive 连接池，避免每次重新建连。
+
+写请求（STORE）带幂等键：请求已发出但回复丢失时，只向同一节点用同一个键
+重试（BC 节点按键去重，不会重复上链）；只有请求根本没发出去时才换节点。
+
+公开接口
 --------
-add_data(peer, data)      – 把 data 放入 pending 池
-mine_block(peer)          – 打包 pending 数据并挖新区块，返回区块 dict
-get_chain(peer)           – 获得完整链 list[block]
-query(peer, key, value)   – 简易筛选（可选）
+BCClient(peer, kad, loop)
+    .store(data, key=None) – 写入链上（非 str 的 data 会先 json.dumps；key 为幂等键）
+    .fetch()              – 获得链上全部字符串 list[str]
+    .query(key, value)    – 简易筛选：返回解析为 dict 且 data[key] == value 的记录
 """
 from __future__ import annotations
 
+import itertools
 import json
+import threading
+import time
+import uuid
 from typing import Any, Callable, Dict, List
 
-from bc_handlers import blockchain   # 本地实例（若 peertype == BC）
+from bt_utils import find_peers_for_service, hedged_request
+from btpeer import PeerUnreachable, ReplyLost
 
+# DHT 服务表查询结果的缓存时间（秒）
+PROVIDER_CACHE_TTL = 10.0
+# STORE 回复丢失时，对同一节点的重试次数
+STORE_RETRIES = 2
+# 单次 BCRQ 的超时（秒）；STORE 要等交易回执
+RPC_TIMEOUT = 60.0
 
-# ------------------------------------------------------------------ #
-# 内部工具
-# ------------------------------------------------------------------ #
-def _find_bc_peer(peer) -> str | None:
-    """返回第一个已知 BC peer 的 peerid；若无返回 None。"""
-    for pid, (_, _, ptype) in peer.peers.items():
-        if ptype == "BC":
-            return pid
-    return None
 
+class BCError(RuntimeError):
+    """BC 节点返回 ERR，或没有任何 BC 节点可用。"""
 
-def _rpc(peer, cmd: str, payload: str | None = None):
-    """向远程 BC 节点发送 BCRQ 并返回反序列化后的 JSON 对象。"""
-    target = _find_bc_peer(peer)
-    if not target:
-        raise RuntimeError("No known BC peer")
 
-    msg = cmd.upper() if payload is None else f"{cmd.upper()} {payload}"
-    replies = peer.send_to_peer(target, "BCRQ", msg, waitreply=True)
-    if not replies:
-        raise RuntimeError("No reply from BC peer")
+# ------------------------------------------------------------------ #
+# 内部工具
+# ------------------------------------------------------------------ #
+def _local_bc():
+    """延迟导入本地 BC 处理模块（若 peertype == BC），避免 import 时连接节点。"""
+    from handlers import bc_handlers
+    return bc_handlers
 
-    mtype, mdata = replies[0]
-    if mtype != "BCRS":
-        raise RuntimeError(f"Unexpected reply type: {mtype}")
 
-    obj = json.loads(mdata)
-    if obj.get("type") == "ERROR":
-        raise RuntimeError(obj["data"])
-    return obj
+def _parse_reply(replies: list[tuple[str, str]] | None) -> Dict[str, Any]:
+    for mtype, mdata in replies or []:
+        if mtype == "BCRS":
+            obj = json.loads(mdata)
+            if obj.get("type") == "ERR":
+                raise BCError(obj.get("msg", "unknown BC error"))
+            return obj
+    raise ConnectionError("No BCRS reply from BC peer")
 
 
 # ------------------------------------------------------------------ #
 # 公共 API
 # ------------------------------------------------------------------ #
-def add_data(peer, data: Any) -> None:
-    """写数据（本地或远程）。"""
-    if getattr(peer, "peertype", "").upper() == "BC":
-        blockchain.add_data(data)
-    else:
-        _rpc(peer, "TXN", json.dumps(data))
-
-
-def mine_block(peer) -> Dict[str, Any]:
-    """挖矿（本地或远程），返回新区块 dict。"""
-    if getattr(peer, "peertype", "").upper() == "BC":
-        return blockchain.mine_block()
-    return _rpc(peer, "MINE")["data"]
-
-
-def get_chain(peer) -> List[Dict[str, Any]]:
-    """获取完整链 list[block]。"""
-    if getattr(peer, "peertype", "").upper() == "BC":
-        return blockchain.get_chain()
-    return _rpc(peer, "GET")["data"]
-
-
-# 可选：按键值过滤区块
-def query(
-        peer,
-        key: str,
-        value: Any,
-        predicate: Callable[[Any], bool] | None = None,
-) -> List[Dict[str, Any]]:
-    """
-    返回所有含指定 (key, value) 的区块；或使用自定义 predicate(tx)。
-    """
-    if predicate is None:
-        predicate = lambda tx: isinstance(tx, dict) and tx.get(key) == value  # type: ignore[arg-type]
-
-    chain = get_chain(peer)
-    return [blk for blk in chain if any(predicate(tx) for tx in blk["data"])]
\ No newline at end of file
+class BCClient:
+    """面向 web 应用和 CLI 的 BC 客户端。"""
+
+    def __init__(self, peer, kad, loop):
+        self.peer = peer
+        self.kad = kad
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._providers: list[str] = []
+        self._providers_at = 0.0
+        self._rr = itertools.count()
+
+    @property
+    def is_local(self) -> bool:
+        return getattr(self.peer, "peertype", "").upper() == "BC"
+
+    def providers(self, refresh: bool = False) -> list[str]:
+        """返回已知 BC 节点列表（DHT 服务表 + 本地 peers 表，去重）。"""
+        with self._lock:
+            fresh = time.monotonic() - self._providers_at < PROVIDER_CACHE_TTL
+            if self._providers and fresh and not refresh:
+                return list(self._providers)
+
+        found = find_peers_for_service(self.kad, self.loop, "BC")
+        found += [pid for pid, (_, _, ptype) in list(self.peer.peers.items()) if ptype == "BC"]
+        providers = [pid for pid in dict.fromkeys(found) if pid != self.peer.myid]
+
+        with self._lock:
+            self._providers = providers
+            self._providers_at = time.monotonic()
+        return list(providers)
+
+    def _rpc(self, msg: str, *, key: str | None = None) -> Dict[str, Any]:
+        """把 BCRQ 发给一个 BC 节点；请求没发出去时依次尝试其它节点。
+
+        带 key（幂等键）的请求一旦发出，回复丢失时只对同一节点重试。
+        """
+        providers = self.providers()
+        if not providers:
+            providers = self.providers(refresh=True)
+        if not providers:
+            raise BCError("No known BC peer")
+
+        last_error: Exception | None = None
+        for pid in providers:
+            for _ in range(1 + (STORE_RETRIES if key else 0)):
+                try:
+                    replies = self.peer.send_to_peer(pid, "BCRQ", msg, waitreply=True, keepalive=True,
+                                                     idempotency_key=key, timeout=RPC_TIMEOUT,
+                                                     raise_errors=True)
+                    return _parse_reply(replies)
+                except PeerUnreachable as e:
+                    last_error = e
+                    break                       # 没发出去：换下一个节点
+                except (ReplyLost, ConnectionError) as e:
+                    last_error = e              # 可能已执行：同一节点、同一个键重试
+            else:
+                if key:
+                    break                       # 不能换节点，否则可能重复写入
+        # 所有节点都失败：下次重新查询 DHT
+        with self._lock:
+            self._providers_at = 0.0
+        raise BCError(f"All BC peers failed: {last_error}")
+
+    def store(self, data: Any, key: str | None = None) -> None:
+        """写入链上（本地或远程）。key：幂等键，重复调用同一个 key 只写一次。"""
+        text = data if isinstance(data, str) else json.dumps(data)
+        if self.is_local:
+            _local_bc().store(self.peer, text)
+            return
+        self._rpc(f"STORE {text}", key=key or uuid.uuid4().hex)
+
+    def fetch(self) -> List[str]:
+        """获取链上全部字符串（本地或远程）。"""
+        if self.is_local:
+            return _local_bc().fetch(self.peer, self.providers)
+        providers = self.providers() or self.providers(refresh=True)
+        if not providers:
+            raise BCError("No known BC peer")
+        start = next(self._rr) % len(providers)
+        try:
+            reply = hedged_request(self.peer, providers[start:] + providers[:start], "BCRQ", "FETCH",
+                                   _parse_reply, timeout=RPC_TIMEOUT, op="BCRQ FETCH")
+        except BCError:
+            raise
+        except Exception as e:
+            # 下次重新查询 DHT
+            with self._lock:
+                self._providers_at = 0.0
+            raise BCError(f"All BC peers failed: {e}") from e
+        return reply["data"]
+
+    # 可选：按键值过滤记录
+    def query(
+            self,
+            key: str,
+            value: Any,
+            predicate: Callable[[Any], bool] | None = None,
+    ) -> List[Any]:
+        """
+        返回所有 JSON 记录中含指定 (key, value) 的条目；或使用自定义 predicate(record)。
+        """
+        if predicate is None:
+            predicate = lambda rec: isinstance(rec, dict) and rec.get(key) == value  # type: ignore[arg-type]
+
+        records = []
+        for text in self.fetch():
+            try:
+                records.append(json.loads(text))
+            except json.JSONDecodeError:
+                records.append(text)
+        return [rec for rec in records if predicate(rec)]
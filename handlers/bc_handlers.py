@@ -1,121 +1,331 @@
 #!/usr/bin/env python3
 """
 This module (bc_handlers.py) bridges your P2P network peers with an on-chain Solidity contract. In brief, it:
-- Connects to a Hardhat local blockchain.
+- Connects to a Hardhat local blockchain (lazily, on first use).
 - Loads the ABI and address of a deployed Solidity contract.
 - Provides functions to add strings to the contract and fetch all stored strings.
 - Implements handlers for P2P BC requests and responses.
 - Uses the Web3.py library to interact with the Ethereum blockchain.
 - Uses the dotenv library to load environment variables.
-- Uses the json library to handle JSON data.
-- Uses the os and pathlib libraries to manage file paths and environment variables.
+- Optionally (BC_STORAGE_MODE=cas) keeps payloads off-chain in a local
+  content-addressed store and writes only their digest on-chain.
+- With BC_BACKEND=memory, keeps the chain in process memory instead of
+  talking to a node (for tests and benchmarks; nothing is persisted).
+
+Importing this module is cheap: nothing touches the network or the filesystem
+until the first STORE/FETCH (or an explicit `chain.init()`).
 """
 
 from __future__ import annotations
+import base64
 import json
+import logging
 import os
 import pathlib
-from typing import Any, List
-from dotenv import load_dotenv
-from web3 import Web3
-from web3.contract import Contract
-import pathlib
+import threading
+import time
+from typing import Any, Callable, List
 
-# Load environment variables
-load_dotenv()
-RPC_URL = os.getenv("RPC_URL", "http://127.0.0.1:8545")
-PRIVATE_KEY = os.getenv("PRIVATE_KEY")
-CHAIN_ID = int(os.getenv("CHAIN_ID", 31337))
-
-if not PRIVATE_KEY:
-    raise RuntimeError("PRIVATE_KEY is not set. Please add it to .env")
-
-# Connect to Hardhat network
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
-if not w3.is_connected():
-    raise RuntimeError(f"Cannot connect to node at {RPC_URL}")
-
-ACCOUNT = w3.eth.account.from_key(PRIVATE_KEY).address
-
-# Load contract ABI and address
-ARTIFACT_PATH = pathlib.Path(__file__).resolve().parent.parent / \
-    "artifacts/contracts/StringChain.sol/StringChain.json"
-
-if ARTIFACT_PATH.exists():
-    with open(ARTIFACT_PATH) as f:
-        abi = json.load(f)["abi"]
-else:
-    abi = [
-        {
-            "inputs": [{"internalType": "string", "name": "data", "type": "string"}],
-            "name": "addData",
-            "outputs": [],
-            "stateMutability": "nonpayable",
-            "type": "function"
-        },
-        {
-            "inputs": [],
-            "name": "getAll",
-            "outputs": [{"internalType":"string[]", "name":"", "type":"string[]"}],
-            "stateMutability": "view",
-            "type": "function"
-        }
-    ]
+import metrics
+from handlers.blob_store import ContentStore, digest_of, make_ref, parse_ref
+from handlers.bc_provider import ProviderConfig, batch_call, make_provider
+
+# Fallback ABI used when the Hardhat artifact has not been compiled locally
+DEFAULT_ABI = [
+    {
+        "inputs": [{"internalType": "string", "name": "data", "type": "string"}],
+        "name": "addData",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "getAll",
+        "outputs": [{"internalType":"string[]", "name":"", "type":"string[]"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent.parent
+ARTIFACT_PATH = PROJECT_ROOT / "artifacts/contracts/StringChain.sol/StringChain.json"
+
+log = logging.getLogger(__name__)
+
+TX_CONFIRM_SECONDS = metrics.histogram("bc_tx_confirm_seconds", "Time from sending a transaction to its receipt")
 
-ADDRESS_FILE = pathlib.Path("stringchain.addr")
-if not ADDRESS_FILE.exists():
-    fallback_path = pathlib.Path(__file__).resolve().parent.parent / "stringchain.addr"
+
+def _load_abi() -> list[dict[str, Any]]:
+    if ARTIFACT_PATH.exists():
+        with open(ARTIFACT_PATH) as f:
+            return json.load(f)["abi"]
+    return DEFAULT_ABI
+
+
+def _find_address_file() -> pathlib.Path:
+    address_file = pathlib.Path("stringchain.addr")
+    if address_file.exists():
+        return address_file
+    fallback_path = PROJECT_ROOT / "stringchain.addr"
     if fallback_path.exists():
-        ADDRESS_FILE = fallback_path
-    else:
-        raise FileNotFoundError("stringchain.addr not found in current directory or fallback path. Deploy the contract first.")
-
-CONTRACT_ADDRESS = ADDRESS_FILE.read_text().strip()
-contract: Contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=abi)
-
-def _fill_fee_fields(tx: dict[str, Any]) -> None:
-    """Ensure tx dict has gas and gas price fields."""
-    if not tx.get("gas"):
-        tx["gas"] = w3.eth.estimate_gas(tx)
-    if "gasPrice" not in tx and "maxFeePerGas" not in tx:
-        tx["gasPrice"] = w3.eth.gas_price or Web3.toWei(1, "gwei")
-
-def _send_tx(tx: dict[str, Any]) -> None:
-    """Sign and send a raw transaction."""
-    _fill_fee_fields(tx)
-    signed = w3.eth.account.sign_transaction(tx, private_key=PRIVATE_KEY)
-    raw_tx = getattr(signed, "raw_transaction", None) or getattr(signed, "rawTransaction", signed)
-    tx_hash = w3.eth.send_raw_transaction(raw_tx)
-    w3.eth.wait_for_transaction_receipt(tx_hash)
+        return fallback_path
+    raise FileNotFoundError("stringchain.addr not found in current directory or fallback path. Deploy the contract first.")
+
+
+# --------------------------------------------------------------------------- #
+# Lazily initialised chain client
+# --------------------------------------------------------------------------- #
+class StringChainClient:
+    """Connection to the StringChain contract, created on first use.
+
+    Configuration comes from the environment (and `.env`) when `init()` runs:
+    PRIVATE_KEY, CHAIN_ID and the provider settings read by
+    `ProviderConfig.from_env` (RPC_URL, RPC_POOL_SIZE, ...).
+    """
+
+    def __init__(self, session=None):
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()        # serialises nonce use
+        self._ready = False
+        self._session = session
+        self.config: ProviderConfig | None = None
+        self.private_key: str | None = None
+        self.chain_id: int | None = None
+        self.w3 = None
+        self.account: str | None = None
+        self.contract = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def init(self) -> "StringChainClient":
+        """Connect to the node and load the contract (idempotent)."""
+        if self._ready:
+            return self
+        with self._lock:
+            if self._ready:
+                return self
+
+            from dotenv import load_dotenv
+            from web3 import Web3
+
+            load_dotenv()
+            config = ProviderConfig.from_env()
+            private_key = os.getenv("PRIVATE_KEY")
+            chain_id = int(os.getenv("CHAIN_ID", 31337))
+            if not private_key:
+                raise RuntimeError("PRIVATE_KEY is not set. Please add it to .env")
+
+            w3 = Web3(make_provider(config, session=self._session))
+            if not w3.is_connected():
+                raise RuntimeError(f"Cannot connect to node at {config.rpc_url}")
+
+            address = _find_address_file().read_text().strip()
+
+            self.config = config
+            self.private_key = private_key
+            self.chain_id = chain_id
+            self.w3 = w3
+            self.account = w3.eth.account.from_key(private_key).address
+            self.contract = w3.eth.contract(address=address, abi=_load_abi())
+            self._ready = True
+        return self
+
+    # ----------------------------------------------------------------------- #
+    # Transactions
+    # ----------------------------------------------------------------------- #
+    def _prepare_tx(self, text: str) -> dict[str, Any]:
+        """Build a fully populated addData transaction.
+
+        Nonce, gas price and gas estimate do not depend on each other, so
+        they are fetched in a single JSON-RPC batch round trip.
+        """
+        from web3 import Web3
+
+        data = self.contract.encode_abi("addData", args=[text])
+        call = {"from": self.account, "to": self.contract.address, "data": data}
+        eth = self.w3.eth
+        nonce, gas_price, gas = batch_call(self.w3, [
+            lambda: eth.get_transaction_count(self.account, "pending"),
+            lambda: eth.gas_price,
+            lambda: eth.estimate_gas(call),
+        ], enabled=self.config.batch)
+
+        return {
+            **call,
+            "nonce": nonce,
+            "gas": gas,
+            "gasPrice": gas_price or Web3.to_wei(1, "gwei"),
+            "chainId": self.chain_id,
+        }
+
+    def add(self, text: str) -> None:
+        """Add a string to the on-chain contract."""
+        self.init()
+        with self._send_lock:
+            tx = self._prepare_tx(text)
+            signed = self.w3.eth.account.sign_transaction(tx, private_key=self.private_key)
+            raw_tx = getattr(signed, "raw_transaction", None) or getattr(signed, "rawTransaction", signed)
+            tx_hash = self.w3.eth.send_raw_transaction(raw_tx)
+            sent_at = time.perf_counter()
+        self.w3.eth.wait_for_transaction_receipt(
+            tx_hash, poll_latency=self.config.poll_latency
+        )
+        TX_CONFIRM_SECONDS.observe(time.perf_counter() - sent_at)
+
+    def fetch_all(self) -> List[str]:
+        """Retrieve all stored strings from the contract."""
+        self.init()
+        return self.contract.functions.getAll().call()
+
+
+class MemoryChain:
+    """In-process stand-in for StringChainClient (BC_BACKEND=memory).
+
+    Each add() waits BC_MEMORY_BLOCK_TIME seconds (default 0), one
+    transaction at a time, to mimic block confirmation.
+    """
+
+    def __init__(self, block_time: float | None = None):
+        self.block_time = float(os.getenv("BC_MEMORY_BLOCK_TIME", 0)) if block_time is None else block_time
+        self._lock = threading.Lock()
+        self._data: List[str] = []
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def init(self) -> "MemoryChain":
+        return self
+
+    def add(self, text: str) -> None:
+        sent_at = time.perf_counter()
+        with self._lock:
+            if self.block_time:
+                time.sleep(self.block_time)
+            self._data.append(text)
+        TX_CONFIRM_SECONDS.observe(time.perf_counter() - sent_at)
+
+    def fetch_all(self) -> List[str]:
+        with self._lock:
+            return list(self._data)
+
+
+# Shared per-process client; nothing is connected until first use
+chain = MemoryChain() if os.getenv("BC_BACKEND", "node").lower() == "memory" else StringChainClient()
+
 
 def add_onchain(text: str) -> None:
     """Add a string to the on-chain contract."""
-    tx = contract.functions.addData(text).build_transaction({
-        "from": ACCOUNT,
-        "nonce": w3.eth.get_transaction_count(ACCOUNT),
-        "chainId": CHAIN_ID
-    })
-    _send_tx(tx)
+    chain.add(text)
 
 def fetch_all() -> List[str]:
     """Retrieve all stored strings from the contract."""
-    return contract.functions.getAll().call()
+    return chain.fetch_all()
+
+# --------------------------------------------------------------------------- #
+# Off-chain (content-addressed) storage
+# --------------------------------------------------------------------------- #
+_blobs: ContentStore | None = None
+_blobs_lock = threading.Lock()
+
+def blob_store() -> ContentStore:
+    """The local blob store, created on first use so `.env` can set BC_BLOB_DIR."""
+    global _blobs
+    if _blobs is None:
+        with _blobs_lock:
+            if _blobs is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _blobs = ContentStore(os.getenv("BC_BLOB_DIR") or PROJECT_ROOT / "blobs")
+    return _blobs
+
+def _storage_mode() -> str:
+    return os.getenv("BC_STORAGE_MODE", "onchain").lower()
+
+def _fetch_blob_from_peers(peer, digest: str,
+                           providers: Callable[[], List[str]] | None = None) -> bytes | None:
+    """Ask the other BC peers for a blob we do not hold locally.
+
+    Asks the BC peers in *providers()* (e.g. BCClient.providers, which reads
+    the DHT service table) and then those in our own peers table.
+    """
+    candidates = list(providers()) if providers is not None else []
+    candidates += [pid for pid, (_, _, ptype) in list(peer.peers.items()) if ptype == "BC"]
+    for pid in dict.fromkeys(candidates):
+        if pid == peer.myid:
+            continue
+        replies = peer.send_to_peer(pid, "BCRQ", f"BLOB {digest}", waitreply=True, keepalive=True)
+        for mtype, mdata in replies or []:
+            if mtype != "BCRS":
+                continue
+            reply = json.loads(mdata)
+            if reply.get("type") != "BLOB":
+                continue
+            data = base64.b64decode(reply["data"])
+            if digest_of(data) != digest:   # only keep what matches the on-chain digest
+                log.warning("Blob %s from %s does not match its digest", digest, pid)
+                continue
+            blob_store().put(data)
+            return data
+    return None
+
+def store(peer, text: str) -> dict[str, Any]:
+    """Store *text*, on-chain or as an on-chain digest of an off-chain blob."""
+    chain.init()    # loads .env, which may set BC_STORAGE_MODE
+    if _storage_mode() != "cas":
+        add_onchain(text)
+        return {"type": "ACK", "msg": "stored"}
+
+    data = text.encode()
+    digest = blob_store().put(data)
+    add_onchain(json.dumps(make_ref(digest, len(data))))
+    return {"type": "ACK", "msg": "stored", "digest": digest}
+
+def resolve(peer, entry: str, providers: Callable[[], List[str]] | None = None) -> str:
+    """Replace an on-chain blob reference with the verified blob content."""
+    ref = parse_ref(entry)
+    if ref is None:
+        return entry
+    digest = ref["cas"]
+    data = blob_store().get(digest)
+    if data is None and peer is not None:
+        data = _fetch_blob_from_peers(peer, digest, providers)
+    if data is None:
+        log.warning("Blob %s unavailable; returning reference", digest)
+        return entry
+    return data.decode()
+
+def fetch(peer, providers: Callable[[], List[str]] | None = None) -> List[str]:
+    """Retrieve all stored strings, resolving off-chain blob references.
+
+    *providers* lists the BC peers to ask for blobs missing locally.
+    """
+    return [resolve(peer, entry, providers) for entry in fetch_all()]
 
-def bc_request_handler(peer, conn, msg: str) -> None:
+def bc_request_handler(peer, conn, msg: str,
+                       providers: Callable[[], List[str]] | None = None) -> None:
     """Handle incoming P2P BC requests."""
     cmd, *rest = msg.split(maxsplit=1)
     cmd = cmd.upper()
     payload = rest[0] if rest else ""
     try:
         if cmd == "STORE":
-            add_onchain(payload)
-            response = {"type": "ACK", "msg": "stored"}
+            response = store(peer, payload)
         elif cmd == "FETCH":
-            response = {"type": "ALL", "data": fetch_all()}
+            response = {"type": "ALL", "data": fetch(peer, providers)}
+        elif cmd == "BLOB":
+            data = blob_store().get(payload.strip())
+            if data is None:
+                response = {"type": "ERR", "msg": f"Unknown blob {payload.strip()}"}
+            else:
+                response = {"type": "BLOB", "data": base64.b64encode(data).decode()}
         else:
             response = {"type": "ERR", "msg": f"Unknown command {cmd}"}
     except Exception as e:
-        print(f"[BC-RX] Request failed: {e}")
+        log.warning("%s request failed: %s", cmd, e)
         response = {"type": "ERR", "msg": str(e)}
 
     if conn:
@@ -126,13 +336,13 @@ def bc_response_handler(_peer, msg: str) -> None:
     try:
         data = json.loads(msg)
     except json.JSONDecodeError:
-        print(f"[BC-RX] Non-JSON response: {msg}")
+        log.warning("Non-JSON BC response: %.200s", msg)
         return
 
     typ = data.get("type")
     if typ == "ACK":
-        print("✓ Data stored on-chain")
+        log.info("✓ Data stored on-chain")
     elif typ == "ALL":
-        print("→ On-chain data:", data.get("data"))
+        log.info("→ On-chain data: %s", data.get("data"))
     else:
-        print("⚠️ Error:", data.get("msg"))
+        log.warning("⚠️ Error: %s", data.get("msg"))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+bc_provider.py – Web3 provider construction for the BC peer.
+
+The provider is chosen from the RPC_URL scheme:
+- http:// / https://  → HTTPProvider on a pooled keep-alive requests session
+- ws:// / wss://      → persistent WebSocket connection
+- ipc:// or a path    → IPC socket (e.g. a geth node on the same host)
+
+Tuning knobs (all optional, read from the environment):
+- RPC_POOL_SIZE    connections kept alive in the HTTP pool   (default 10)
+- RPC_TIMEOUT      per-request timeout in seconds            (default 10)
+- RPC_BATCH        use JSON-RPC batch requests, 1/0          (default 1)
+- RPC_POLL_LATENCY receipt polling interval in seconds       (default 0.05)
+"""
+
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+
+
+@dataclass
+class ProviderConfig:
+    rpc_url: str = "http://127.0.0.1:8545"
+    pool_size: int = 10
+    timeout: float = 10.0
+    batch: bool = True
+    poll_latency: float = 0.05
+
+    @classmethod
+    def from_env(cls) -> "ProviderConfig":
+        return cls(
+            rpc_url=os.getenv("RPC_URL", cls.rpc_url),
+            pool_size=int(os.getenv("RPC_POOL_SIZE", cls.pool_size)),
+            timeout=float(os.getenv("RPC_TIMEOUT", cls.timeout)),
+            batch=os.getenv("RPC_BATCH", "1") not in ("0", "false", "no"),
+            poll_latency=float(os.getenv("RPC_POLL_LATENCY", cls.poll_latency)),
+        )
+
+    @property
+    def scheme(self) -> str:
+        if self.rpc_url.startswith(("http://", "https://")):
+            return "http"
+        if self.rpc_url.startswith(("ws://", "wss://")):
+            return "ws"
+        return "ipc"
+
+
+def make_session(pool_size: int):
+    """Return a requests session that keeps connections to the node alive."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_provider(config: ProviderConfig, session=None):
+    """Build the Web3 provider described by *config*.
+
+    *session* overrides the pooled HTTP session (used by the benchmarks to
+    count round trips); it is ignored for WebSocket and IPC providers.
+    """
+    from web3 import Web3
+
+    if config.scheme == "http":
+        return Web3.HTTPProvider(
+            config.rpc_url,
+            request_kwargs={"timeout": config.timeout},
+            session=session or make_session(config.pool_size),
+        )
+    if config.scheme == "ws":
+        return Web3.LegacyWebSocketProvider(
+            config.rpc_url, websocket_timeout=config.timeout
+        )
+    path = config.rpc_url.removeprefix("ipc://")
+    return Web3.IPCProvider(path, timeout=config.timeout)
+
+
+def batch_call(w3, calls, *, enabled: bool = True) -> list:
+    """Run independent RPC calls, in one JSON-RPC batch when possible.
+
+    *calls* is a list of zero-argument callables issuing one RPC each, e.g.
+    ``lambda: w3.eth.get_transaction_count(addr)``. If the provider cannot
+    batch, the calls are made one after another instead.
+    """
+    if enabled:
+        try:
+            with w3.batch_requests() as batch:
+                for call in calls:
+                    batch.add(call())
+                return list(batch.execute())
+        except (NotImplementedError, AttributeError, TypeError):
+            pass
+    return [call() for call in calls]
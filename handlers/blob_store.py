@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+blob_store.py – local content-addressed storage for off-chain BC payloads.
+
+Blobs are stored under <root>/<first two hex chars>/<sha256 hex> and are
+verified against their digest whenever they are read back. On-chain, a blob
+is represented by a small JSON reference:
+
+    {"cas": "sha256:<hex>", "size": <bytes>, "ts": <unix time>}
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+from typing import Any
+
+DIGEST_PREFIX = "sha256:"
+
+
+def digest_of(data: bytes) -> str:
+    return DIGEST_PREFIX + hashlib.sha256(data).hexdigest()
+
+
+def make_ref(digest: str, size: int) -> dict[str, Any]:
+    return {"cas": digest, "size": size, "ts": int(time.time())}
+
+
+def parse_ref(entry: str) -> dict[str, Any] | None:
+    """Return the reference dict if *entry* is an on-chain blob reference."""
+    if not entry.startswith('{"cas"'):
+        return None
+    try:
+        ref = json.loads(entry)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(ref, dict) and str(ref.get("cas", "")).startswith(DIGEST_PREFIX):
+        return ref
+    return None
+
+
+class ContentStore:
+    """Write-once blob store addressed by SHA-256 digest."""
+
+    def __init__(self, root: str | os.PathLike):
+        self.root = pathlib.Path(root)
+
+    def _path(self, digest: str) -> pathlib.Path:
+        hexdigest = digest.removeprefix(DIGEST_PREFIX)
+        if len(hexdigest) != 64 or not all(c in "0123456789abcdef" for c in hexdigest):
+            raise ValueError(f"Invalid digest: {digest}")
+        return self.root / hexdigest[:2] / hexdigest
+
+    def put(self, data: bytes) -> str:
+        """Store *data* and return its digest (no-op if already present)."""
+        digest = digest_of(data)
+        path = self._path(digest)
+        if path.exists():
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file and rename so readers never see partial blobs
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes | None:
+        """Return the verified blob for *digest*, or None if absent/corrupt."""
+        path = self._path(digest)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        if digest_of(data) != digest:
+            path.unlink(missing_ok=True)
+            return None
+        return data
+
+    def has(self, digest: str) -> bool:
+        return self._path(digest).exists()
@@ -1,28 +1,35 @@
 import json
+import logging
+import os
+import random
+import threading
+import time
 from datetime import datetime
-import paho.mqtt.client as mqtt, ssl
+
+log = logging.getLogger(__name__)
 
 iot_data_log = []
 
 def iot_response_handler(peer, msgdata):
     try:
         data = json.loads(msgdata)
-        print(data)
         if isinstance(data, list):
-            print(f"[{peer.myid}] IoT Data Received ({len(data)} entries):")
-            for entry in data:
-                print(f" - {entry['timestamp']} | Vibration: {entry['vibration_level']} | Noise (db): {entry['room_noise (db)']}")
+            log.info("[%s] IoT Data Received (%d entries)", peer.myid, len(data))
+            if log.isEnabledFor(logging.DEBUG):
+                for entry in data:
+                    log.debug(" - %s | Vibration: %s | Noise (db): %s",
+                              entry['timestamp'], entry['vibration_level'], entry['room_noise (db)'])
         elif isinstance(data, dict) and "error" in data:
-            print(f"[{peer.myid}] IoT Error: {data['error']}")
+            log.warning("[%s] IoT Error: %s", peer.myid, data['error'])
         else:
-            print(f"[{peer.myid}] Unknown IoT response format: {data}")
+            log.warning("[%s] Unknown IoT response format: %.200s", peer.myid, data)
     except Exception as e:
-        print(f"[{peer.myid}] Failed to parse IoT response: {msgdata} ({e})")
+        log.warning("[%s] Failed to parse IoT response: %.200s (%s)", peer.myid, msgdata, e)
 
 from datetime import datetime, timezone
 
 def iot_request_handler(peer, conn, msgdata):
-    print(f"[{peer.myid}] Received IoT request with time filter: {msgdata}")
+    log.debug("[%s] Received IoT request with time filter: %s", peer.myid, msgdata)
     try:
         start_time_str, end_time_str = msgdata.split("|")
 
@@ -39,10 +46,10 @@ def iot_request_handler(peer, conn, msgdata):
                 if start_time <= entry_time <= end_time:
                     filtered_data.append(entry)
             except Exception as parse_err:
-                print(f"[{peer.myid}] Skipping malformed timestamp: {entry['timestamp']} ({parse_err})")
+                log.debug("[%s] Skipping malformed timestamp: %s (%s)", peer.myid, entry['timestamp'], parse_err)
                 continue
 
-        print(f"[{peer.myid}] Filtered {len(filtered_data)} entries")
+        log.debug("[%s] Filtered %d entries", peer.myid, len(filtered_data))
         conn.senddata("IORS", json.dumps(filtered_data))
 
     except Exception as e:
@@ -59,6 +66,7 @@ def on_message(client, userdata, msg):
     # print(f"[{peer.myid}] Logged IoT data: {data}")
 
 def start_aws_iot_listener():
+    import paho.mqtt.client as mqtt, ssl     # only needed for the real feed
     client = mqtt.Client(client_id="drum-vibration-subscriber")
     client.tls_set(ca_certs="root-CA.crt",
                    certfile="vibration_sensor.cert.pem",
@@ -68,4 +76,38 @@ def start_aws_iot_listener():
 
     client.on_message = on_message
     client.connect("a23b8qpya3dwq-ats.iot.us-east-1.amazonaws.com", 8883, 60)
-    client.loop_start()
\ No newline at end of file
+    client.loop_start()
+
+def _synthetic_entry(ts: datetime) -> dict:
+    return {
+        "timestamp": ts.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        "vibration_level": round(random.uniform(0, 100), 2),
+        "room_noise (db)": round(random.uniform(40, 95), 1),
+    }
+
+def start_synthetic_feed(rate: float | None = None, backfill: float | None = None):
+    """Append fake sensor readings to iot_data_log, *rate* per second.
+
+    Stands in for the AWS IoT subscription on a single box; *backfill*
+    seconds of past readings are added first so queries find data at once.
+    """
+    rate = rate or float(os.getenv("IOT_SYNTHETIC_RATE", 10))
+    backfill = float(os.getenv("IOT_SYNTHETIC_BACKFILL", 600)) if backfill is None else backfill
+    now = time.time()
+    step = 1 / rate
+    iot_data_log.extend(_synthetic_entry(datetime.fromtimestamp(now - backfill + i * step, timezone.utc))
+                        for i in range(int(backfill * rate)))
+
+    def _feed():
+        while True:
+            time.sleep(step)
+            iot_data_log.append(_synthetic_entry(datetime.now(timezone.utc)))
+
+    threading.Thread(target=_feed, daemon=True, name="iot-synthetic").start()
+
+def start_iot_feed():
+    """Start the sensor feed named by IOT_FEED: "aws" (default) or "synthetic"."""
+    if os.getenv("IOT_FEED", "aws").lower() == "synthetic":
+        start_synthetic_feed()
+    else:
+        start_aws_iot_listener()
\ No newline at end of file
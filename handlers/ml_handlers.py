@@ -1,61 +1,179 @@
 import base64
-import tempfile
+import cProfile
 import cv2
 import requests
 import json
+import logging
 from collections import defaultdict
-import urllib.request
 import os
+import random
+import re
+import tempfile
+import time
 from datetime import timedelta
+import metrics
+from blob_transport import fetch_blob, is_blob_url
+from btpeer import REQUEST_ID_HEADER, current_trace, time_left
+
+log = logging.getLogger(__name__)
+
+# inference API; point it at a stub server for local runs (see benchmarks/bench_cluster.py)
+PREDICT_URL = os.getenv("ML_PREDICT_URL", "http://34.29.29.124:8080/predict")
+
+FRAMES = metrics.counter("ml_frames_total", "Video frames sent for inference")
+INFERENCE_SECONDS = metrics.histogram("ml_inference_seconds", "Round trip of one /predict call")
+FRAMES_PER_SECOND = metrics.gauge("ml_frames_per_second", "Throughput of the last analysed video")
+VIDEOS = metrics.counter("ml_videos_total", "Videos analysed, by outcome", ["result"])
+STAGE_SECONDS = metrics.histogram("ml_stage_seconds", "Per-frame time in each pipeline stage (sampled frames)",
+                                  ["stage"])
+
+# ---- profiling (opt-in) ----
+# ML_PROFILE_SAMPLE: share of frames whose stages are timed (0 = off); the
+#   per-request summary is logged and sent back as "profile" in MLRS.
+# ML_CPROFILE: request ids (the job's trace id, or the request id) to run
+#   under cProfile, comma separated, or "*" for all; dumps go to
+#   ML_PROFILE_DIR/ml-<id>.prof, with anything but [A-Za-z0-9_-] in the id
+#   replaced by "_" (view with `python -m pstats` or snakeviz).
+PROFILE_SAMPLE = float(os.getenv("ML_PROFILE_SAMPLE", 0))
+CPROFILE_IDS = {i.strip() for i in os.getenv("ML_CPROFILE", "").split(",") if i.strip()}
+PROFILE_DIR = os.getenv("ML_PROFILE_DIR", tempfile.gettempdir())
+STAGES = ("decode", "encode", "http", "parse")
+
+
+class StageTimer:
+    """Durations of the pipeline stages of one request, on sampled frames.
+
+    Call frame() at the top of each frame, then mark(stage) as each stage
+    ends; unsampled frames cost one attribute check per mark.
+    """
+
+    def __init__(self, sample: float):
+        self.sample = sample
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(STAGES, 0)
+        self._last: float | None = None
+
+    @property
+    def sampled(self) -> int:
+        return self.counts[STAGES[0]]
+
+    def frame(self) -> None:
+        self._last = time.perf_counter() if self.sample and random.random() < self.sample else None
+
+    def mark(self, stage: str) -> None:
+        if self._last is None:
+            return
+        now = time.perf_counter()
+        self.totals[stage] += now - self._last
+        self.counts[stage] += 1
+        STAGE_SECONDS.observe(now - self._last, stage=stage)
+        self._last = now
+
+    def summary(self, frames: int) -> dict:
+        """Mean milliseconds per frame in each stage, and its share of the total."""
+        total = sum(self.totals.values()) or 1.0
+        return {
+            "frames": frames,
+            "sampled_frames": self.sampled,
+            "stages": {stage: {"mean_ms": round(t / self.counts[stage] * 1000, 3) if self.counts[stage] else None,
+                               "share": round(t / total, 3)}
+                       for stage, t in self.totals.items()},
+        }
+
+
+def _request_id(conn) -> str | None:
+    return current_trace() or (getattr(conn, "headers", None) or {}).get(REQUEST_ID_HEADER)
+
+
+def _profiled(request_id, fn, *args):
+    """Run fn(*args), under cProfile if ML_CPROFILE names *request_id*."""
+    if not request_id or not ("*" in CPROFILE_IDS or request_id in CPROFILE_IDS):
+        return fn(*args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        # the id comes from the sender: keep it from naming a path outside PROFILE_DIR
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", request_id)[:64]
+        path = os.path.join(PROFILE_DIR, f"ml-{safe_id}.prof")
+        profiler.dump_stats(path)
+        log.info("cProfile of request %s written to %s", request_id, path)
 
 def ml_request_handler(peer, conn, msgdata):
-    if not msgdata.startswith("http"):
-        print(f"[{peer.myid}] Received simple ML request: {msgdata}")
+    if not is_blob_url(msgdata):
+        log.info("[%s] Received simple ML request: %.200s", peer.myid, msgdata)
         result = f"Processed ML Request({msgdata})"
         conn.senddata("MLRS", result)
         return
 
-    # If msgdata is a URL (video url from GCS)
+    # If msgdata is a URL (GCS / file:// object, or a direct p2p:// transfer)
     video_url = msgdata
-    print(f"[{peer.myid}] Received video ML request for URL: {video_url}")
-
-    # Download video from URL and save to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp:
-        tmp_path = tmp.name
-        print(f"[{peer.myid}] Downloading video to {tmp_path} ...")
-        urllib.request.urlretrieve(video_url, tmp_path)
-
-    print(f"[{peer.myid}] Video downloaded to {tmp_path}")
-
+    log.info("[%s] Received video ML request for URL: %s", peer.myid, video_url)
+
+    request_id = _request_id(conn)
+    with fetch_blob(video_url) as video_path:
+        log.debug("[%s] Video available at %s", peer.myid, video_path)
+        result_data = _profiled(request_id, analyze_video, peer, video_path, conn)
+
+    if result_data is None:
+        return      # nobody is waiting for the result any more
+    conn.senddata("MLRS", json.dumps(result_data))
+
+def _predict_timeout() -> float:
+    """10s per frame, or less when the request's deadline is closer."""
+    left = time_left()
+    return 10 if left is None else max(min(10, left), 0.1)
+
+def analyze_video(peer, video_path, conn=None):
+    """Run drum-hit inference on every frame of the video at *video_path*.
+
+    Returns None if *conn*'s request is abandoned (cancelled, past its
+    deadline, or the requester hung up; see BTPeerConnection.abandoned)
+    before the video is done. With
+    ML_PROFILE_SAMPLE set, the result carries a "profile" of stage timings.
+    """
     # Open video
-    cap = cv2.VideoCapture(tmp_path)
+    cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    print(f"[{peer.myid}] Video FPS: {fps}")
+    log.debug("[%s] Video FPS: %s", peer.myid, fps)
 
     frame_number = 0
+    started = time.perf_counter()
+    stages = StageTimer(PROFILE_SAMPLE)
     hits_total = defaultdict(int)
     hits_per_second = defaultdict(lambda: defaultdict(int))  # {second: {drum: count}}
 
     while True:
+        if conn is not None and conn.abandoned():
+            log.info("[%s] Request abandoned at frame %d; stopping", peer.myid, frame_number)
+            cap.release()
+            VIDEOS.inc(result="abandoned")
+            return None
+
+        stages.frame()
         ret, frame = cap.read()
         if not ret:
             break
+        stages.mark("decode")
 
         frame_number += 1
-        # print(f"Sent frame number: {frame_number}")
         current_second = int(frame_number // fps)
 
         # Encode frame as PNG bytes
         _, img_encoded = cv2.imencode('.png', frame)
         img_bytes = img_encoded.tobytes()
+        stages.mark("encode")
 
         # Send to inference API
+        FRAMES.inc()
         try:
-            response = requests.post(
-                "http://34.29.29.124:8080/predict",
-                files={"file": ("frame.png", img_bytes, "image/png")},
-                timeout=10
-            )
+            with INFERENCE_SECONDS.time():
+                response = requests.post(
+                    PREDICT_URL,
+                    files={"file": ("frame.png", img_bytes, "image/png")},
+                    timeout=_predict_timeout()
+                )
+            stages.mark("http")
 
             if response.status_code == 200:
                 prediction = response.json()
@@ -63,14 +181,19 @@ def ml_request_handler(peer, conn, msgdata):
                     drum_hit = item["hit_drum"]
                     hits_total[drum_hit] += 1
                     hits_per_second[current_second][drum_hit] += 1
+                stages.mark("parse")
 
             else:
-                print(f"[{peer.myid}] Error from API: {response.status_code}")
+                log.warning("[%s] Error from API: %s", peer.myid, response.status_code)
 
         except Exception as e:
-            print(f"[{peer.myid}] Failed to send frame: {e}")
+            log.warning("[%s] Failed to send frame %d: %s", peer.myid, frame_number, e)
 
     cap.release()
+    elapsed = time.perf_counter() - started
+    if frame_number and elapsed > 0:
+        FRAMES_PER_SECOND.set(frame_number / elapsed)
+    VIDEOS.inc(result="done")
 
     # Prepare result to send back
     result_data = {
@@ -82,13 +205,11 @@ def ml_request_handler(peer, conn, msgdata):
     for sec, hits in hits_per_second.items():
         result_data["per_second_hits"][str(sec)] = dict(hits)
 
-    if os.path.exists(tmp_path):
-        os.remove(tmp_path)
-        print(f"[{peer.myid}] Deleted temporary video at {tmp_path}")
-
-    result_json = json.dumps(result_data)
+    if stages.sampled:
+        result_data["profile"] = stages.summary(frame_number)
+        log.info("[%s] Stage profile: %s", peer.myid, json.dumps(result_data["profile"]))
 
-    conn.senddata("MLRS", result_json)
+    return result_data
 
 def ml_response_handler(peer, msgdata):
     print(f"[{peer.myid}] Received ML response")
@@ -0,0 +1,104 @@
+# logconfig.py
+"""
+Logging setup for peers and the web app.
+
+Modules log through `logging.getLogger(__name__)` with %-style arguments,
+so a message below its logger's level costs a level check and nothing
+else. Entry points (peer.py, the job coordinator, the development server)
+call `setup_logging()` once: records are put on a queue and written by a
+QueueListener thread, so network and inference threads never wait on the
+console.
+
+Records made while handling or sending a traced request carry its trace id
+(see btpeer.tracing): text lines start with `[trace <id>]`, JSON lines have
+a "trace" field.
+
+Environment:
+- LOG_LEVEL   root level (default INFO)
+- LOG_LEVELS  per-logger levels, e.g. "btpeer=DEBUG,handlers.ml_handlers=WARNING"
+- LOG_FORMAT  "text" (default) or "json" (one object per line)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+from btpeer import current_trace
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(trace_tag)s%(message)s"
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class _TraceFilter(logging.Filter):
+    """Stamp the caller's trace id on the record (runs in the calling thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace = current_trace()
+        record.trace_tag = f"[trace {record.trace}] " if record.trace else ""
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace", None):
+            out["trace"] = record.trace
+        return json.dumps(out)     # the QueueHandler already folded any traceback into msg
+
+
+def _parse_levels(spec: str) -> dict[str, str]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str | None = None, stream=None) -> None:
+    """Route all logging through a queue to *stream* (default stderr).
+
+    Calling it again only re-applies the levels.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    for name, lvl in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(lvl)
+    if _listener is not None:
+        return
+
+    target = logging.StreamHandler(stream or sys.stderr)
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(_TraceFilter())
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(records, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out the records still queued and stop the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
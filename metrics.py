@@ -0,0 +1,207 @@
+# metrics.py
+"""
+In-process metrics: counters, gauges and histograms, exported in the
+Prometheus text format.
+
+Modules declare their metrics at import time and update them on the hot
+path; updates are a dict operation under a per-metric lock.
+
+    REQUESTS = metrics.counter("btpeer_handled_total", "Requests handled", ["type"])
+    REQUESTS.inc(type="MLRQ")
+    with LATENCY.time(type="MLRQ"):
+        ...
+
+`serve(port)` exposes everything at http://127.0.0.1:<port>/metrics
+(peer.py does so when METRICS_PORT is set), and `summary()` renders the
+same numbers for humans (the `stats` CLI command).
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds; covers a local round trip up to a whole video
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _fmt(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{n}="{v}"' for n, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> list[tuple[str, float]]:
+        with self._lock:
+            return [(f"{self.name}{self._fmt(k)}", v) for k, v in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self) -> list[tuple[str, float]]:
+        out = []
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                out.append((f"{self.name}_bucket{self._fmt(key, le)}", cumulative))
+            out.append((f"{self.name}_sum{self._fmt(key)}", total))
+            out.append((f"{self.name}_count{self._fmt(key)}", cumulative))
+        return out
+
+    def stats(self) -> list[tuple[dict, int, float, float]]:
+        """(labels, count, mean, approximate p95) per label set."""
+        out = []
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for key, (counts, total) in items:
+            n = sum(counts)
+            if not n:
+                continue
+            rank, cumulative, p95 = 0.95 * n, 0, float("inf")
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                if cumulative >= rank:
+                    p95 = bound
+                    break
+            out.append((dict(zip(self.labels, key)), n, total / n, p95))
+        return out
+
+
+# ---- registry ----
+_registry: dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cls, name: str, help: str, labels, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, tuple(labels), **kwargs)
+        return metric
+
+
+def counter(name: str, help: str, labels=()) -> Counter:
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, labels=()) -> Gauge:
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name} {value:g}" for name, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> list[str]:
+    """One readable line per series (histograms: count, mean, ~p95)."""
+    lines = []
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    for metric in metrics:
+        if isinstance(metric, Histogram):
+            for labels, n, mean, p95 in metric.stats():
+                tag = ",".join(f"{k}={v}" for k, v in labels.items())
+                p95_text = "> %gs" % metric.buckets[-1] if p95 == float("inf") else f"<= {p95:g}s"
+                lines.append(f"{metric.name}{{{tag}}}: n={n} mean={mean * 1000:.1f}ms p95 {p95_text}")
+        else:
+            lines.extend(f"{name}: {value:g}" for name, value in metric.samples())
+    return lines
+
+
+# ---- HTTP endpoint ----
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass                    # scraped every few seconds: keep the console quiet
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on *host*:*port* from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
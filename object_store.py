@@ -0,0 +1,190 @@
+# object_store.py
+"""
+Object storage used to hand videos to ML peers.
+
+Two backends share one small interface:
+- GCSObjectStore   – a Google Cloud Storage bucket ("gs://<bucket>"); uploads
+                     are resumable and streamed in chunks, and one storage
+                     client is reused for the whole process.
+- LocalObjectStore – a directory ("file:///path/to/dir"), served to peers on
+                     the same host as file:// URLs. Used for testing and
+                     single-box setups.
+
+`get_object_store()` picks the backend from OBJECT_STORE_URL
+(default "gs://drum-videos").
+"""
+
+import os
+import pathlib
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+
+DEFAULT_STORE_URL = "gs://drum-videos"
+CHUNK_SIZE = 8 * 1024 * 1024            # must be a multiple of 256 KiB for GCS
+
+
+class ObjectWriter:
+    """Write-only stream for one object; `close()` commits it.
+
+    Also accepts `seek(0)` so it can be used as a werkzeug upload container.
+    """
+
+    def __init__(self, store: "ObjectStore", name: str, raw):
+        self.store = store
+        self.name = name
+        self._raw = raw
+        self.size = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._raw.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.size
+
+    def tell(self) -> int:
+        return self.size
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.store._commit(self)
+
+    def discard(self) -> None:
+        """Abandon the upload, deleting anything already committed."""
+        if not self.closed:
+            self.closed = True
+            self.store._abort(self)
+        else:
+            self.store.delete(self.name)
+
+    @property
+    def url(self) -> str:
+        return self.store.public_url(self.name)
+
+
+class ObjectStore:
+    def open_writer(self, name: str) -> ObjectWriter:
+        raise NotImplementedError
+
+    def public_url(self, name: str) -> str:
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def upload_file(self, path: str, name: str | None = None) -> str:
+        """Upload a local file and return its public URL."""
+        name = name or os.path.basename(path)
+        writer = self.open_writer(name)
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        return writer.url
+
+    def _commit(self, writer: ObjectWriter) -> None:
+        raise NotImplementedError
+
+    def _abort(self, writer: ObjectWriter) -> None:
+        raise NotImplementedError
+
+
+# ---- Google Cloud Storage ----
+class GCSObjectStore(ObjectStore):
+    def __init__(self, bucket_name: str, chunk_size: int = CHUNK_SIZE):
+        self.bucket_name = bucket_name
+        self.chunk_size = chunk_size
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                from google.cloud import storage
+                self._bucket = storage.Client().bucket(self.bucket_name)
+            return self._bucket
+
+    def open_writer(self, name: str) -> ObjectWriter:
+        blob = self.bucket.blob(name)
+        raw = blob.open("wb", chunk_size=self.chunk_size, ignore_flush=True)
+        writer = ObjectWriter(self, name, raw)
+        writer.blob = blob
+        return writer
+
+    def _commit(self, writer: ObjectWriter) -> None:
+        writer._raw.close()
+        writer.blob.make_public()
+
+    def _abort(self, writer: ObjectWriter) -> None:
+        # an unfinished resumable upload is never committed and expires on
+        # its own; there is nothing to delete yet
+        pass
+
+    def public_url(self, name: str) -> str:
+        return self.bucket.blob(name).public_url
+
+    def delete(self, name: str) -> None:
+        self.bucket.blob(name).delete()
+
+
+# ---- Local directory (fake GCS) ----
+class LocalObjectStore(ObjectStore):
+    def __init__(self, root: str | os.PathLike):
+        self.root = pathlib.Path(root).resolve()
+
+    def path(self, name: str) -> pathlib.Path:
+        return self.root / os.path.basename(name)
+
+    def open_writer(self, name: str) -> ObjectWriter:
+        self.root.mkdir(parents=True, exist_ok=True)
+        raw = tempfile.NamedTemporaryFile(dir=self.root, prefix=".upload-", delete=False)
+        return ObjectWriter(self, name, raw)
+
+    def _commit(self, writer: ObjectWriter) -> None:
+        writer._raw.close()
+        os.replace(writer._raw.name, self.path(writer.name))
+
+    def _abort(self, writer: ObjectWriter) -> None:
+        writer._raw.close()
+        os.remove(writer._raw.name)
+
+    def public_url(self, name: str) -> str:
+        return self.path(name).as_uri()
+
+    def delete(self, name: str) -> None:
+        self.path(name).unlink(missing_ok=True)
+
+
+def open_store(url: str) -> ObjectStore:
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "gs":
+        return GCSObjectStore(parsed.netloc)
+    if parsed.scheme == "file":
+        return LocalObjectStore(urllib.request.url2pathname(parsed.path))
+    raise ValueError(f"Unsupported object store URL: {url}")
+
+
+_store: ObjectStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_object_store() -> ObjectStore:
+    """Return the process-wide object store named by OBJECT_STORE_URL."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(os.getenv("OBJECT_STORE_URL", DEFAULT_STORE_URL))
+        return _store
@@ -1,7 +1,12 @@
+import argparse
+import signal
 import sys
 import threading
+import metrics
+from logconfig import setup_logging
 from btpeer import BTPeer, BTPeerConnection
-from handlers import ml_handlers, iot_handlers
+from bt_utils import ML_TIMEOUT, start_dht, direct_router_factory
+from handlers.bc_api import BCClient
 import base64
 import time
 import logging
@@ -10,53 +15,37 @@ import logging
 # log.addHandler(logging.StreamHandler())
 
 import asyncio, json
-from kademlia.network import Server as KadServer
+from discovery import announce_service as _announce
 
-
-from google.cloud import storage
 import os
 
-BOOTSTRAP_NODE = ("127.0.0.1", 7000)
-
 # ---------------- create peer ----------------
-if len(sys.argv) != 4:
-    print("Usage: python peer.py <port> <maxpeers> <peertype>")
-    sys.exit(1)
+parser = argparse.ArgumentParser(usage="python peer.py <port> <maxpeers> <peertype> [--headless]")
+parser.add_argument("port", type=int)
+parser.add_argument("maxpeers", type=int)
+parser.add_argument("peertype")
+parser.add_argument("--headless", action="store_true",
+                    help="run as a daemon without the interactive CLI (stop with SIGTERM)")
+args = parser.parse_args()
+
+# LOG_LEVEL / LOG_LEVELS / LOG_FORMAT (see logconfig.py); CLI output stays on stdout
+setup_logging()
+log = logging.getLogger("peer")
 
-port, maxpeers, peertype = sys.argv[1], sys.argv[2], sys.argv[3]
-peer = BTPeer(maxpeers=int(maxpeers), serverport=int(port), peertype=peertype.upper())
+peer = BTPeer(maxpeers=args.maxpeers, serverport=args.port, peertype=args.peertype.upper())
 
 # --------------- Kademlia setup ---------------
 # run the Kademlia node on port = peer port + 10000
-KAD_PORT = peer.serverport + 10000
-kad_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(kad_loop)
-
-kad = KadServer()
-
-async def start_kademlia():
-    await kad.listen(KAD_PORT)
-    bootstrap_nodes = [(BOOTSTRAP_NODE[0], BOOTSTRAP_NODE[1] + 10000)]
-    if (peer.serverhost, peer.serverport) != BOOTSTRAP_NODE:
-        await kad.bootstrap([(BOOTSTRAP_NODE[0], BOOTSTRAP_NODE[1] + 10000)])
-    await kad.set(peer.myid, json.dumps({
-        "host": peer.serverhost,
-        "port": peer.serverport,
-        "type": peer.peertype,
-    }))
+# (or use the single-host registry file with DISCOVERY=local).
+# It bootstraps and announces us in the background; dht_ready completes
+# once other peers can find us.
+kad, kad_loop, dht_ready = start_dht(peer)
 
 def announce_service(pid, ptype):
     """
-    Fetch the current list under "svc:<ptype>", append pid if missing, and re-store.
+    Add pid to the list under "svc:<ptype>" (see discovery.announce_service).
     """
-    key = f"svc:{ptype.upper()}"
-    async def _update():
-        raw = await kad.get(key)
-        lst = json.loads(raw) if raw else []
-        if pid not in lst:
-            lst.append(pid)
-            await kad.set(key, json.dumps(lst))
-    asyncio.run_coroutine_threadsafe(_update(), kad_loop)
+    asyncio.run_coroutine_threadsafe(_announce(kad, pid, ptype), kad_loop)
 def add_and_announce(pid, host, port, ptype):
     # add into your BT peer table
     peer.add_peer(pid, host, port, ptype)
@@ -70,63 +59,39 @@ def add_and_announce(pid, host, port, ptype):
     asyncio.run_coroutine_threadsafe(kad.bootstrap([bootstrap_node]), kad_loop)
     announce_service(pid, ptype)
 
-# start it in the background
-kad_loop.run_until_complete(start_kademlia())
-threading.Thread(target=kad_loop.run_forever, daemon=True).start()
-time.sleep(0.5)
-# retry bootstrap now that everyone’s listening
-if (peer.serverhost, peer.serverport) != BOOTSTRAP_NODE:
-    asyncio.run_coroutine_threadsafe(
-      kad.bootstrap([ (BOOTSTRAP_NODE[0], BOOTSTRAP_NODE[1]+10000) ]),
-      kad_loop
-    )
-announce_service(peer.myid, peer.peertype)
 # ------------------------------------------------
 
+# table → DHT; unresolvable peers are reached through other peers (FWRD)
+peer.add_router(direct_router_factory(peer, kad, kad_loop))
 
+peer.add_handler("PING", lambda conn, msg: conn.senddata("PONG", msg))
 
-# Direct router function and registration
-# def direct_router(pid: str):
-#     try:
-#         host, port, peertype = peer.get_peer(pid)
-#         return (pid, host, port)
-#     except KeyError:
-#         return (None, None, None)
-
-def direct_router(pid: str):
-    # try local cache:
-    if pid in peer.peers:
-        h, p, t = peer.peers[pid]
-        return (pid, h, p)
-
-    # else, ask the DHT
-    future = asyncio.run_coroutine_threadsafe(kad.get(pid), kad_loop)
-    try:
-        raw = future.result(timeout=5)   # wait up to 5s
-    except Exception:
-        return (None, None, None)
-
-    if not raw:
-        return (None, None, None)
-
-    data = json.loads(raw)
-    # cache it locally for next time
-    peer.add_peer(pid, data["host"], data["port"], data["type"])
-    return (pid, data["host"], data["port"])
-
-peer.add_router(direct_router)
+bc_client = BCClient(peer, kad, kad_loop)
 
 if peer.peertype == "BC":
     from handlers import bc_handlers as _bc
-    peer.add_handler("BCRQ", lambda conn, msg: _bc.bc_request_handler(peer, conn, msg))
+    # idempotent: a retried STORE (same key) is written on-chain only once
+    peer.add_handler("BCRQ", lambda conn, msg: _bc.bc_request_handler(peer, conn, msg, bc_client.providers),
+                     idempotent=True)
     peer.add_handler("BCRS", lambda conn, msg: _bc.bc_response_handler(peer, msg))
 
+    # warm the chain connection without holding up peer startup
+    def _warm_chain():
+        try:
+            _bc.chain.init()
+        except Exception as e:
+            log.warning("Chain not ready yet: %s", e)
+    threading.Thread(target=_warm_chain, daemon=True).start()
+
 if peer.peertype == "IOT":
+    from handlers import iot_handlers
     peer.add_handler("IORQ", lambda conn, msgdata: iot_handlers.iot_request_handler(peer, conn, msgdata))
-    threading.Thread(target=iot_handlers.start_aws_iot_listener, daemon=True).start()
+    threading.Thread(target=iot_handlers.start_iot_feed, daemon=True).start()
 
 if peer.peertype == "ML":
-    peer.add_handler("MLRQ", lambda conn, msgdata: ml_handlers.ml_request_handler(peer, conn, msgdata))
+    from handlers import ml_handlers
+    peer.add_handler("MLRQ", lambda conn, msgdata: ml_handlers.ml_request_handler(peer, conn, msgdata),
+                     idempotent=True)
 
 # Optional: Periodically print the list of live peers
 def heartbeat():
@@ -139,6 +104,31 @@ def heartbeat():
 t = threading.Thread(target=peer.mainloop, daemon=True)
 t.start()
 
+# Prometheus endpoint: METRICS_PORT=<port>, or "auto" for peer port + 20000
+metrics_port = os.getenv("METRICS_PORT")
+if metrics_port:
+    metrics_port = args.port + 20000 if metrics_port == "auto" else int(metrics_port)
+    try:
+        metrics.serve(metrics_port)
+        log.info("Metrics at http://127.0.0.1:%d/metrics", metrics_port)
+    except OSError as e:
+        log.warning("Metrics endpoint not started: %s", e)
+
+def report_ready():
+    """Print one READY line once we accept connections and are announced.
+
+    Launchers (start_peers.py) wait for this line instead of sleeping.
+    """
+    peer.ready.wait()
+    try:
+        dht_ready.result()
+    except Exception as e:
+        log.error("DHT start failed: %s", e)
+        return
+    print(f"READY {peer.peertype} {peer.myid}", flush=True)
+
+threading.Thread(target=report_ready, daemon=True).start()
+
 # ---------------- Simple CLI ----------------
 
 def find_peer_for_service(service_type: str, timeout=5):
@@ -159,10 +149,11 @@ def find_peer_for_service(service_type: str, timeout=5):
     # pick first
     target_id = ids[0]
 
-    return pid
+    return target_id
 
 
 def upload_video_to_bucket(bucket_name, source_file_path):
+    from google.cloud import storage
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
     blob_name = os.path.basename(source_file_path)
@@ -176,6 +167,7 @@ def upload_video_to_bucket(bucket_name, source_file_path):
     print(f"Uploaded to {blob.public_url}")
     return blob.public_url
 def delete_from_gcs(bucket_name, blob_name):
+    from google.cloud import storage
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(blob_name)
@@ -184,6 +176,20 @@ def delete_from_gcs(bucket_name, blob_name):
 
     print(f"Deleted {blob_name} from {bucket_name}")
 
+# ---------------- Headless mode ----------------
+if args.headless:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    while not stop.wait(1):
+        if not t.is_alive():
+            # the server died (e.g. the port is taken): exit so a launcher restarts us
+            log.error("Server stopped, exiting")
+            sys.exit(1)
+    log.info("Shutting down")
+    peer.shutdown = True
+    sys.exit(0)
+
 while True:
     cmd = input("cmd> ").strip().split()
     if not cmd:
@@ -206,6 +212,9 @@ while True:
     elif cmd[0] == "quit":
         peer.shutdown = True
         break
+    elif cmd[0] == "stats":
+        for line in metrics.summary() or ["(no metrics yet)"]:
+            print(line)
     elif cmd[0] == "heartbeat":
         peer.check_live_peers()
         print(f"### [{peer.myid}] known peers:", peer.get_peer_ids())
@@ -233,8 +242,9 @@ while True:
             data_to_send = "example-ml-data"
             print(f"Sending simple ML request to {target_peer}")
 
-        replies = peer.send_to_peer(target_peer, "MLRQ", data_to_send, waitreply=True)
+        replies = peer.send_to_peer(target_peer, "MLRQ", data_to_send, waitreply=True, timeout=ML_TIMEOUT)
 
+        from handlers import ml_handlers
         for msgtype, msgdata in replies:
             if msgtype == "MLRS":
                 ml_handlers.ml_response_handler(peer, msgdata)
@@ -250,6 +260,7 @@ while True:
             time_range = f"{cmd[1]}|{cmd[2]}"
             print(f"Requesting IoT data from {target_peer} for {time_range}")
             replies = peer.send_to_peer(target_peer, "IORQ", time_range, waitreply=True)
+            from handlers import iot_handlers
             for msgtype, msgdata in replies:
                 if msgtype == "IORS":
                     iot_handlers.iot_response_handler(peer, msgdata)
@@ -259,23 +270,18 @@ while True:
             print("No known IoT peer found.")
 
     # ---- Blockchain ----
-    elif cmd[0] == "bc_store" and len(cmd) == 2:
-        payload = cmd[1]
-        # target = get_peer_by_service("BC") or peer.myid
-        target = find_peer_for_service("BC") or peer.myid
-        replies = peer.send_to_peer(target, "BCRQ", f"STORE {payload}", waitreply=True)
-        for msg_type, msg_data in replies:
-            if msg_type == "BCRS":
-                from handlers import bc_handlers as _bc
-                _bc.bc_response_handler(peer, msg_data)
+    elif cmd[0] == "bc_store" and len(cmd) >= 2:
+        payload = " ".join(cmd[1:])
+        try:
+            bc_client.store(payload)
+            print("✓ Data stored on-chain")
+        except Exception as e:
+            print(f"⚠️ Error: {e}")
 
     elif cmd[0] == "bc_fetch":
-        # target = get_peer_by_service("BC") or peer.myid
-        target = find_peer_for_service("BC") or peer.myid
-        replies = peer.send_to_peer(target, "BCRQ", "FETCH", waitreply=True)
-        for msg_type, msg_data in replies:
-            if msg_type == "BCRS":
-                from handlers import bc_handlers as _bc
-                _bc.bc_response_handler(peer, msg_data)
+        try:
+            print("→ On-chain data:", bc_client.fetch())
+        except Exception as e:
+            print(f"⚠️ Error: {e}")
     else:
-        print("Commands: add <peerid> <host> <port> <peertype> | ping <peerid> | list | quit")
\ No newline at end of file
+        print("Commands: add <peerid> <host> <port> <peertype> | ping <peerid> | list | stats | quit")
\ No newline at end of file
@@ -1,134 +1,265 @@
+#!/usr/bin/env python3
+"""
+start_peers.py – launch and supervise a local cluster of peers.
+
+Starts the Hardhat node (and deploys the contract), then every peer listed
+in the cluster config at once, each as `peer.py ... --headless`. It waits
+for all of them to print READY, restarts peers that crash (with backoff),
+and on Ctrl-C / SIGTERM stops the whole cluster.
+
+Usage: python start_peers.py [--config cluster.json] [--no-hardhat]
+
+Config (JSON; see cluster.example.json). Keys missing from it take the
+defaults below, which are also the layout used without --config (comments
+for illustration only):
+
+    {
+      "hardhat": true,                  # start `npx hardhat node` and deploy
+      "maxpeers": 10,
+      "env": {"DISCOVERY": "dht"},      # extra environment for every peer
+      "max_restarts": 5,                # per peer, before giving up on it
+      "peers": [
+        {"type": "BOOTSTRAP", "port": 7000},
+        {"type": "BC",  "port": 8001},
+        {"type": "IOT", "port": 6001},
+        {"type": "ML",  "port": 6000, "count": 1}   # count > 1: ports port, port+1, ...
+      ]
+    }
+"""
+
+import argparse
+import json
+import os
+import platform
+import signal
 import subprocess
 import sys
+import threading
 import time
-import os
-import signal
-import platform
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {
+    "hardhat": True,
+    "maxpeers": 10,
+    "env": {},
+    "max_restarts": 5,
+    "peers": [
+        {"type": "BOOTSTRAP", "port": 7000},
+        {"type": "BC", "port": 8001},
+        {"type": "IOT", "port": 6001},
+        {"type": "ML", "port": 6000},
+    ],
+}
+
+READY_TIMEOUT = 60          # seconds to wait for the whole cluster
+STOP_TIMEOUT = 10           # seconds between SIGTERM and SIGKILL
+STABLE_AFTER = 30           # a peer up this long has its restart backoff reset
+MAX_BACKOFF = 30
+
+
+# ----- Hardhat -----
+def _npx() -> str:
+    return r"C:\Program Files\nodejs\npx.cmd" if platform.system() == "Windows" else "npx"
 
-# ----- Start Hardhat Node -----
-def Start_Hardhat_Node()->None:
+
+def start_hardhat_node() -> subprocess.Popen:
     print("[Starter] Starting Hardhat node...")
     if platform.system() == "Windows":
         # Windows: no preexec_fn; use creationflags
-        npx_path = r"C:\Program Files\nodejs\npx.cmd"
-        hardhat_proc = subprocess.Popen(
-            [npx_path, "hardhat", "node"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-        )
-    else:
-        # Unix: use os.setsid
-        hardhat_proc = subprocess.Popen(
-            ["npx", "hardhat", "node"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            preexec_fn=os.setsid
+        return subprocess.Popen(
+            [_npx(), "hardhat", "node"], cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
         )
+    # Unix: own process group, so the node's children stop with it
+    return subprocess.Popen(
+        [_npx(), "hardhat", "node"], cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
 
 
-# ----- Deploy Contract -----
-def Deploy_Contract()->None:
+def deploy_contract() -> None:
     print("[Starter] Deploying StringChain contract...")
-    deploy_result = None
+    result = subprocess.run(
+        [_npx(), "hardhat", "run", "--network", "localhost", "scripts/deploy.js"],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    print("[Starter] Deploy result:", result.stdout.decode().strip())
+
+
+def stop_hardhat_node(proc: subprocess.Popen) -> None:
+    if proc.poll() is not None:
+        return
     if platform.system() == "Windows":
-        npx_path = r"C:\Program Files\nodejs\npx.cmd"
-        deploy_result = subprocess.run(
-            [npx_path, "hardhat", "run", "--network", "localhost", "scripts/deploy.js"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        proc.send_signal(signal.CTRL_BREAK_EVENT)
     else:
-        deploy_result = subprocess.run(
-            ["npx", "hardhat", "run", "--network", "localhost", "scripts/deploy.js"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+# ----- Peers -----
+class PeerProcess:
+    """One supervised `peer.py --headless` child."""
+
+    def __init__(self, peertype: str, port: int, maxpeers: int, env: dict):
+        self.peertype = peertype.upper()
+        self.port = port
+        self.maxpeers = maxpeers
+        self.env = env
+        self.name = f"{self.peertype.lower()}:{port}"
+        self.proc: subprocess.Popen | None = None
+        self.started_at = 0.0
+        self.ready = threading.Event()
+        self.restarts = 0
+        self.next_start = 0.0           # monotonic time of the next restart attempt
+
+    def start(self) -> None:
+        self.ready.clear()
+        self.started_at = time.monotonic()
+        self.proc = subprocess.Popen(
+            [sys.executable, "peer.py", str(self.port), str(self.maxpeers), self.peertype, "--headless"],
+            cwd=ROOT, env=self.env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1,
         )
-    print("[Starter] Deploy result:", deploy_result.stdout.decode().strip())
-    time.sleep(2)
+        threading.Thread(target=self._pump, args=(self.proc,), daemon=True).start()
 
+    def _pump(self, proc: subprocess.Popen) -> None:
+        """Echo the peer's output with its name, noting the READY line."""
+        for line in proc.stdout:
+            print(f"[{self.name}] {line}", end="", flush=True)
+            if line.startswith("READY "):
+                self.ready.set()
 
-# ----- Create a BC Peer -----
-def Create_BC_Peer(port: str) -> None:
-    print(f"[Starter] Starting BC Node on {port}...")
-    bc_node = subprocess.Popen(
-        [os.path.join(".venv", "Scripts", "python"), "peer.py", port, "10", "BC"],
-        stdin=subprocess.PIPE
-    )
-    time.sleep(3)
-    return bc_node
+    def exited(self) -> int | None:
+        return self.proc.poll() if self.proc else None
 
+    def terminate(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
 
+    def wait_or_kill(self, deadline: float) -> None:
+        if not self.proc:
+            return
+        try:
+            self.proc.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            print(f"[Starter] {self.name} did not stop, killing it")
+            self.proc.kill()
+            self.proc.wait()
 
-def Create_ML_Peers(port: str):
-    # Start ML Node
-    print(f"[Starter] Starting ML Node on {port}...")
-    ml_node = subprocess.Popen(
-        [os.path.join(".venv", "Scripts", "python.exe"), "peer.py", port, "10", "ML"],
-        stdin=subprocess.PIPE
-    )
-    time.sleep(3)
-    return ml_node
 
+def load_config(path: str | None) -> dict:
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
 
 
-def Create_IoT_Peer(port:str) :
-    # Start IOT Node
-    print(f"[Starter] Starting IoT Node on {port}...")
-    iot_node = subprocess.Popen(
-        [os.path.join(".venv", "Scripts", "python.exe"), "peer.py", port, "10", "IOT"],
-        stdin=subprocess.PIPE
-    )
-    time.sleep(3)
-    return iot_node
+def make_peers(config: dict) -> list[PeerProcess]:
+    env = {**os.environ, "PYTHONUNBUFFERED": "1", **{k: str(v) for k, v in config["env"].items()}}
+    peers, ports = [], set()
+    for spec in config["peers"]:
+        for i in range(int(spec.get("count", 1))):
+            port = int(spec["port"]) + i
+            if port in ports:
+                raise ValueError(f"Port {port} is assigned to more than one peer")
+            ports.add(port)
+            peers.append(PeerProcess(spec["type"], port, int(spec.get("maxpeers", config["maxpeers"])), env))
+    return peers
 
-# Register peers (send "add" command to running peers)
-print("[Starter] Registering peers...")
 
-def Create_Bootstrap_Peer():
-    print(f"[Starter] Starting Bootstrap Node... (Port 7000)")
-    bootstrap_node = subprocess.Popen(
-        [os.path.join(".venv", "Scripts", "python.exe"), "peer.py", "7000", "10", "Bootstrap"],
-        stdin=subprocess.PIPE
-    )
-    time.sleep(3)
-    return bootstrap_node
+class Cluster:
+    def __init__(self, peers: list[PeerProcess], max_restarts: int):
+        self.peers = peers
+        self.max_restarts = max_restarts
+        self.stopping = threading.Event()
 
+    def start(self) -> None:
+        t0 = time.monotonic()
+        print(f"[Starter] Starting {len(self.peers)} peers...")
+        for p in self.peers:
+            p.start()
+        # wait until every peer is ready or has crashed (the supervisor restarts it)
+        deadline = t0 + READY_TIMEOUT
+        while time.monotonic() < deadline and not all(
+                p.ready.is_set() or p.exited() is not None for p in self.peers):
+            time.sleep(0.1)
+        pending = [p.name for p in self.peers if not p.ready.is_set()]
+        if pending:
+            print(f"[Starter] Not ready: {', '.join(pending)}")
+        else:
+            print(f"[Starter] Cluster ready in {time.monotonic() - t0:.1f}s")
 
-def main():
-    python_exec = sys.executable
-    if not python_exec:
-        raise RuntimeError("Could not determine the current Python interpreter path.")
-    print(f"Current Python interpreter: {python_exec}")
+    def supervise(self) -> None:
+        """Restart crashed peers until stop() is called."""
+        while not self.stopping.wait(0.5):
+            now = time.monotonic()
+            for p in self.peers:
+                code = p.exited()
+                if code is None or p.restarts > self.max_restarts:
+                    continue
+                if p.next_start == 0.0:
+                    if now - p.started_at >= STABLE_AFTER:
+                        p.restarts = 0
+                    p.restarts += 1
+                    if p.restarts > self.max_restarts:
+                        print(f"[Starter] {p.name} exited with {code}; giving up after {self.max_restarts} restarts")
+                        continue
+                    delay = min(2 ** (p.restarts - 1), MAX_BACKOFF)
+                    p.next_start = now + delay
+                    print(f"[Starter] {p.name} exited with {code}; restarting in {delay}s")
+                elif now >= p.next_start:
+                    p.next_start = 0.0
+                    p.start()
 
-    #Star Hardhat Node and Contract
-    Start_Hardhat_Node()
-    Deploy_Contract()
+    def stop(self) -> None:
+        self.stopping.set()
+        print("[Starter] Shutting down...")
+        for p in self.peers:
+            p.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for p in self.peers:
+            p.wait_or_kill(deadline)
 
-    #Generating Peers
-    bootstrap_node = Create_Bootstrap_Peer()
-    bc_node = Create_BC_Peer("8001")
-    iot_node = Create_IoT_Peer("6001")
-    ml_node = Create_ML_Peers("6000")
 
-    # bc_node.stdin.write(b"add BCNode localhost 8001 IOT\n")
-    # bc_node.stdin.flush()
-    #
-    # ml_node.stdin.write(b"add IOTNode localhost 6001 IOT\n")
-    # ml_node.stdin.flush()
+def _interrupt(signum, frame):
+    """SIGTERM behaves like Ctrl-C."""
+    raise KeyboardInterrupt
 
-    # iot_node.stdin.write(b"add MLNode localhost 6000 ML\n")
-    # iot_node.stdin.flush()
 
-    print("[Starter] Peers registered. System ready.")
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Launch and supervise a local peer cluster")
+    parser.add_argument("--config", help="cluster config (JSON)")
+    parser.add_argument("--no-hardhat", action="store_true", help="do not start Hardhat / deploy")
+    args = parser.parse_args()
 
+    config = load_config(args.config)
+    cluster = Cluster(make_peers(config), int(config["max_restarts"]))
+
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    hardhat = None
     try:
-        while True:
-            time.sleep(1)
+        if config["hardhat"] and not args.no_hardhat:
+            hardhat = start_hardhat_node()
+            time.sleep(2)                   # let the JSON-RPC endpoint come up
+            deploy_contract()
+        cluster.start()
+        cluster.supervise()
     except KeyboardInterrupt:
-        print("[Starter] Shutting down...")
-        ml_node.terminate()
-        iot_node.terminate()
+        pass
+    finally:
+        cluster.stop()
+        if hardhat:
+            stop_hardhat_node(hardhat)
+
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""combine_and_analyze (vectorised) against combine_and_analyze_py (reference)."""
+
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from bench_combine import assert_equivalent, make_session
+from webapp.analysis import combine_and_analyze, combine_and_analyze_py
+
+IOT, ML = make_session(seconds=30, hz=20)
+_MISSING = object()
+
+
+def _with(index: int, **changes) -> list[dict]:
+    iot = [dict(e) for e in IOT]
+    for field, value in changes.items():
+        if value is _MISSING:
+            del iot[index][field]
+        else:
+            iot[index][field] = value
+    return iot
+
+
+CASES = {
+    "well-formed": IOT,
+    "+00:00": [dict(e, timestamp=e["timestamp"][:-1] + "+00:00") for e in IOT],
+    "non-UTC": [dict(e, timestamp=e["timestamp"][:-1] + "+02:00") for e in IOT],
+    "naive": [dict(e, timestamp=e["timestamp"][:-1]) for e in IOT],
+    "None timestamp": _with(5, timestamp=None),
+    "numeric timestamp": _with(5, timestamp=1714564800),
+    "missing timestamp": _with(5, timestamp=_MISSING),
+    "garbled timestamp": _with(5, timestamp="yesterday-ishZ"),
+    "first timestamp None": _with(0, timestamp=None),
+    "missing volume": _with(5, **{"room_noise (db)": _MISSING}),
+    "missing vibration": _with(5, vibration_level=_MISSING),
+}
+
+
+@pytest.mark.parametrize("iot", CASES.values(), ids=CASES.keys())
+def test_matches_reference(iot):
+    assert_equivalent(combine_and_analyze_py(iot, ML), combine_and_analyze(iot, ML))
+
+
+def test_empty_inputs():
+    assert combine_and_analyze([], ML) == combine_and_analyze_py([], ML) == {}
+    assert combine_and_analyze(IOT, {}) == combine_and_analyze_py(IOT, {}) == {}
@@ -0,0 +1,56 @@
+"""BCClient: where a STORE goes when a reply is lost (handlers/bc_api)."""
+
+import asyncio
+import json
+import pathlib
+import sys
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bt_utils import direct_router_factory
+from btpeer import IDEMPOTENCY_HEADER, BTPeer
+from discovery import LocalRegistry
+from handlers.bc_api import BCClient
+
+HOST = "127.0.0.1"
+
+
+def _start(port: int, peertype: str) -> BTPeer:
+    peer = BTPeer(maxpeers=0, serverport=port, peertype=peertype, serverhost=HOST)
+    threading.Thread(target=peer.mainloop, daemon=True).start()
+    peer.ready.wait()
+    return peer
+
+
+def test_store_retries_the_same_provider_after_a_lost_reply(tmp_path):
+    calls = {"first": [], "second": []}
+
+    def flaky(conn, msg):
+        calls["first"].append(conn.headers.get(IDEMPOTENCY_HEADER))
+        if len(calls["first"]) == 1:
+            conn.close()                  # the request ran, but its reply is lost
+            return
+        conn.senddata("BCRS", json.dumps({"type": "ACK", "msg": "stored"}))
+
+    first, second = _start(18975, "BC"), _start(18976, "BC")
+    first.add_handler("BCRQ", flaky)
+    second.add_handler("BCRQ", lambda conn, msg: (calls["second"].append(msg),
+                                                  conn.senddata("BCRS", json.dumps({"type": "ACK"}))))
+    web = _start(18977, "WEB")
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    kad = LocalRegistry(str(tmp_path / "peers.json"))
+    for peer in (first, second):
+        info = json.dumps({"host": HOST, "port": peer.serverport, "type": "BC"})
+        asyncio.run_coroutine_threadsafe(kad.set(peer.myid, info), loop).result()
+    asyncio.run_coroutine_threadsafe(kad.set("svc:BC", json.dumps([first.myid, second.myid])), loop).result()
+    web.add_router(direct_router_factory(web, kad, loop))
+    try:
+        BCClient(web, kad, loop).store({"job": 1}, key="job-1")
+        assert calls["first"] == ["job-1", "job-1"]     # retried where it may have run
+        assert calls["second"] == []                     # never written twice
+    finally:
+        first.shutdown = second.shutdown = web.shutdown = True
+        loop.call_soon_threadsafe(loop.stop)
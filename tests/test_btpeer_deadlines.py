@@ -0,0 +1,73 @@
+"""Deadlines on pooled keep-alive connections (btpeer)."""
+
+import pathlib
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from btpeer import BTPeer, DeadlineBeforeSend, DeadlineExceeded
+
+HOST = "127.0.0.1"
+
+
+def _start(port: int, peertype: str) -> BTPeer:
+    peer = BTPeer(maxpeers=0, serverport=port, peertype=peertype, serverhost=HOST)
+    threading.Thread(target=peer.mainloop, daemon=True).start()
+    peer.ready.wait()
+    return peer
+
+
+def test_pooled_connection_gets_the_next_requests_deadline():
+    server = _start(18961, "SLOW")
+    server.add_handler("SLOW", lambda conn, data: (time.sleep(float(data)), conn.senddata("SLRS", data)))
+    client = _start(18962, "CLI")
+    client.add_peer(server.myid, HOST, server.serverport, "SLOW")
+    try:
+        # leaves the pooled socket with a timeout of a fraction of a second
+        assert client.send_to_peer(server.myid, "SLOW", "0.8", keepalive=True, timeout=1.0,
+                                   raise_errors=True) == [("SLRS", "0.8")]
+        idle = client.connpool._idle[(HOST, server.serverport)]
+        assert len(idle) == 1
+        reused = idle[0][1]
+
+        # the same connection must wait out the new, longer deadline
+        assert client.send_to_peer(server.myid, "SLOW", "0.6", keepalive=True, timeout=10,
+                                   raise_errors=True) == [("SLRS", "0.6")]
+        assert client.connpool._idle[(HOST, server.serverport)][0][1] is reused
+    finally:
+        server.shutdown = client.shutdown = True
+
+
+def test_deadline_passed_before_sending_is_not_sent():
+    server = _start(18965, "SLOW")
+    cancels = []
+    server.add_handler("CNCL", lambda conn, data: cancels.append(data))
+    client = _start(18966, "CLI")
+    client.add_peer(server.myid, HOST, server.serverport, "SLOW")
+    try:
+        with pytest.raises(DeadlineBeforeSend):
+            client.send_to_peer(server.myid, "SLOW", "0", timeout=0, raise_errors=True)
+        time.sleep(0.3)
+        assert cancels == []                      # nothing to cancel
+        assert server.myid in client.peers        # and the peer is not to blame
+    finally:
+        server.shutdown = client.shutdown = True
+
+
+def test_send_that_times_out_exceeds_the_deadline():
+    sink = socket.socket()                        # accepts, never reads
+    sink.bind((HOST, 0))
+    sink.listen()
+    client = _start(18967, "CLI")
+    client.add_peer("sink", HOST, sink.getsockname()[1], "SINK")
+    try:
+        with pytest.raises(DeadlineExceeded):
+            client.send_to_peer("sink", "SLOW", "x" * (64 << 20), timeout=0.5, raise_errors=True)
+    finally:
+        client.shutdown = True
+        sink.close()
@@ -0,0 +1,113 @@
+"""Idempotent handlers: a retry with the same key gets the first run's replies (btpeer)."""
+
+import pathlib
+import sys
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from btpeer import IDEMPOTENCY_HEADER, BTPeer, BTPeerConnection, CompletedRequests
+
+HOST = "127.0.0.1"
+
+
+def _start(port: int, peertype: str) -> BTPeer:
+    peer = BTPeer(maxpeers=0, serverport=port, peertype=peertype, serverhost=HOST)
+    threading.Thread(target=peer.mainloop, daemon=True).start()
+    peer.ready.wait()
+    return peer
+
+
+def test_completed_requests_replay_a_finished_run():
+    cache = CompletedRequests(capacity=8, ttl=60)
+    entry, first = cache.begin("MLRQ:a")
+    assert first
+    cache.finish("MLRQ:a", entry, [("MLRS", "done")])
+    again, first = cache.begin("MLRQ:a")
+    assert not first and again is entry
+    assert again.done.is_set() and again.replies == [("MLRS", "done")]
+
+
+def test_completed_requests_expire_after_ttl():
+    cache = CompletedRequests(capacity=8, ttl=0.05)
+    entry, _ = cache.begin("k")
+    cache.finish("k", entry, [("BCRS", "{}")])
+    time.sleep(0.1)
+    assert cache.begin("k")[1]
+
+
+def test_completed_requests_keep_at_most_capacity_finished_runs():
+    cache = CompletedRequests(capacity=2, ttl=60)
+    for key in ("a", "b", "c"):
+        entry, _ = cache.begin(key)
+        cache.finish(key, entry, [("BCRS", key)])
+    cache.begin("d")                    # expiry runs on begin()
+    assert len(cache) == 3              # b, c and the running d
+    assert cache.begin("a")[1]          # the oldest was dropped
+    assert not cache.begin("c")[1]
+
+
+def test_completed_requests_forget_a_failed_run():
+    cache = CompletedRequests(capacity=8, ttl=60)
+    entry, _ = cache.begin("k")
+    cache.finish("k", entry, [])        # the handler failed: nothing to replay
+    assert entry.done.is_set()
+    assert cache.begin("k")[1]
+
+
+def test_same_key_retry_does_not_rerun_the_handler():
+    runs = []
+
+    def work(conn, data):
+        runs.append(data)
+        conn.senddata("WKRS", f"{data}#{len(runs)}")
+
+    server = _start(18968, "WORK")
+    server.add_handler("WORK", work, idempotent=True)
+    client = _start(18969, "CLI")
+    client.add_peer(server.myid, HOST, server.serverport, "WORK")
+    try:
+        def send(key):
+            return client.send_to_peer(server.myid, "WORK", "job", idempotency_key=key,
+                                       keepalive=True, timeout=5, raise_errors=True)
+
+        assert send("k1") == [("WKRS", "job#1")]
+        assert send("k1") == [("WKRS", "job#1")]      # replayed
+        assert send("k2") == [("WKRS", "job#2")]      # a new key runs again
+        assert len(runs) == 2
+    finally:
+        server.shutdown = client.shutdown = True
+
+
+def test_hung_up_keyed_request_keeps_running_for_a_retry():
+    runs = []
+
+    def work(conn, data):
+        # like the ML loop: one step at a time, stopping once abandoned
+        runs.append("started")
+        for _ in range(8):
+            if conn.abandoned():
+                runs[-1] = "abandoned"
+                return
+            time.sleep(0.05)
+        runs[-1] = "completed"
+        conn.senddata("WKRS", data)
+
+    server = _start(18963, "WORK")
+    server.add_handler("WORK", work, idempotent=True)
+    client = _start(18964, "CLI")
+    client.add_peer(server.myid, HOST, server.serverport, "WORK")
+    try:
+        first = BTPeerConnection(None, HOST, server.serverport)
+        assert first.senddata("WORK", "job-1", {IDEMPOTENCY_HEADER: "job-1"})
+        time.sleep(0.2)
+        first.close()           # the requester hangs up mid-run ...
+        time.sleep(0.1)
+        # ... and retries with the same key
+        replies = client.send_to_peer(server.myid, "WORK", "job-1", idempotency_key="job-1",
+                                      keepalive=True, timeout=5, raise_errors=True)
+        assert replies == [("WKRS", "job-1")]
+        assert runs == ["completed"]
+    finally:
+        server.shutdown = client.shutdown = True
@@ -0,0 +1,48 @@
+"""/submit keeps only the committed video in the upload store (webapp/app)."""
+
+import io
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import blob_transport
+from object_store import LocalObjectStore
+from webapp import app as webapp_app
+
+
+class _Manager:
+    def submit(self, job):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LocalObjectStore(tmp_path)
+    monkeypatch.setattr(blob_transport, "_transport", blob_transport.ObjectStoreTransport(store))
+    monkeypatch.setattr(webapp_app, "get_job_manager", _Manager)
+    return tmp_path
+
+
+def _post(**kwargs):
+    return webapp_app.app.test_client().post("/submit", **kwargs)
+
+
+def test_other_file_fields_are_discarded(store):
+    resp = _post(data={"start_time": "a", "end_time": "b", "video": (io.BytesIO(b"v" * 100), "v.mp4"),
+                       "extra": (io.BytesIO(b"x" * 100), "x.bin")})
+    assert resp.status_code == 200
+    assert [p.name.split("-", 1)[1] for p in store.iterdir()] == ["v.mp4"]
+
+
+def test_missing_fields_leave_nothing(store):
+    assert _post(data={"video": (io.BytesIO(b"v"), "v.mp4")}).status_code == 400
+    assert list(store.iterdir()) == []
+
+
+def test_truncated_body_leaves_no_temp_file(store):
+    body = b'--B\r\nContent-Disposition: form-data; name="video"; filename="v.mp4"\r\n\r\n' + b"v" * 5000
+    assert _post(data=body, content_type="multipart/form-data; boundary=B").status_code == 400
+    assert list(store.iterdir()) == []
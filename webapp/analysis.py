@@ -0,0 +1,239 @@
+"""
+analysis.py – combine ML hit counts with IoT sensor readings per second.
+
+combine_and_analyze() is the vectorised implementation used by the web app;
+summarize_minutes() condenses its result into per-minute aggregates.
+combine_and_analyze_py() is the original per-entry version; it remains the
+reference for the benchmark's equivalence check, and the fallback for input
+the fast path does not handle (non-UTC or malformed timestamps).
+"""
+
+import logging
+from datetime import datetime, timezone
+from collections import defaultdict
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+WARN_THRESHOLD = 70
+UTC_SUFFIXES = ("Z", "+00:00")
+
+# --------------------- Utility to combine ML + IOT --------------------
+
+def combine_and_analyze_py(iot_data, ml_data):
+    combined_result = {}
+
+    # Infer base time from FIRST IoT timestamp
+    if not iot_data:
+        log.info("No IoT data to analyze.")
+        return {}
+
+    try:
+        first_ts = datetime.fromisoformat(iot_data[0]["timestamp"].replace("Z", "+00:00")).astimezone(timezone.utc)
+    except Exception as e:
+        log.warning("Failed to parse first IoT timestamp: %s", e)
+        return {}
+
+    #Group IoT data by second offset from first timestamp
+    iot_per_second = defaultdict(lambda: {"volume": [], "vibration": []})
+
+    for entry in iot_data:
+        try:
+            ts = datetime.fromisoformat(entry["timestamp"].replace("Z", "+00:00")).astimezone(timezone.utc)
+            second_offset = int((ts - first_ts).total_seconds())
+            iot_per_second[second_offset]["volume"].append(entry["room_noise (db)"])
+            iot_per_second[second_offset]["vibration"].append(entry["vibration_level"])
+        except Exception as e:
+            log.debug("Skipping malformed timestamp: %s (%s)", entry.get("timestamp"), e)
+
+    # Use ML seconds as baseline
+    ml_per_second = ml_data.get("per_second_hits", {})
+    ml_seconds = sorted(int(s) for s in ml_per_second)
+
+    for sec in ml_seconds:
+        hits = ml_per_second.get(str(sec), {})
+        volume_list = iot_per_second.get(sec, {}).get("volume", [])
+        vibration_list = iot_per_second.get(sec, {}).get("vibration", [])
+
+        avg_volume = sum(volume_list) / len(volume_list) if volume_list else None
+        avg_vibration = sum(vibration_list) / len(vibration_list) if vibration_list else None
+
+        warning = None
+        if (avg_volume and avg_volume > WARN_THRESHOLD) or (avg_vibration and avg_vibration > WARN_THRESHOLD):
+            warn_parts = []
+            if avg_volume and avg_volume > WARN_THRESHOLD:
+                warn_parts.append(f"Volume ({avg_volume:.1f}db)")
+            if avg_vibration and avg_vibration > WARN_THRESHOLD:
+                warn_parts.append(f"Vibration ({avg_vibration:.1f})")
+            warning = "Warning: " + " and ".join(warn_parts)
+            if hits:
+                most_hit = max(hits.items(), key=lambda x: x[1])[0]
+                warning += f", you were hitting '{most_hit}' the most."
+
+        combined_result[sec] = {
+            "volume": avg_volume,
+            "vibration": avg_vibration,
+            "hits": hits,
+            "warning": warning
+        }
+
+    return combined_result
+
+
+# --------------------- Vectorised implementation --------------------
+
+def _iot_columns(iot_data):
+    """Return (second offsets, volume, vibration) arrays, or None.
+
+    None means the fast path cannot reproduce the reference semantics
+    exactly (a timestamp without an explicit UTC marker, or anything that
+    does not parse cleanly) and the caller should fall back.
+    """
+    try:
+        stamps = [e["timestamp"] for e in iot_data]
+        volume = np.array([e["room_noise (db)"] for e in iot_data], dtype=np.float64)
+        vibration = np.array([e["vibration_level"] for e in iot_data], dtype=np.float64)
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not all(isinstance(ts, str) for ts in stamps):
+        return None
+
+    # strip the UTC marker; numpy parses naive ISO strings much faster
+    utc = [ts[:-1] for ts in stamps if ts[-1:] == "Z"]
+    if len(utc) != len(stamps):
+        utc = []
+        for ts in stamps:
+            if not ts.endswith(UTC_SUFFIXES):
+                return None
+            utc.append(ts[:-1] if ts.endswith("Z") else ts[:-6])
+    try:
+        micros = np.array(utc, dtype="datetime64[us]").astype(np.int64)
+    except ValueError:
+        return None
+
+    # int((ts - first).total_seconds()) truncates toward zero
+    delta = micros - micros[0]
+    seconds = np.where(delta >= 0, delta // 1_000_000, -(-delta // 1_000_000))
+    return seconds, volume, vibration
+
+
+def _per_second_means(seconds, values, wanted):
+    """Mean of *values* grouped by *seconds*, evaluated at *wanted* (NaN if none)."""
+    lo, hi = int(seconds.min()), int(seconds.max())
+    if hi - lo <= max(4 * len(seconds), 1 << 16):
+        idx = seconds - lo
+        counts = np.bincount(idx)
+        sums = np.bincount(idx, weights=values)
+        pos = wanted - lo
+        valid = (pos >= 0) & (pos < len(counts))
+        pos = np.where(valid, pos, 0)
+    else:
+        # sparse span (e.g. an outlier timestamp): group via sorting instead
+        keys, inverse = np.unique(seconds, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=values)
+        pos = np.searchsorted(keys, wanted)
+        valid = pos < len(keys)
+        pos = np.where(valid, pos, 0)
+        valid &= keys[pos] == wanted
+
+    has = valid & (counts[pos] > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(has, sums[pos] / np.maximum(counts[pos], 1), np.nan)
+    return means
+
+
+def combine_and_analyze(iot_data, ml_data):
+    """Vectorised equivalent of combine_and_analyze_py()."""
+    if not iot_data:
+        log.info("No IoT data to analyze.")
+        return {}
+
+    columns = _iot_columns(iot_data)
+    if columns is None:
+        return combine_and_analyze_py(iot_data, ml_data)
+    seconds, volume, vibration = columns
+
+    # Use ML seconds as baseline
+    ml_per_second = ml_data.get("per_second_hits", {})
+    ml_seconds = np.array(sorted(int(s) for s in ml_per_second), dtype=np.int64)
+    if not len(ml_seconds):
+        return {}
+
+    avg_volume = _per_second_means(seconds, volume, ml_seconds)
+    avg_vibration = _per_second_means(seconds, vibration, ml_seconds)
+    loud = avg_volume > WARN_THRESHOLD          # NaN compares False
+    shaky = avg_vibration > WARN_THRESHOLD
+
+    combined_result = {}
+    for i, sec in enumerate(ml_seconds.tolist()):
+        hits = ml_per_second.get(str(sec), {})
+        vol = None if np.isnan(avg_volume[i]) else float(avg_volume[i])
+        vib = None if np.isnan(avg_vibration[i]) else float(avg_vibration[i])
+
+        warning = None
+        if loud[i] or shaky[i]:
+            warn_parts = []
+            if loud[i]:
+                warn_parts.append(f"Volume ({vol:.1f}db)")
+            if shaky[i]:
+                warn_parts.append(f"Vibration ({vib:.1f})")
+            warning = "Warning: " + " and ".join(warn_parts)
+            if hits:
+                most_hit = max(hits.items(), key=lambda x: x[1])[0]
+                warning += f", you were hitting '{most_hit}' the most."
+
+        combined_result[sec] = {
+            "volume": vol,
+            "vibration": vib,
+            "hits": hits,
+            "warning": warning
+        }
+
+    return combined_result
+
+
+# --------------------- Per-minute summary --------------------
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def summarize_minutes(combined_result):
+    """Per-minute aggregates of a combined result, in minute order.
+
+    `first_index` is the position of the minute's first second in the
+    result, so pages over seconds can link to it.
+    """
+    minutes = {}
+    for index, (sec, row) in enumerate(combined_result.items()):
+        minute = int(sec) // 60
+        acc = minutes.get(minute)
+        if acc is None:
+            acc = minutes[minute] = {"first_index": index, "seconds": 0, "volume": [],
+                                     "vibration": [], "hits": defaultdict(int), "warnings": 0}
+        acc["seconds"] += 1
+        if row["volume"] is not None:
+            acc["volume"].append(row["volume"])
+        if row["vibration"] is not None:
+            acc["vibration"].append(row["vibration"])
+        for drum, count in row["hits"].items():
+            acc["hits"][drum] += count
+        if row["warning"]:
+            acc["warnings"] += 1
+
+    return [
+        {
+            "minute": minute,
+            "first_index": acc["first_index"],
+            "seconds": acc["seconds"],
+            "avg_volume": _mean(acc["volume"]),
+            "max_volume": max(acc["volume"], default=None),
+            "avg_vibration": _mean(acc["vibration"]),
+            "max_vibration": max(acc["vibration"], default=None),
+            "hits": dict(acc["hits"]),
+            "warnings": acc["warnings"],
+        }
+        for minute, acc in sorted(minutes.items())
+    ]
@@ -1,166 +1,54 @@
-from flask import Flask, request, render_template, make_response
-import os
-from google.cloud import storage
-import threading
-import time
-from btpeer import BTPeer
-import base64
-from datetime import datetime, timezone
-from collections import defaultdict
-from bt_utils import init_dht, direct_router_factory, request_ml, request_iot, bc_store, bc_fetch, find_peer_for_service
+from flask import Flask, Request, Response, request, render_template, make_response, jsonify, stream_with_context
 import json
 import uuid
-import socket
-import random
-from handlers import ml_handlers, iot_handlers
+from werkzeug.utils import secure_filename
+from blob_transport import get_blob_transport
+from webapp.jobs import Job, QueueFull, STORED, TERMINAL_STATES, current_job_manager, get_job_manager
+from webapp.results import load_result, load_summary, load_window
+
+# seconds between SSE keep-alive comments while a job is quiet
+SSE_KEEPALIVE = 15
+# seconds of a result per page / per API call
+RESULTS_PAGE_SIZE = 300
+MAX_PAGE_LIMIT = 3600
+# template statements rendered between flushes of a streamed page
+RENDER_BUFFER = 50
+
+
+class StreamingUploadRequest(Request):
+    """Request whose uploaded files stream straight into the upload store.
+
+    werkzeug normally spools uploads to memory or a temp file; here each
+    chunk is forwarded to the store as it is parsed off the socket, so the
+    upload to storage overlaps the HTTP receive. Only the p2p blob transport
+    keeps uploads on local disk, since it serves them to ML peers directly.
+
+    A view commits the uploads it keeps with `close()`; every other writer
+    (other file fields, or a body whose parse was cut short) is discarded
+    when the request ends, see discard_uploads().
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        name = f"{uuid.uuid4().hex}-{secure_filename(filename or 'upload')}"
+        writer = get_blob_transport().store.open_writer(name)
+        self.__dict__.setdefault("_upload_writers", []).append(writer)
+        return writer
+
+    def discard_uploads(self) -> None:
+        """Discard the uploads of this request that were not committed."""
+        for writer in self.__dict__.pop("_upload_writers", []):
+            if not writer.closed:
+                writer.discard()
 
-app = Flask(__name__)
-BUCKET_NAME = "drum-videos"
-
-def get_available_port(max_port=20000, attempts=100):
-    for _ in range(attempts):
-        port = random.randint(1024, max_port)
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.bind(('', port))
-                s.listen(1)
-                print(f"[DEBUG] Allocated port: {port}")
-                return port
-            except OSError:
-                continue
-    raise RuntimeError(f"Could not find a free port under {max_port} after {attempts} attempts.")
-
-# --------------------- Utility to combine ML + IOT --------------------
 
-def combine_and_analyze(iot_data, ml_data):
-    combined_result = {}
+app = Flask(__name__)
+app.request_class = StreamingUploadRequest
 
-    # Infer base time from FIRST IoT timestamp
-    if not iot_data:
-        print("No IoT data to analyze.")
-        return {}
 
-    try:
-        first_ts = datetime.fromisoformat(iot_data[0]["timestamp"].replace("Z", "+00:00")).astimezone(timezone.utc)
-    except Exception as e:
-        print(f"Failed to parse first IoT timestamp: {e}")
-        return {}
-
-    #Group IoT data by second offset from first timestamp
-    iot_per_second = defaultdict(lambda: {"volume": [], "vibration": []})
-
-    for entry in iot_data:
-        try:
-            ts = datetime.fromisoformat(entry["timestamp"].replace("Z", "+00:00")).astimezone(timezone.utc)
-            second_offset = int((ts - first_ts).total_seconds())
-            iot_per_second[second_offset]["volume"].append(entry["room_noise (db)"])
-            iot_per_second[second_offset]["vibration"].append(entry["vibration_level"])
-        except Exception as e:
-            print(f"Skipping malformed timestamp: {entry['timestamp']} ({e})")
-
-    # Use ML seconds as baseline
-    ml_per_second = ml_data.get("per_second_hits", {})
-    ml_seconds = sorted(int(s) for s in ml_per_second)
-
-    for sec in ml_seconds:
-        hits = ml_per_second.get(str(sec), {})
-        volume_list = iot_per_second.get(sec, {}).get("volume", [])
-        vibration_list = iot_per_second.get(sec, {}).get("vibration", [])
-
-        avg_volume = sum(volume_list) / len(volume_list) if volume_list else None
-        avg_vibration = sum(vibration_list) / len(vibration_list) if vibration_list else None
-
-        warning = None
-        if (avg_volume and avg_volume > 70) or (avg_vibration and avg_vibration > 70):
-            warn_parts = []
-            if avg_volume and avg_volume > 70:
-                warn_parts.append(f"Volume ({avg_volume:.1f}db)")
-            if avg_vibration and avg_vibration > 70:
-                warn_parts.append(f"Vibration ({avg_vibration:.1f})")
-            warning = "Warning: " + " and ".join(warn_parts)
-            if hits:
-                most_hit = max(hits.items(), key=lambda x: x[1])[0]
-                warning += f", you were hitting '{most_hit}' the most."
-
-        combined_result[sec] = {
-            "volume": avg_volume,
-            "vibration": avg_vibration,
-            "hits": hits,
-            "warning": warning
-        }
-
-    return combined_result
-
-def start_peer(start_time, end_time, video_path, result_id):
-    peer_port = get_available_port()
-    peer_type = random.choice(["BC", "IOT", "ML"])
-    peer = BTPeer(maxpeers=5, serverport=peer_port, peertype=peer_type)
-
-    # Initialize Kademlia DHT and router
-    kad, loop = init_dht(peer)
-    peer.add_router(direct_router_factory(peer, kad, loop))
-
-    if peer.peertype == "BC":
-        from handlers import bc_handlers as _bc
-        peer.add_handler("BCRQ", lambda conn, msg: _bc.bc_request_handler(peer, conn, msg))
-        peer.add_handler("BCRS", lambda conn, msg: _bc.bc_response_handler(peer, msg))
-
-    if peer.peertype == "IOT":
-        peer.add_handler("IORQ", lambda conn, msgdata: iot_handlers.iot_request_handler(peer, conn, msgdata))
-        threading.Thread(target=iot_handlers.start_aws_iot_listener, daemon=True).start()
-
-    if peer.peertype == "ML":
-        peer.add_handler("MLRQ", lambda conn, msgdata: ml_handlers.ml_request_handler(peer, conn, msgdata))
-
-    def run():
-        t = threading.Thread(target=peer.mainloop, daemon=True)
-        t.start()
-
-        # Upload video to GCS
-        # video_url = upload_video_to_bucket(BUCKET_NAME, video_path)
-
-        # --- Request ML ---
-        try:
-            ml_data = request_ml(peer, kad, loop, BUCKET_NAME, video_path)
-            print("[WEB PEER] ML Results:", ml_data)
-        except Exception as e:
-            print(f"[WEB PEER] ML request failed: {e}")
-            return
-
-        # --- Request IoT ---
-        try:
-            iot_data = request_iot(peer, kad, loop, start_time, end_time)
-            print("[WEB PEER] IoT Results:", iot_data)
-        except Exception as e:
-            print(f"[WEB PEER] IoT request failed: {e}")
-            return
-
-        # --- Combine and Analyze ---
-        if ml_data and iot_data:
-            combined_data = combine_and_analyze(iot_data, ml_data)
-
-            os.makedirs("results", exist_ok=True)
-            with open(f"results/{result_id}.json", "w") as f:
-                json.dump(combined_data, f, indent=2)
-            print(f"Combined results saved to results/{result_id}.json")
-
-            # --- Store in Blockchain ---
-            try:
-                bc_result = bc_store(peer, kad, loop, combined_data)
-                print("[WEB PEER] Blockchain response:", bc_result)
-            except Exception as e:
-                print(f"[WEB PEER] Blockchain store failed: {e}")
-
-            try:
-                bc_chain = bc_fetch(peer, kad, loop)
-                print("[WEB PEER] Blockchain fetch:", bc_chain)
-            except Exception as e:
-                print(f"[WEB PEER] Blockchain fetch failed: {e}")
-
-        peer.shutdown = True
-        loop.call_soon_threadsafe(loop.stop)
-
-    threading.Thread(target=run).start()
+@app.teardown_request
+def _discard_uploads(exc):
+    # runs before Request.close(), which would otherwise commit them
+    request.discard_uploads()
 
 # --------------------- Web Routes --------------------
 @app.route("/")
@@ -174,33 +62,132 @@ def submit():
     video = request.files.get("video")
 
     if not (start_time and end_time and video):
-        return "Missing fields", 400
+        return "Missing fields", 400            # the uploads are discarded on teardown
 
-    save_path = os.path.join("uploads", video.filename)
-    os.makedirs("uploads", exist_ok=True)
-    video.save(save_path)
+    # finish the streamed upload (commits the object in the store)
+    video.stream.close()
 
     result_id = str(uuid.uuid4())
-    start_peer(start_time, end_time, save_path, result_id)
-
-    resp = make_response(render_template("submitted.html"))
+    try:
+        get_job_manager().submit(Job(result_id, start_time, end_time, video.stream.name))
+    except QueueFull:
+        video.stream.discard()
+        return "Too many sessions are being analysed. Please try again shortly.", 503
+    except ConnectionError:
+        video.stream.discard()
+        return "The analysis service is unavailable. Please try again shortly.", 503
+
+    resp = make_response(render_template("submitted.html", result_id=result_id))
     resp.set_cookie("result_id", result_id)
     return resp
 
+def _job_status(result_id):
+    """Status dict for *result_id*, or None if it is unknown."""
+    manager = current_job_manager()
+    status = manager.status(result_id) if manager else None
+    if status is not None:
+        return status
+    if load_result(result_id) is not None:
+        # finished before this process started (or evicted from the registry)
+        return {"result_id": result_id, "state": STORED, "error": None,
+                "bc_status": "unknown", "version": 0, "updated_at": None}
+    return None
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/api/jobs/<result_id>")
+def job_status(result_id):
+    status = _job_status(result_id)
+    if status is None:
+        return jsonify({"error": "unknown result id"}), 404
+    return jsonify(status)
+
+@app.route("/events/<result_id>")
+def job_events(result_id):
+    """Server-Sent Events: `progress` on every state change, then `result`."""
+    def stream():
+        manager = current_job_manager()
+        seen = -1
+        while True:
+            snap = manager.wait_for_change(result_id, seen, SSE_KEEPALIVE) if manager else None
+            if snap is None:
+                status = _job_status(result_id)
+                if status is None:
+                    yield _sse("failed", {"result_id": result_id, "error": "unknown result id"})
+                else:
+                    yield _sse("progress", status)
+                    yield _sse("result", load_result(result_id))
+                return
+            if snap["version"] == seen:
+                yield ": keep-alive\n\n"
+                continue
+            seen = snap["version"]
+            yield _sse("progress", snap)
+            if snap["state"] in TERMINAL_STATES:
+                if snap["state"] == STORED:
+                    yield _sse("result", load_result(result_id))
+                else:
+                    yield _sse("failed", snap)
+                return
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _page_args():
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", RESULTS_PAGE_SIZE, type=int), 1), MAX_PAGE_LIMIT)
+    return offset, limit
+
+def _stream_template(name, **context):
+    """Render *name* incrementally, so the first bytes leave before the last row is rendered."""
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(RENDER_BUFFER)
+    return Response(stream_with_context(stream), mimetype="text/html")
+
+@app.route("/api/results/<result_id>")
+def result_window(result_id):
+    """Seconds [offset, offset + limit) of a finished result."""
+    offset, limit = _page_args()
+    window = load_window(result_id, offset, limit)
+    if window is None:
+        return jsonify({"error": "unknown result id"}), 404
+    total, rows = window
+    return jsonify({
+        "result_id": result_id,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "seconds": [{"second": int(sec), **row} for sec, row in rows],
+    })
+
+@app.route("/api/results/<result_id>/summary")
+def result_summary(result_id):
+    summary = load_summary(result_id)
+    if summary is None:
+        return jsonify({"error": "unknown result id"}), 404
+    return jsonify({"result_id": result_id, "minutes": summary})
+
 @app.route("/results")
 def results():
     result_id = request.cookies.get("result_id")
     if not result_id:
         return "No result ID found. Please upload a session first."
 
-    result_path = f"results/{result_id}.json"
-    if not os.path.exists(result_path):
-        return "Results not ready yet. Please wait and refresh."
-
-    with open(result_path, "r") as f:
-        combined_data = json.load(f)
+    offset, limit = _page_args()
+    window = load_window(result_id, offset, limit)
+    if window is None:
+        if _job_status(result_id) is None:
+            return "No such session. Please upload it again."
+        return render_template("submitted.html", result_id=result_id)
 
-    return render_template("results.html", results=combined_data)
+    total, rows = window
+    return _stream_template("results.html", rows=rows, summary=load_summary(result_id),
+                            total=total, offset=offset, limit=limit)
 
 if __name__ == "__main__":
+    # development server; for production use: gunicorn -c webapp/gunicorn.conf.py
+    from logconfig import setup_logging
+    setup_logging()
     app.run(debug=True)
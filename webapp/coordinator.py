@@ -0,0 +1,153 @@
+"""
+coordinator.py – one process owning the web peer and the job queue, shared
+by every HTTP worker.
+
+Under gunicorn each HTTP worker is its own process, but there must be only
+one WEB peer, one Kademlia node and one job queue. The coordinator runs
+those (an ordinary JobManager) and serves the workers over a Unix socket;
+CoordinatorClient gives the workers the same submit / status /
+wait_for_change interface as an in-process JobManager.
+
+Protocol: one JSON object per line in each direction.
+  {"op": "submit", "job": {...}}                       → {"ok": true} | {"ok": false, "error": "queue-full"}
+  {"op": "status", "result_id": id}                    → {"ok": true, "job": {...} | null}
+  {"op": "wait", "result_id": id, "seen": n, "timeout": s} → {"ok": true, "job": {...} | null}
+
+Run:  python -m webapp.coordinator --socket /tmp/web.sock
+(webapp/gunicorn.conf.py starts and stops it together with gunicorn.)
+
+Environment:
+- WEB_COORDINATOR_SOCKET  socket path; when set in an HTTP worker, jobs go to
+                          the coordinator instead of an in-process JobManager
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+from logconfig import setup_logging
+from webapp.jobs import Job, QueueFull, start_job_manager
+
+log = logging.getLogger(__name__)
+
+QUEUE_FULL = "queue-full"
+
+
+# --------------------- Server (coordinator process) --------------------
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        manager = self.server.manager
+        for line in self.rfile:
+            msg = json.loads(line)
+            op = msg.get("op")
+            if op == "submit":
+                fields = msg["job"]
+                job = Job(fields["result_id"], fields["start_time"], fields["end_time"], fields["video_object"])
+                try:
+                    manager.submit(job)
+                    reply = {"ok": True}
+                except QueueFull:
+                    reply = {"ok": False, "error": QUEUE_FULL}
+            elif op == "status":
+                reply = {"ok": True, "job": manager.status(msg["result_id"])}
+            elif op == "wait":
+                snap = manager.wait_for_change(msg["result_id"], msg["seen"], msg["timeout"])
+                reply = {"ok": True, "job": snap}
+            else:
+                reply = {"ok": False, "error": f"unknown op {op!r}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class CoordinatorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, manager):
+        if os.path.exists(path):
+            os.remove(path)
+        self.manager = manager
+        super().__init__(path, _Handler)
+
+
+def serve(path: str) -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # so the socket file is removed
+    manager = start_job_manager()
+    with CoordinatorServer(path, manager) as server:
+        log.info("Serving jobs on %s", path)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+
+# --------------------- Client (HTTP worker processes) --------------------
+class CoordinatorClient:
+    """JobManager look-alike that forwards to the coordinator process.
+
+    Each thread keeps its own connection, so a long wait_for_change (SSE)
+    does not hold up other requests in the same worker.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock, sock.makefile("rb")
+
+    def _call(self, msg: dict) -> dict:
+        data = json.dumps(msg).encode() + b"\n"
+        conn = getattr(self._local, "conn", None)
+        reused = conn is not None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._local.conn = self._connect()
+                sock, rfile = conn
+                sock.sendall(data)
+                line = rfile.readline()
+                if line:
+                    return json.loads(line)
+                err = ConnectionError("Coordinator closed the connection")
+            except OSError as e:
+                err = e
+            if conn is not None:
+                conn[0].close()
+            conn = self._local.conn = None
+            if not reused:
+                raise ConnectionError(f"Job coordinator unavailable at {self.path}: {err}")
+            reused = False              # a stale kept-alive connection: retry once on a new one
+
+    def submit(self, job: Job) -> None:
+        reply = self._call({"op": "submit", "job": {
+            "result_id": job.result_id,
+            "start_time": job.start_time,
+            "end_time": job.end_time,
+            "video_object": job.video_object,
+        }})
+        if not reply["ok"]:
+            if reply.get("error") == QUEUE_FULL:
+                raise QueueFull
+            raise RuntimeError(reply.get("error"))
+
+    def status(self, result_id: str) -> dict | None:
+        return self._call({"op": "status", "result_id": result_id})["job"]
+
+    def wait_for_change(self, result_id: str, seen_version: int, timeout: float) -> dict | None:
+        return self._call({"op": "wait", "result_id": result_id,
+                           "seen": seen_version, "timeout": timeout})["job"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Web app job coordinator")
+    parser.add_argument("--socket", default=os.getenv("WEB_COORDINATOR_SOCKET"),
+                        required=not os.getenv("WEB_COORDINATOR_SOCKET"))
+    setup_logging()
+    serve(parser.parse_args().socket)
@@ -0,0 +1,63 @@
+"""
+gunicorn.conf.py – production serving for the web app.
+
+    gunicorn -c webapp/gunicorn.conf.py        (from the repository root)
+
+The gunicorn master starts one coordinator process (webapp.coordinator)
+that owns the WEB peer, the DHT client and the job queue, and points the
+HTTP workers at it through WEB_COORDINATOR_SOCKET. Workers are threaded so
+long-lived Server-Sent Events streams do not block uploads.
+
+Environment:
+- WEB_BIND          listen address (default 0.0.0.0:8000)
+- WEB_HTTP_WORKERS  HTTP worker processes (default 2 × CPUs + 1)
+- WEB_HTTP_THREADS  threads per worker (default 8)
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+wsgi_app = "webapp.app:app"
+bind = os.getenv("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_HTTP_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_HTTP_THREADS", 8))
+timeout = 120                     # video uploads stream through the worker
+graceful_timeout = 30
+
+COORDINATOR_START_TIMEOUT = 60    # DHT bootstrap happens before the socket opens
+
+_coordinator: subprocess.Popen | None = None
+
+
+def on_starting(server):
+    global _coordinator
+    path = os.getenv("WEB_COORDINATOR_SOCKET") or os.path.join(
+        tempfile.gettempdir(), f"drum-web-coordinator-{os.getpid()}.sock")
+    os.environ["WEB_COORDINATOR_SOCKET"] = path     # inherited by the workers
+    if os.path.exists(path):
+        os.remove(path)                             # stale socket from an earlier run
+    _coordinator = subprocess.Popen([sys.executable, "-m", "webapp.coordinator", "--socket", path])
+
+    deadline = time.monotonic() + COORDINATOR_START_TIMEOUT
+    while not os.path.exists(path):
+        if _coordinator.poll() is not None:
+            raise RuntimeError(f"Job coordinator exited with code {_coordinator.returncode}")
+        if time.monotonic() > deadline:
+            _coordinator.terminate()
+            raise RuntimeError("Job coordinator did not start in time")
+        time.sleep(0.1)
+    server.log.info("Job coordinator (pid %s) listening on %s", _coordinator.pid, path)
+
+
+def on_exit(server):
+    if _coordinator is not None and _coordinator.poll() is None:
+        _coordinator.terminate()
+        try:
+            _coordinator.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _coordinator.kill()
@@ -0,0 +1,325 @@
+"""
+jobs.py – the web app's long-lived peer and its analysis worker pool.
+
+One WEB peer (and one Kademlia node) is created per process, on first use.
+Uploaded sessions are queued as jobs and processed by a fixed number of
+worker threads; when the queue is full, submit() raises QueueFull so the
+route can answer 503 instead of piling up threads. Job progress is tracked
+in a JobRegistry that status endpoints can poll or block on.
+
+With several HTTP worker processes (gunicorn), only the coordinator process
+runs a JobManager; workers reach it through webapp.coordinator (see
+get_job_manager).
+
+Environment:
+- WEB_PEER_PORT   port of the web peer (default: a free random port)
+- WEB_WORKERS     analysis worker threads (default 4)
+- WEB_QUEUE_SIZE  jobs waiting beyond the running ones (default 16)
+- WEB_COORDINATOR_SOCKET  hand jobs to a coordinator process on this socket
+- METRICS_PORT    serve Prometheus metrics of the process running the jobs
+
+Every peer request a job makes carries the job's result id as its trace id.
+"""
+
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import metrics
+from btpeer import BTPeer, tracing
+from blob_transport import get_blob_transport
+from bt_utils import init_dht, direct_router_factory, request_ml, request_iot
+from handlers.bc_api import BCClient
+from webapp.analysis import combine_and_analyze
+from webapp.results import save_result
+
+log = logging.getLogger(__name__)
+
+MAX_TRACKED_JOBS = 1000
+
+QueueFull = queue.Full
+
+
+def get_available_port(max_port=20000, attempts=100):
+    for _ in range(attempts):
+        port = random.randint(1024, max_port)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(('', port))
+                s.listen(1)
+                log.debug("Allocated port: %d", port)
+                return port
+            except OSError:
+                continue
+    raise RuntimeError(f"Could not find a free port under {max_port} after {attempts} attempts.")
+
+
+# --------------------- Long-lived web peer --------------------
+class WebPeer:
+    """The process-wide WEB peer with its DHT client and BC client."""
+
+    def __init__(self, port: int | None = None):
+        port = port or int(os.getenv("WEB_PEER_PORT", 0)) or get_available_port()
+        self.peer = BTPeer(maxpeers=50, serverport=port, peertype="WEB")
+        # accept replies right away; the DHT bootstrap is the slow part
+        threading.Thread(target=self.peer.mainloop, daemon=True).start()
+        self.kad, self.loop = init_dht(self.peer)
+        self.peer.add_router(direct_router_factory(self.peer, self.kad, self.loop))
+        self.bc = BCClient(self.peer, self.kad, self.loop)
+        # side requests (IoT queries, blockchain writes) run here so the job
+        # worker can overlap them with the ML request
+        self.io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="web-io")
+        metrics_port = os.getenv("METRICS_PORT")
+        if metrics_port:
+            # "auto": peer port + 20000, as for peer.py
+            metrics.serve(port + 20000 if metrics_port == "auto" else int(metrics_port))
+
+    def close(self) -> None:
+        self.io_pool.shutdown(wait=False)
+        self.peer.shutdown = True
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# job states, in the order a successful job passes through them
+QUEUED = "queued"
+ML_RUNNING = "ml-running"         # ML request (and IoT query) in flight
+IOT_DONE = "iot-done"             # IoT data in hand, waiting for / combining ML
+STORED = "stored"                 # result saved; see bc_status for the chain copy
+FAILED = "failed"
+TERMINAL_STATES = (STORED, FAILED)
+
+
+@dataclass
+class Job:
+    result_id: str
+    start_time: str
+    end_time: str
+    video_object: str                 # object name in the blob transport's store
+    state: str = QUEUED
+    error: str | None = None
+    bc_status: str = "not-started"    # → pending → stored | failed
+    version: int = 0                  # bumped on every change
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return {
+            "result_id": self.result_id,
+            "state": self.state,
+            "error": self.error,
+            "bc_status": self.bc_status,
+            "version": self.version,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobRegistry:
+    """Recent jobs by result id, with change notification for watchers."""
+
+    def __init__(self, capacity: int = MAX_TRACKED_JOBS):
+        self.capacity = capacity
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._changed = threading.Condition()
+
+    def add(self, job: Job) -> None:
+        with self._changed:
+            self._jobs[job.result_id] = job
+            while len(self._jobs) > self.capacity:
+                self._jobs.popitem(last=False)
+
+    def discard(self, job: Job) -> None:
+        with self._changed:
+            self._jobs.pop(job.result_id, None)
+
+    def get(self, result_id: str) -> Job | None:
+        with self._changed:
+            return self._jobs.get(result_id)
+
+    def update(self, job: Job, *, expect_state: str | None = None, **changes) -> bool:
+        """Apply *changes* to *job* and wake watchers.
+
+        With *expect_state*, the update only happens if the job is still in
+        that state (so racing updates cannot move a job backwards).
+        """
+        with self._changed:
+            if expect_state is not None and job.state != expect_state:
+                return False
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            job.updated_at = time.time()
+            self._changed.notify_all()
+            return True
+
+    def wait_for_change(self, result_id: str, seen_version: int, timeout: float) -> dict | None:
+        """Block until the job's version exceeds *seen_version* (or timeout).
+
+        Returns a snapshot of the job, or None if the job is unknown.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(result_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if job.version > seen_version or remaining <= 0:
+                    return job.to_dict()
+                self._changed.wait(remaining)
+
+
+def _traced(job: Job, fn, *args):
+    """Run fn(*args) with *job*'s trace id (for io_pool threads)."""
+    with tracing(job.result_id):
+        return fn(*args)
+
+
+def _store_on_chain(web: WebPeer, registry: JobRegistry, job: Job, combined_data: dict) -> None:
+    try:
+        web.bc.store(combined_data, key=job.result_id)
+        registry.update(job, bc_status="stored")
+        log.info("Blockchain store done for %s", job.result_id)
+    except Exception as e:
+        registry.update(job, bc_status="failed")
+        log.warning("Blockchain store failed for %s: %s", job.result_id, e)
+
+
+def run_analysis(web: WebPeer, registry: JobRegistry, job: Job) -> None:
+    """Fetch ML and IoT results for *job*, combine them and store the result.
+
+    The IoT query runs while the ML request is in flight, and the blockchain
+    write is handed off without waiting for it (see Job.bc_status), so the
+    result is ready as soon as the slowest of ML and IoT returns.
+    """
+    peer, kad, loop = web.peer, web.kad, web.loop
+    registry.update(job, state=ML_RUNNING)
+
+    def _iot_finished(future):
+        if not future.cancelled() and future.exception() is None:
+            registry.update(job, expect_state=ML_RUNNING, state=IOT_DONE)
+
+    iot_future = web.io_pool.submit(_traced, job, request_iot, peer, kad, loop, job.start_time, job.end_time)
+    iot_future.add_done_callback(_iot_finished)
+
+    # --- Request ML ---
+    try:
+        ml_data = request_ml(peer, kad, loop, get_blob_transport(), job.video_object, key=job.result_id)
+        log.debug("ML results: %s", ml_data)
+    except Exception as e:
+        log.warning("ML request failed for %s: %s", job.result_id, e)
+        iot_future.cancel()
+        registry.update(job, state=FAILED, error=f"ML request failed: {e}")
+        return
+
+    # --- Request IoT ---
+    try:
+        iot_data = iot_future.result()
+        log.debug("IoT results: %s", iot_data)
+    except Exception as e:
+        log.warning("IoT request failed for %s: %s", job.result_id, e)
+        registry.update(job, state=FAILED, error=f"IoT request failed: {e}")
+        return
+
+    if not (ml_data and iot_data):
+        registry.update(job, state=FAILED, error="No ML or IoT data for this session")
+        return
+
+    # --- Combine and Analyze ---
+    registry.update(job, expect_state=ML_RUNNING, state=IOT_DONE)
+    combined_data = combine_and_analyze(iot_data, ml_data)
+    save_result(job.result_id, combined_data)
+    log.info("Combined results saved for %s", job.result_id)
+
+    # --- Store in Blockchain (fire-and-forget) ---
+    registry.update(job, state=STORED, bc_status="pending")
+    web.io_pool.submit(_traced, job, _store_on_chain, web, registry, job, combined_data)
+
+
+# --------------------- Bounded worker pool --------------------
+class JobManager:
+    """Bounded job queue drained by a fixed pool of worker threads."""
+
+    def __init__(self, web: WebPeer, workers: int = 4, max_queued: int = 16):
+        self.web = web
+        self.jobs: queue.Queue[Job] = queue.Queue(maxsize=max_queued)
+        self.registry = JobRegistry()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, job: Job) -> None:
+        """Queue *job*; raises QueueFull if the backlog is at capacity."""
+        self.registry.add(job)
+        try:
+            self.jobs.put_nowait(job)
+        except QueueFull:
+            self.registry.discard(job)
+            raise
+
+    def get(self, result_id: str) -> Job | None:
+        return self.registry.get(result_id)
+
+    def status(self, result_id: str) -> dict | None:
+        job = self.registry.get(result_id)
+        return job.to_dict() if job is not None else None
+
+    def wait_for_change(self, result_id: str, seen_version: int, timeout: float) -> dict | None:
+        return self.registry.wait_for_change(result_id, seen_version, timeout)
+
+    def _worker(self) -> None:
+        while True:
+            job = self.jobs.get()
+            try:
+                with tracing(job.result_id):
+                    run_analysis(self.web, self.registry, job)
+            except Exception as e:
+                log.exception("Job %s crashed", job.result_id)
+                self.registry.update(job, state=FAILED, error=str(e))
+            finally:
+                self.jobs.task_done()
+
+
+_manager = None                   # JobManager, or CoordinatorClient in HTTP workers
+_manager_lock = threading.Lock()
+
+
+def start_job_manager() -> JobManager:
+    """Start this process's web peer and an in-process JobManager."""
+    return JobManager(
+        WebPeer(),
+        workers=int(os.getenv("WEB_WORKERS", 4)),
+        max_queued=int(os.getenv("WEB_QUEUE_SIZE", 16)),
+    )
+
+
+def get_job_manager():
+    """Return the process-wide job manager, starting it on first use.
+
+    With WEB_COORDINATOR_SOCKET set this is a client of the coordinator
+    process; otherwise the web peer and workers run in this process.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            path = os.getenv("WEB_COORDINATOR_SOCKET")
+            if path:
+                from webapp.coordinator import CoordinatorClient
+                _manager = CoordinatorClient(path)
+            else:
+                _manager = start_job_manager()
+        return _manager
+
+
+def current_job_manager():
+    """Return the job manager if it has been started, without starting it.
+
+    A coordinator client is cheap, so it is always available.
+    """
+    if _manager is None and os.getenv("WEB_COORDINATOR_SOCKET"):
+        return get_job_manager()
+    return _manager
@@ -0,0 +1,212 @@
+"""
+results.py – storage for finished analysis results.
+
+Results live in one SQLite database (results/results.db by default):
+
+- results         one row per session: result id, number of seconds and the
+                  per-minute summary computed when the result was saved
+- result_seconds  one row per analysed second, keyed by (result_id, idx),
+                  where idx is the second's position in the session
+
+Pages read windows of seconds straight off the primary-key index
+(load_window), so viewing a slice of a long session never loads the rest.
+Whole results are kept in an in-memory LRU cache for repeated full reads.
+
+Results written as results/<result_id>.json by earlier versions are
+imported on first access, or all at once with:
+
+    python -m webapp.results --migrate [--keep]
+
+Environment:
+- RESULTS_DB          database path (default results/results.db)
+- RESULTS_CACHE_SIZE  number of whole results kept in memory (default 128)
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from webapp.analysis import summarize_minutes
+
+RESULTS_DIR = "results"
+DB_PATH = os.getenv("RESULTS_DB", os.path.join(RESULTS_DIR, "results.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    result_id  TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    total      INTEGER NOT NULL,
+    summary    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_seconds (
+    result_id  TEXT NOT NULL,
+    idx        INTEGER NOT NULL,
+    second     INTEGER NOT NULL,
+    volume     REAL,
+    vibration  REAL,
+    hits       TEXT NOT NULL,
+    warning    TEXT,
+    PRIMARY KEY (result_id, idx)
+) WITHOUT ROWID;
+"""
+
+
+class ResultCache:
+    """Thread-safe LRU mapping result_id → combined result."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, result_id: str) -> dict | None:
+        with self._lock:
+            data = self._items.get(result_id)
+            if data is not None:
+                self._items.move_to_end(result_id)
+            return data
+
+    def put(self, result_id: str, data: dict) -> None:
+        with self._lock:
+            self._items[result_id] = data
+            self._items.move_to_end(result_id)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+
+cache = ResultCache(int(os.getenv("RESULTS_CACHE_SIZE", 128)))
+
+# ---- database connection ----
+# one per thread; WAL lets HTTP workers read while the coordinator writes
+_local = threading.local()
+
+
+def _db() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _row(volume, vibration, hits, warning) -> dict:
+    return {"volume": volume, "vibration": vibration, "hits": json.loads(hits), "warning": warning}
+
+
+# ---- writing ----
+def save_result(result_id: str, data: dict) -> None:
+    summary = summarize_minutes(data)
+    rows = [
+        (result_id, idx, int(sec), row["volume"], row["vibration"],
+         json.dumps(row["hits"], separators=(",", ":")), row["warning"])
+        for idx, (sec, row) in enumerate(data.items())
+    ]
+    conn = _db()
+    with conn:
+        conn.execute("DELETE FROM result_seconds WHERE result_id = ?", (result_id,))
+        conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                     (result_id, time.time(), len(rows), json.dumps(summary)))
+        conn.executemany("INSERT INTO result_seconds VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    # cache what a reader would see (seconds come back as str keys)
+    cache.put(result_id, {str(k): v for k, v in data.items()})
+
+
+# ---- migration from JSON files ----
+def _legacy_path(result_id: str, kind: str = "") -> str:
+    return os.path.join(RESULTS_DIR, f"{os.path.basename(result_id)}{kind}.json")
+
+
+def _import_legacy(result_id: str, keep: bool = False) -> bool:
+    """Import results/<result_id>.json if it exists; returns whether it did."""
+    try:
+        with open(_legacy_path(result_id), "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    save_result(result_id, data)
+    if not keep:
+        for kind in ("", ".summary"):
+            try:
+                os.remove(_legacy_path(result_id, kind))
+            except FileNotFoundError:
+                pass                # no summary yet, or another thread imported it too
+    return True
+
+
+def migrate_json_results(keep: bool = False) -> int:
+    """Import every results/<id>.json into the database; returns the count."""
+    count = 0
+    for path in glob.glob(os.path.join(RESULTS_DIR, "*.json")):
+        name = os.path.basename(path)[:-len(".json")]
+        if not name.endswith(".summary") and _import_legacy(name, keep):
+            count += 1
+    return count
+
+
+# ---- reading ----
+def _total(result_id: str) -> int | None:
+    query = "SELECT total FROM results WHERE result_id = ?"
+    row = _db().execute(query, (result_id,)).fetchone()
+    if row is None and _import_legacy(result_id):
+        row = _db().execute(query, (result_id,)).fetchone()
+    return row[0] if row else None
+
+
+def load_result(result_id: str) -> dict | None:
+    """Return the stored result, or None if it does not exist (yet)."""
+    data = cache.get(result_id)
+    if data is not None:
+        return data
+    if _total(result_id) is None:
+        return None
+    rows = _db().execute(
+        "SELECT second, volume, vibration, hits, warning FROM result_seconds "
+        "WHERE result_id = ? ORDER BY idx", (result_id,)).fetchall()
+    # decode all hit maps with one json.loads instead of one per second
+    hits = json.loads("[" + ",".join(r[3] for r in rows) + "]")
+    data = {
+        str(second): {"volume": volume, "vibration": vibration, "hits": h, "warning": warning}
+        for (second, volume, vibration, _, warning), h in zip(rows, hits)
+    }
+    cache.put(result_id, data)
+    return data
+
+
+def load_window(result_id: str, offset: int, limit: int) -> tuple[int, list[tuple[str, dict]]] | None:
+    """Return (total seconds, up to *limit* (second, row) pairs from *offset*)."""
+    total = _total(result_id)
+    if total is None:
+        return None
+    rows = _db().execute(
+        "SELECT second, volume, vibration, hits, warning FROM result_seconds "
+        "WHERE result_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+        (result_id, offset, offset + limit))
+    return total, [(str(second), _row(*rest)) for second, *rest in rows]
+
+
+def load_summary(result_id: str) -> list | None:
+    """Return the per-minute summary computed when the result was saved."""
+    if _total(result_id) is None:
+        return None
+    row = _db().execute("SELECT summary FROM results WHERE result_id = ?", (result_id,)).fetchone()
+    return json.loads(row[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Results store maintenance")
+    parser.add_argument("--migrate", action="store_true", help="import results/*.json into the database")
+    parser.add_argument("--keep", action="store_true", help="keep the JSON files after importing them")
+    args = parser.parse_args()
+    if args.migrate:
+        print(f"Imported {migrate_json_results(args.keep)} results into {DB_PATH}")
+    else:
+        parser.print_help()